@@ -0,0 +1,109 @@
+"""
+Peak memory and time of the loss forward and backward with `ChunkedCrossEntropy`, for several
+chunk sizes, against `F.cross_entropy` on the full [B * T, V] logits.
+
+Every variant runs in a fresh process. On CPU, peak memory is the growth of the peak RSS over
+the RSS before the loss; on CUDA, the growth of the peak allocated memory. It includes the
+gradients of the hidden states and of the `lm_head` weight, which both variants produce. With
+`--eval`, the loss is computed under `torch.no_grad()`, without backward. The numerical parity
+with `F.cross_entropy` is tested in `tests/test_chunked_cross_entropy.py`.
+
+Usage:
+    python -m benchmarks.chunked_cross_entropy --batch-size 4 --seq-len 1024 --vocab-size 50257 --chunk-sizes 512 1024 4096
+"""
+import argparse
+import json
+import statistics
+import time
+from typing import Any, Dict, List, Optional
+
+import torch
+import torch.nn.functional as F
+
+from benchmarks.utils import peak_rss_bytes, rss_bytes, run_worker
+from training.criteria.chunked_cross_entropy import ChunkedCrossEntropy
+
+
+def _inputs(batch_size: int, seq_len: int, d_model: int, vocab_size: int, device: str):
+    torch.manual_seed(0)
+    hidden = torch.randn(batch_size, seq_len, d_model, device=device, requires_grad=True)
+    weight = (torch.randn(vocab_size, d_model, device=device) * 0.02).requires_grad_()
+    labels = torch.randint(0, vocab_size, (batch_size, seq_len), device=device)
+    return hidden, weight, labels
+
+
+def _full_loss(hidden: torch.Tensor, weight: torch.Tensor, labels: torch.Tensor) -> torch.Tensor:
+    return F.cross_entropy((hidden @ weight.T).flatten(0, 1), labels.flatten())
+
+
+def run_variant(chunk_size: int, batch_size: int, seq_len: int, d_model: int, vocab_size: int,
+                steps: int, device: str, eval_mode: bool = False) -> Dict[str, Any]:
+    """`chunk_size` 0 is the full logits."""
+    hidden, weight, labels = _inputs(batch_size, seq_len, d_model, vocab_size, device)
+    criterion = ChunkedCrossEntropy(chunk_size=chunk_size) if chunk_size else None
+
+    def loss_fn() -> torch.Tensor:
+        if criterion is None:
+            return _full_loss(hidden, weight, labels)
+        prediction = {"hidden_states": hidden, "lm_head_weight": weight}
+        return criterion({"labels": labels}, prediction, "train")["loss"]
+
+    cuda = device.startswith("cuda")
+    if cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        start_memory = torch.cuda.memory_allocated()
+    else:
+        start_memory = rss_bytes()
+    times = []
+    for _ in range(steps):
+        hidden.grad, weight.grad = None, None
+        start = time.perf_counter()
+        if eval_mode:
+            with torch.no_grad():
+                loss_fn()
+        else:
+            loss_fn().backward()
+        if cuda:
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    peak = torch.cuda.max_memory_allocated() if cuda else peak_rss_bytes()
+
+    step_time = statistics.median(times[1:] if len(times) > 1 else times)
+    return {"step_ms": 1000 * step_time, "peak_mb": (peak - start_memory) / 2**20}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--seq-len", type=int, default=1024)
+    parser.add_argument("--d-model", type=int, default=768)
+    parser.add_argument("--vocab-size", type=int, default=50257)
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[512, 1024, 4096])
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--eval", action="store_true", help="Forward only, under torch.no_grad()")
+    parser.add_argument("--worker", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    config = ["--batch-size", str(args.batch_size), "--seq-len", str(args.seq_len), "--d-model", str(args.d_model),
+              "--vocab-size", str(args.vocab_size), "--steps", str(args.steps), "--device", args.device,
+              *(["--eval"] if args.eval else [])]
+
+    if args.worker is not None:
+        print(json.dumps(run_variant(args.worker, args.batch_size, args.seq_len, args.d_model, args.vocab_size,
+                                     args.steps, args.device, args.eval)))
+        return
+
+    logits_mb = args.batch_size * args.seq_len * args.vocab_size * 4 / 2**20
+    print(f"batch={args.batch_size}x{args.seq_len} d_model={args.d_model} vocab={args.vocab_size} "
+          f"device={args.device} threads={torch.get_num_threads()} float32 logits={logits_mb:.0f} MB"
+          f"{' eval' if args.eval else ''}")
+    print(f"{'loss':<14} {'step (ms)':>10} {'peak (MB)':>10}")
+    for chunk_size in [0, *args.chunk_sizes]:
+        result = run_worker("benchmarks.chunked_cross_entropy", ["--worker", str(chunk_size), *config])
+        name = f"chunk {chunk_size}" if chunk_size else "full logits"
+        print(f"{name:<14} {result['step_ms']:>10.1f} {result['peak_mb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+CPU cost of collating a batch of packed samples: `DefaultCollateFn` against
+`PackedCollateFn`, which also derives `cu_seqlens`, `max_seqlen` and `position_ids`.
+
+Usage:
+    python -m benchmarks.collate --batch-size 32 --seq-len 1024
+"""
+import argparse
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+import torch
+
+from data.collate_fns.default import DefaultCollateFn
+from data.collate_fns.packed import PackedCollateFn
+
+
+def packed_samples(batch_size: int, seq_len: int, max_doc: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    samples = []
+    for _ in range(batch_size):
+        ids: List[int] = []
+        while len(ids) < seq_len:
+            ids += [len(ids)] * rng.randint(1, max_doc)
+        samples.append({
+            "input": {"input_ids": torch.zeros(seq_len, dtype=torch.long), "sequence_id": torch.tensor(ids[:seq_len])},
+            "target": torch.zeros(seq_len, dtype=torch.long),
+        })
+    return samples
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--seq-len", type=int, default=1024)
+    parser.add_argument("--max-doc", type=int, default=400, help="Longest document")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    samples = packed_samples(args.batch_size, args.seq_len, args.max_doc)
+    print(f"batch={args.batch_size}x{args.seq_len} documents=1-{args.max_doc} threads={torch.get_num_threads()}")
+    print(f"{'collate_fn':<18} {'ms/batch':>9}")
+    for collate_fn in (DefaultCollateFn(), PackedCollateFn()):
+        collate_fn(samples)
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            collate_fn(samples)
+        print(f"{type(collate_fn).__name__:<18} {(time.perf_counter() - start) / args.iterations * 1e3:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
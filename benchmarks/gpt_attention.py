@@ -0,0 +1,108 @@
+"""
+Throughput and memory of a forward and backward pass of the reference GPT on packed
+documents: document masking with the tiled "sdpa" mask (masked key blocks skipped), against
+a dense document mask (one tile covering the whole sequence) and the plain causal mask
+(which attends across documents).
+
+Every variant runs in a fresh process. On CPU, peak memory is the growth of the peak RSS
+over the RSS before the first pass; on CUDA, the growth of the peak allocated memory.
+
+Usage:
+    python -m benchmarks.gpt_attention --batch-size 4 --seq-len 2048 --block-size 128
+"""
+import argparse
+import json
+import statistics
+import time
+from typing import Any, Dict, List, Optional
+
+import torch
+
+from benchmarks.utils import peak_rss_bytes, rss_bytes, run_worker
+from modeling.models.gpt import GPT
+
+VARIANTS = ("causal", "dense", "tiled")
+
+
+def packed_sequence_ids(batch_size: int, seq_len: int, min_doc: int, max_doc: int, seed: int = 1) -> torch.Tensor:
+    """Document ids of rows packed with documents of random lengths in [min_doc, max_doc)."""
+    generator = torch.Generator().manual_seed(seed)
+    rows = []
+    for _ in range(batch_size):
+        lengths = []
+        while sum(lengths) < seq_len:
+            lengths.append(int(torch.randint(min_doc, max_doc, (1,), generator=generator)))
+        ids = torch.repeat_interleave(torch.arange(len(lengths)), torch.tensor(lengths))
+        rows.append(ids[:seq_len])
+    return torch.stack(rows)
+
+
+def run_variant(variant: str, batch_size: int, seq_len: int, block_size: int, d_model: int, n_layers: int,
+                min_doc: int, max_doc: int, steps: int, device: str) -> Dict[str, Any]:
+    torch.manual_seed(0)
+    model = GPT(1024, d_model=d_model, n_layers=n_layers, n_heads=d_model // 64,
+                block_size=seq_len if variant == "dense" else block_size).to(device)
+    input_ids = torch.randint(0, 1024, (batch_size, seq_len), device=device)
+    inputs = {"input_ids": input_ids}
+    if variant != "causal":
+        inputs["sequence_id"] = packed_sequence_ids(batch_size, seq_len, min_doc, max_doc).to(device)
+
+    cuda = device.startswith("cuda")
+    if cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        start_memory = torch.cuda.memory_allocated()
+    else:
+        start_memory = rss_bytes()
+    times = []
+    for _ in range(steps):
+        model.zero_grad(set_to_none=False)
+        start = time.perf_counter()
+        model(**inputs).float().mean().backward()
+        if cuda:
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    peak = torch.cuda.max_memory_allocated() if cuda else peak_rss_bytes()
+    step_time = statistics.median(times[1:] if len(times) > 1 else times)
+    return {
+        "step_ms": 1000 * step_time,
+        "tokens_per_s": batch_size * seq_len / step_time,
+        "peak_mb": (peak - start_memory) / 2**20,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--seq-len", type=int, default=2048)
+    parser.add_argument("--block-size", type=int, default=128)
+    parser.add_argument("--d-model", type=int, default=256)
+    parser.add_argument("--n-layers", type=int, default=4)
+    parser.add_argument("--min-doc", type=int, default=32, help="Shortest document")
+    parser.add_argument("--max-doc", type=int, default=512, help="Longest document (exclusive)")
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=VARIANTS)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker is not None:
+        print(json.dumps(run_variant(args.worker, args.batch_size, args.seq_len, args.block_size, args.d_model,
+                                     args.n_layers, args.min_doc, args.max_doc, args.steps, args.device)))
+        return
+
+    config = ["--batch-size", str(args.batch_size), "--seq-len", str(args.seq_len), "--block-size",
+              str(args.block_size), "--d-model", str(args.d_model), "--n-layers", str(args.n_layers),
+              "--min-doc", str(args.min_doc), "--max-doc", str(args.max_doc), "--steps", str(args.steps),
+              "--device", args.device]
+    print(f"batch={args.batch_size}x{args.seq_len} block_size={args.block_size} d_model={args.d_model} "
+          f"n_layers={args.n_layers} documents={args.min_doc}-{args.max_doc} device={args.device} "
+          f"threads={torch.get_num_threads()}")
+    print(f"{'mask':<8} {'step (ms)':>10} {'tokens/s':>10} {'peak (MB)':>10}")
+    for variant in args.variants:
+        result = run_worker("benchmarks.gpt_attention", ["--worker", variant, *config])
+        print(f"{variant:<8} {result['step_ms']:>10.1f} {result['tokens_per_s']:>10.0f} {result['peak_mb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
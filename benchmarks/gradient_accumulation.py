@@ -0,0 +1,113 @@
+"""
+Peak memory and throughput of a training step of the reference GPT, with and without
+gradient accumulation (`GradientAccumulationModel`), for a fixed batch.
+
+Every variant runs in a fresh process. On CPU, peak memory is the growth of the peak RSS
+over the RSS before the first step; on CUDA, the growth of the peak allocated memory. The
+targets are flattened to [B * T], as the training loop does, and the gradients are checked
+against the unwrapped model.
+
+Usage:
+    python -m benchmarks.gradient_accumulation --batch-size 16 --seq-len 512 --micro-batches 1 2 4 8
+"""
+import argparse
+import json
+import statistics
+import time
+from typing import Any, Dict, List, Optional
+
+import torch
+import torch.nn.functional as F
+
+from benchmarks.utils import peak_rss_bytes, rss_bytes, run_worker
+from modeling.models.gpt import GPT
+from modeling.wrappers.gradient_accumulation import GradientAccumulation
+
+
+def _criterion(data: Dict[str, Any], prediction: torch.Tensor, mode: str) -> Dict[str, Any]:
+    loss = F.cross_entropy(prediction.flatten(0, 1), data["target"])
+    return {"loss": loss, "logs": {"loss": loss.detach()}}
+
+
+def run_variant(micro_batches: int, batch_size: int, seq_len: int, d_model: int, n_layers: int,
+                vocab_size: int, steps: int, device: str) -> Dict[str, Any]:
+    torch.manual_seed(0)
+    model = GPT(vocab_size, d_model=d_model, n_layers=n_layers, n_heads=d_model // 64, tie_weights=False).to(device)
+    tokens = torch.randint(0, vocab_size, (batch_size, seq_len + 1), device=device)
+    batch = {"input": {"input_ids": tokens[:, :-1]}, "target": tokens[:, 1:].flatten()}
+    reference = [p.detach().clone() for p in model.parameters()]
+    if micro_batches > 1:
+        model = GradientAccumulation(num_micro_batches=micro_batches)(model, None)
+
+    def step() -> None:
+        if micro_batches > 1:
+            model.forward_backward(batch, _criterion)
+        else:
+            _criterion(batch, model(**batch["input"]), "train")["loss"].backward()
+
+    cuda = device.startswith("cuda")
+    if cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        start_memory = torch.cuda.memory_allocated()
+    else:
+        start_memory = rss_bytes()
+    times = []
+    for _ in range(steps):
+        model.zero_grad(set_to_none=False)
+        start = time.perf_counter()
+        step()
+        if cuda:
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    peak = torch.cuda.max_memory_allocated() if cuda else peak_rss_bytes()
+
+    # Gradients of the unwrapped model, for the same parameters and batch
+    check = GPT(vocab_size, d_model=d_model, n_layers=n_layers, n_heads=d_model // 64, tie_weights=False).to(device)
+    with torch.no_grad():
+        for p, value in zip(check.parameters(), reference):
+            p.copy_(value)
+    _criterion(batch, check(**batch["input"]), "train")["loss"].backward()
+    error = max((p.grad - q.grad).abs().max().item() for p, q in zip(model.parameters(), check.parameters()))
+
+    step_time = statistics.median(times[1:] if len(times) > 1 else times)
+    return {
+        "step_ms": 1000 * step_time,
+        "tokens_per_s": batch_size * seq_len / step_time,
+        "peak_mb": (peak - start_memory) / 2**20,
+        "grad_error": error,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--seq-len", type=int, default=512)
+    parser.add_argument("--d-model", type=int, default=256)
+    parser.add_argument("--n-layers", type=int, default=4)
+    parser.add_argument("--vocab-size", type=int, default=8192)
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--micro-batches", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--worker", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    config = ["--batch-size", str(args.batch_size), "--seq-len", str(args.seq_len), "--d-model", str(args.d_model),
+              "--n-layers", str(args.n_layers), "--vocab-size", str(args.vocab_size), "--steps", str(args.steps),
+              "--device", args.device]
+
+    if args.worker is not None:
+        print(json.dumps(run_variant(args.worker, args.batch_size, args.seq_len, args.d_model, args.n_layers,
+                                     args.vocab_size, args.steps, args.device)))
+        return
+
+    print(f"batch={args.batch_size}x{args.seq_len} d_model={args.d_model} n_layers={args.n_layers} "
+          f"vocab={args.vocab_size} device={args.device} threads={torch.get_num_threads()}")
+    print(f"{'micro-batches':<14} {'step (ms)':>10} {'tokens/s':>10} {'peak (MB)':>10} {'max grad err':>13}")
+    for micro_batches in args.micro_batches:
+        result = run_worker("benchmarks.gradient_accumulation", ["--worker", str(micro_batches), *config])
+        print(f"{micro_batches:<14} {result['step_ms']:>10.1f} {result['tokens_per_s']:>10.0f} "
+              f"{result['peak_mb']:>10.1f} {result['grad_error']:>13.1e}")
+
+
+if __name__ == "__main__":
+    main()
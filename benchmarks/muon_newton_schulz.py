@@ -0,0 +1,141 @@
+"""
+Step time and memory of Muon's Newton–Schulz iteration: the original allocating iteration
+against the workspace iteration, with per-matrix buffers (default) or workspaces cached across steps.
+
+Every variant runs in a fresh process, on the 2D matrices of a GPT-like stack. On CPU, peak
+memory is the growth of the peak RSS over the RSS before the first step (with glibc's mmap
+threshold pinned, so freed buffers are returned to the OS); on CUDA, the growth of the peak
+allocated memory. "Persistent" is the memory still held by the optimizer after the last
+step (momentum buffers and cached workspaces). "Max |diff|" is the largest difference of the
+final parameters to those of the first variant run (the per-tensor iteration by default),
+i.e. the numerical agreement of the foreach (batched) iteration.
+
+Usage:
+    python -m benchmarks.muon_newton_schulz --d-model 512 --n-layers 8 --steps 10
+    python -m benchmarks.muon_newton_schulz --d-model 128 --n-layers 24 --variants workspaces foreach
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import torch
+
+import training.optimizers.muon as muon_module
+from benchmarks.utils import peak_rss_bytes, rss_bytes, run_worker
+from training.optimizers.muon import Muon
+
+VARIANTS = {
+    # name: (original iteration, foreach, cache_workspaces)
+    "original": (True, False, False),
+    "workspaces": (False, False, False),
+    "workspaces+cache": (False, False, True),
+    "foreach": (False, True, False),
+    "foreach+cache": (False, True, True),
+}
+
+
+def _original_zeropower_via_newtonschulz(grad, ns_coefficients, ns_steps, eps, ns_dtype=torch.bfloat16, workspaces=None):
+    """The iteration before the workspaces: new tensors for every product of every step."""
+    a, b, c = ns_coefficients
+    ortho_grad = grad.to(ns_dtype)
+    if grad.size(0) > grad.size(1):
+        ortho_grad = ortho_grad.T
+    ortho_grad = ortho_grad / ortho_grad.norm().clamp(min=eps)
+    for _ in range(ns_steps):
+        gram_matrix = ortho_grad @ ortho_grad.T
+        gram_update = torch.addmm(gram_matrix, gram_matrix, gram_matrix, beta=b, alpha=c)
+        ortho_grad = torch.addmm(ortho_grad, gram_update, ortho_grad, beta=a)
+    if grad.size(0) > grad.size(1):
+        ortho_grad = ortho_grad.T
+    return ortho_grad
+
+
+def run_variant(variant: str, d_model: int, n_layers: int, steps: int, ns_dtype: str, device: str,
+                dump: Optional[str] = None) -> Dict[str, Any]:
+    original, foreach, cache = VARIANTS[variant]
+    if original:
+        muon_module._zeropower_via_newtonschulz = _original_zeropower_via_newtonschulz
+    shapes = [(3 * d_model, d_model), (d_model, d_model), (4 * d_model, d_model), (d_model, 4 * d_model)] * n_layers
+    generator = torch.Generator().manual_seed(0)
+    params = [torch.nn.Parameter(torch.randn(shape, generator=generator).to(device)) for shape in shapes]
+    for param in params:
+        param.grad = torch.randn(param.shape, generator=generator).to(device)
+    optimizer = Muon(params, lr=0.02, foreach=foreach, ns_dtype=ns_dtype, cache_workspaces=cache)
+
+    cuda = device.startswith("cuda")
+    if cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        start_memory = torch.cuda.memory_allocated()
+    else:
+        start_memory = rss_bytes()
+    times = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        optimizer.step()
+        if cuda:
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    if cuda:
+        peak = torch.cuda.max_memory_allocated() - start_memory
+    else:
+        peak = peak_rss_bytes() - start_memory
+    if dump is not None:
+        torch.save([param.detach().cpu() for param in params], dump)
+    state_bytes = sum(t.numel() * t.element_size() for s in optimizer.state.values() for t in s.values())
+    workspace_bytes = sum(
+        t.numel() * t.element_size() for workspace in optimizer._ns_workspaces.values() for t in workspace.values()
+    )
+    return {
+        "variant": variant,
+        # The first step allocates the momentum buffers (and workspaces)
+        "step_ms": 1000 * statistics.median(times[1:] if len(times) > 1 else times),
+        "first_step_ms": 1000 * times[0],
+        "peak_mb": peak / 2**20,
+        "persistent_mb": (state_bytes + workspace_bytes) / 2**20,
+        "workspace_mb": workspace_bytes / 2**20,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--d-model", type=int, default=512)
+    parser.add_argument("--n-layers", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--ns-dtype", default="float32", choices=["bfloat16", "float16", "float32"])
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--dump", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker is not None:
+        print(json.dumps(run_variant(args.worker, args.d_model, args.n_layers, args.steps, args.ns_dtype, args.device,
+                                     args.dump)))
+        return
+
+    print(f"d_model={args.d_model} n_layers={args.n_layers} ns_dtype={args.ns_dtype} device={args.device} "
+          f"threads={torch.get_num_threads()}")
+    print(f"{'variant':<18} {'step (ms)':>10} {'1st step (ms)':>14} {'peak (MB)':>10} {'persistent (MB)':>16} "
+          f"{'workspaces (MB)':>16} {'max |diff|':>11}")
+    reference = None
+    with tempfile.TemporaryDirectory() as directory:
+        for variant in args.variants:
+            dump = os.path.join(directory, f"{variant}.pt")
+            result = run_worker("benchmarks.muon_newton_schulz", [
+                "--worker", variant, "--dump", dump, "--d-model", str(args.d_model), "--n-layers", str(args.n_layers),
+                "--steps", str(args.steps), "--ns-dtype", args.ns_dtype, "--device", args.device,
+            ])
+            params = torch.load(dump)
+            reference = params if reference is None else reference
+            diff = max((a.float() - b.float()).abs().max().item() for a, b in zip(params, reference))
+            print(f"{variant:<18} {result['step_ms']:>10.1f} {result['first_step_ms']:>14.1f} {result['peak_mb']:>10.1f} "
+                  f"{result['persistent_mb']:>16.1f} {result['workspace_mb']:>16.1f} {diff:>11.1e}")
+
+
+if __name__ == "__main__":
+    main()
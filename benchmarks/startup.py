@@ -0,0 +1,100 @@
+"""
+Startup time of a short run: from the interpreter start to the end of the first training step
+of a small model instantiated from its configs (`utils.registry.time_to_first_step`), and of
+validating every config.
+
+Every variant runs in a fresh process, `--repeats` times, and the median wall time is
+reported. "lazy" instantiates through the `Registry`, which only imports the targets it
+needs. "eager" first imports the module of every `_target_` of every config group and the
+heavy libraries they use (`transformers`, `datasets`), like a launcher importing all its
+components up front. The time of a bare `import torch` is reported as the floor of a step.
+
+Usage:
+    python -m benchmarks.startup --repeats 5
+"""
+import argparse
+import importlib
+import json
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks.utils import run_worker
+
+HEAVY_MODULES = ("torch", "transformers", "datasets")
+VARIANTS = ("import torch", "validate configs", "lazy first step", "eager first step")
+
+
+def _import_everything() -> None:
+    from utils.registry import Registry
+    registry = Registry()
+    for module in HEAVY_MODULES[1:]:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    for group in registry.groups:
+        for name in registry.names(group):
+            target = registry.target(group, name)
+            try:
+                importlib.import_module(target.rsplit(".", 1)[0])
+            except ImportError:
+                pass
+
+
+def run_variant(variant: str, model: str, optimizer: str, scheduler: str, criterion: str) -> Dict[str, Any]:
+    if variant == "import torch":
+        import torch  # noqa: F401
+    elif variant == "validate configs":
+        from utils.registry import Registry
+        Registry().validate_all()
+    else:
+        import torch
+        if variant == "eager first step":
+            _import_everything()
+        from utils.registry import Registry
+        registry = Registry()
+        net = registry.instantiate("models", model, vocab_size=1024, d_model=64, n_layers=2, n_heads=4)
+        opt = registry.instantiate("optimizers", optimizer, net.named_parameters())
+        sched = registry.instantiate("schedulers", scheduler, opt)
+        loss_fn = registry.instantiate("criteria", criterion, target_key="target")
+        tokens = torch.randint(0, 1024, (2, 129))
+        data = {"input": {"input_ids": tokens[:, :-1]}, "target": tokens[:, 1:].flatten()}
+        loss_fn(data, net(**data["input"]).flatten(0, 1), "train")["loss"].backward()
+        opt.step()
+        sched.step()
+    return {"heavy_imported": [module for module in HEAVY_MODULES if module in sys.modules]}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--model", default="gpt")
+    parser.add_argument("--optimizer", default="adamw")
+    parser.add_argument("--scheduler", default="constant")
+    parser.add_argument("--criterion", default="cross_entropy")
+    parser.add_argument("--worker", choices=VARIANTS, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    config = ["--model", args.model, "--optimizer", args.optimizer, "--scheduler", args.scheduler,
+              "--criterion", args.criterion]
+
+    if args.worker is not None:
+        print(json.dumps(run_variant(args.worker, args.model, args.optimizer, args.scheduler, args.criterion)))
+        return
+
+    print(f"model={args.model} optimizer={args.optimizer} scheduler={args.scheduler} "
+          f"criterion={args.criterion} repeats={args.repeats}")
+    print(f"{'variant':<18} {'median (s)':>11} {'min (s)':>8}  heavy modules imported")
+    for variant in VARIANTS:
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            result = run_worker("benchmarks.startup", ["--worker", variant, *config])
+            times.append(time.perf_counter() - start)
+        heavy = ", ".join(result["heavy_imported"]) or "-"
+        print(f"{variant:<18} {statistics.median(times):>11.2f} {min(times):>8.2f}  {heavy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Tokens/s of packing a stream of tokenized documents into `seq_len + 1` training chunks:
+the original packing of `FineWebDataset.__iter__` (Python lists re-sliced after every chunk,
+one `torch.tensor` per chunk) against `TokenPacker` (preallocated ring buffer), on a
+synthetic corpus of documents of mixed lengths. Both produce the same chunks, which is
+checked on a prefix of the corpus.
+
+Documents are given as NumPy arrays, as `encode_batch` returns them, or with `--lists`, as
+Python lists, as `__call__` returns them.
+
+Usage:
+    python -m benchmarks.token_packing --num-docs 400 --seq-len 1024
+"""
+import argparse
+import random
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import torch
+
+from data.datasets.packing import TokenPacker
+
+
+def original_packing(documents: Sequence[Any], seq_len: int) -> Iterator[Dict[str, Any]]:
+    """The packing loop of `FineWebDataset.__iter__` before `TokenPacker`."""
+    chunk_size = seq_len + 1
+    buffer_ids: List[int] = []
+    buffer_seq_ids: List[int] = []
+    for doc_idx, tokens in enumerate(documents):
+        buffer_ids.extend(tokens)
+        buffer_seq_ids.extend([doc_idx] * len(tokens))
+        while len(buffer_ids) >= chunk_size:
+            chunk_ids = torch.tensor(buffer_ids[:chunk_size])
+            chunk_seq_ids = torch.tensor(buffer_seq_ids[:chunk_size])
+            yield {"input": {"input_ids": chunk_ids[:-1], "sequence_id": chunk_seq_ids[:-1]}, "target": chunk_ids[1:]}
+            buffer_ids = buffer_ids[seq_len:]
+            buffer_seq_ids = buffer_seq_ids[seq_len:]
+
+
+def ring_buffer_packing(documents: Sequence[Any], seq_len: int) -> Iterator[Dict[str, Any]]:
+    packer = TokenPacker(seq_len)
+    for doc_idx, tokens in enumerate(documents):
+        yield from packer.pack(tokens, doc_idx)
+
+
+def synthetic_corpus(num_docs: int, vocab_size: int, seed: int = 0) -> List[np.ndarray]:
+    """Documents of 50 to 20000 tokens, as web text mixes short pages and long articles."""
+    rng = random.Random(seed)
+    generator = np.random.default_rng(seed)
+    return [generator.integers(0, vocab_size, rng.choice([50, 500, 3000, 20000]), dtype=np.int64)
+            for _ in range(num_docs)]
+
+
+def _same_chunks(a: List[Dict[str, Any]], b: List[Dict[str, Any]]) -> bool:
+    return len(a) == len(b) and all(
+        torch.equal(x["input"]["input_ids"], y["input"]["input_ids"])
+        and torch.equal(x["input"]["sequence_id"], y["input"]["sequence_id"])
+        and torch.equal(x["target"], y["target"])
+        for x, y in zip(a, b)
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-docs", type=int, default=400)
+    parser.add_argument("--seq-len", type=int, default=1024)
+    parser.add_argument("--vocab-size", type=int, default=50257)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--lists", action="store_true", help="Documents as Python lists instead of arrays")
+    args = parser.parse_args(argv)
+
+    documents: List[Any] = synthetic_corpus(args.num_docs, args.vocab_size)
+    if args.lists:
+        documents = [document.tolist() for document in documents]
+    num_tokens = sum(len(document) for document in documents)
+    if not _same_chunks(list(original_packing(documents[:60], 64)), list(ring_buffer_packing(documents[:60], 64))):
+        raise AssertionError("The packings produce different chunks")
+
+    print(f"documents={args.num_docs} tokens={num_tokens} seq_len={args.seq_len} "
+          f"input={'lists' if args.lists else 'arrays'}")
+    print(f"{'packing':<14} {'chunks':>8} {'Mtokens/s':>10}")
+    for name, packing in (("original", original_packing), ("ring buffer", ring_buffer_packing)):
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            num_chunks = sum(1 for _ in packing(documents, args.seq_len))
+            times.append(time.perf_counter() - start)
+        print(f"{name:<14} {num_chunks:>8} {num_tokens / min(times) / 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Throughput of `HuggingFaceTokenizer.encode_batch` (flat NumPy tokens and offsets) against the
+list path (`__call__`, then one array per document, as consumers did), with the fast
+tokenizer's own parallelism (`num_threads=None`) and with 1 to N threads.
+
+Threads only help with as many cores: the number of cores this process may run on is
+printed, and thread counts above it are expected to be slower than 1 thread.
+
+The corpus is read from a local text file (one document per line), or generated. The
+tokenizer is loaded from `--tokenizer`, or a byte-level BPE is trained on the corpus (needs
+the `tokenizers` package).
+
+Usage:
+    python -m benchmarks.tokenizer_encode_batch --text-file corpus.txt --tokenizer gpt2 --threads 1 2 4 8
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from modeling.tokenizers.huggingface import HuggingFaceTokenizer
+
+
+def synthetic_corpus(num_docs: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    words = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 9))) for _ in range(5000)]
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(50, 1500))) for _ in range(num_docs)]
+
+
+def train_tokenizer(texts: List[str], directory: str, vocab_size: int = 8000) -> str:
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.train_from_iterator(texts, trainers.BpeTrainer(vocab_size=vocab_size, special_tokens=["<|endoftext|>"]))
+    PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<|endoftext|>").save_pretrained(directory)
+    return directory
+
+
+def _best_time(fn, repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--text-file", default=None, help="One document per line. Default: synthetic text")
+    parser.add_argument("--num-docs", type=int, default=4000, help="Number of synthetic documents")
+    parser.add_argument("--tokenizer", default=None, help="Name or path. Default: a BPE trained on the corpus")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.text_file is not None:
+        with open(args.text_file, encoding="utf-8") as f:
+            texts = [line.rstrip("\n") for line in f if line.strip()]
+    else:
+        texts = synthetic_corpus(args.num_docs)
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.tokenizer or train_tokenizer(texts[:500], directory)
+        tokenizers = {threads: HuggingFaceTokenizer(path, num_threads=threads) for threads in [None, *args.threads]}
+
+    reference = tokenizers[None]
+    tokens, offsets = reference.encode_batch(texts[:50])
+    expected = reference(texts[:50])
+    if any(tokens[offsets[i]:offsets[i + 1]].tolist() != expected[i] for i in range(50)):
+        raise AssertionError("encode_batch and the list path disagree")
+    num_tokens = int(reference.encode_batch(texts)[1][-1])
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    print(f"documents={len(texts)} tokens={num_tokens} cores={cores}")
+    print(f"{'path':<28} {'Mtokens/s':>10}")
+    seconds = _best_time(lambda: [np.asarray(ids, dtype=np.int64) for ids in reference(texts)], args.repeats)
+    print(f"{'list path':<28} {num_tokens / seconds / 1e6:>10.2f}")
+    for threads, tokenizer in tokenizers.items():
+        name = "encode_batch, tokenizer's" if threads is None else f"encode_batch, {threads} thread(s)"
+        seconds = _best_time(lambda: tokenizer.encode_batch(texts), args.repeats)
+        note = "  (more threads than cores)" if threads is not None and threads > cores else ""
+        print(f"{name:<28} {num_tokens / seconds / 1e6:>10.2f}{note}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""Helpers shared by the benchmarks: memory readings and fresh-process workers."""
+import json
+import os
+import resource
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+
+def rss_bytes() -> int:
+    """Current resident set size of the process."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of the process so far."""
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_worker(module: str, args: List[str], env: Dict[str, str] = None) -> Dict[str, Any]:
+    """
+    Runs `python -m <module> <args>` in a fresh process and returns the JSON object it prints
+    last. glibc's mmap threshold is pinned, so freed buffers are returned to the OS and the
+    RSS reflects what is live.
+    """
+    env = {**os.environ, "MALLOC_MMAP_THRESHOLD_": "65536", **(env or {})}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-m", module, *args], cwd=root, env=env, check=True,
+                            capture_output=True, text=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
@@ -0,0 +1,64 @@
+from typing import Any, Dict, List
+import torch
+from torch.utils.data import default_collate
+
+class PackedCollateFn:
+    """
+    Collate function for packed sequences.
+
+    On top of `default_collate`, it derives the document boundaries of the batch from
+    `sequence_id` and adds to `batch["input"]`:
+        - "cu_seqlens": int32 tensor of shape [num_docs + 1] with the cumulative document
+          lengths over the flattened [B * T] batch. Rows are always split, even when the
+          same document continues on the next row.
+        - "max_seqlen": length of the longest document segment (int).
+        - "position_ids": tensor of shape [B, T] with positions restarting at 0 for every document.
+
+    These are the inputs expected by variable-length (flash-style) attention kernels,
+    which avoids building an O(T^2) block-diagonal mask.
+    """
+    def __init__(self, sequence_id_key: str = "sequence_id"):
+        """
+        Args:
+            sequence_id_key: Key of the per-token document ids in `batch["input"]`.
+        """
+        self.sequence_id_key = sequence_id_key
+
+    def __call__(self, samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Collates a list of packed samples.
+        
+        Args:
+            samples: A list of dictionaries with a [T] `sequence_id` tensor in `sample["input"]`.
+            
+        Returns:
+            A dictionary containing the batched data and the document boundaries.
+        """
+        batch = default_collate(samples)
+        batch["input"].update(self.document_boundaries(batch["input"][self.sequence_id_key]))
+        return batch
+
+    @staticmethod
+    def document_boundaries(sequence_id: torch.Tensor) -> Dict[str, Any]:
+        """
+        Computes `cu_seqlens`, `max_seqlen` and `position_ids` from a [B, T] `sequence_id` tensor.
+        """
+        batch_size, seq_len = sequence_id.shape
+        # A document starts at the beginning of every row and wherever the id changes
+        is_start = torch.ones_like(sequence_id, dtype=torch.bool)
+        is_start[:, 1:] = sequence_id[:, 1:] != sequence_id[:, :-1]
+        is_start = is_start.flatten()
+
+        starts = is_start.nonzero().squeeze(1)
+        cu_seqlens = torch.cat([starts, starts.new_tensor([batch_size * seq_len])]).to(torch.int32)
+        max_seqlen = int((cu_seqlens[1:] - cu_seqlens[:-1]).max())
+
+        # Position = index - start of the document the token belongs to
+        doc_index = is_start.cumsum(0) - 1
+        position_ids = torch.arange(batch_size * seq_len) - starts[doc_index]
+
+        return {
+            "cu_seqlens": cu_seqlens,
+            "max_seqlen": max_seqlen,
+            "position_ids": position_ids.view(batch_size, seq_len),
+        }
@@ -37,6 +37,8 @@ class IterableDatasetTemplate(Protocol):
     Requirements:
     - Must have a `tokenizer` attribute.
     - `__iter__` must yield dictionaries containing at least an "input" key.
+    - `state_dict` / `load_state_dict` must save and restore the position in the stream,
+      so that iteration resumes at the exact next sample (per DataLoader worker).
     
     It is recommended to inherit from `torch.utils.data.IterableDataset`.
     """
@@ -48,6 +50,12 @@ class IterableDatasetTemplate(Protocol):
     def __iter__(self) -> Iterator[Dict[str, Any]]:
         ...
 
+    def state_dict(self) -> Dict[str, Any]:
+        ...
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        ...
+
 DatasetTemplate = Union[MapDatasetTemplate, IterableDatasetTemplate]
 """
 Type alias for a Dataset, which can be either a map-style dataset or an iterable dataset.
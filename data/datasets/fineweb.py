@@ -1,8 +1,12 @@
-
+import copy
+import numpy as np
 import torch
 from torch.utils.data import IterableDataset
-from datasets import load_dataset
-from typing import Iterator, Optional, Any, Dict, Union
+from typing import Iterator, Optional, Any, Dict, List, Union
+
+from data.datasets.packing import BestFitPacker, TokenPacker
+from data.datasets.token_cache import TokenCache
+from utils.distributed import get_data_shard
 
 class FineWebDataset(IterableDataset):
     def __init__(
@@ -17,6 +21,11 @@ class FineWebDataset(IterableDataset):
         shuffle: bool = True,
         shuffle_buffer_size: int = 10000,
         seed: int = 42,
+        cache_dir: Optional[str] = None,
+        cache_max_bytes: int = 10 * 2**30,
+        packing: str = "greedy",
+        packing_window: int = 1000,
+        token_budget: Optional[int] = None,
     ):
         """
         Iterable dataset for FineWeb using HuggingFace Datasets features.
@@ -32,6 +41,17 @@ class FineWebDataset(IterableDataset):
             shuffle: Whether to shuffle the dataset.
             shuffle_buffer_size: Buffer size for shuffling if streaming is True.
             seed: Random seed for shuffling.
+            cache_dir: If set, tokenized batches are cached in this directory (see `TokenCache`),
+                       keyed by tokenizer and text, so repeated runs skip tokenization.
+            cache_max_bytes: Size of the tokenization cache above which least recently used
+                             entries are evicted.
+            packing: "greedy" packs documents in stream order into fixed seq_len samples
+                     (`TokenPacker`). "best_fit" bins a window of documents with best-fit-decreasing
+                     and yields whole padding-free batches (`BestFitPacker`); use it with
+                     `DataLoader(batch_size=None)`.
+            packing_window: Number of documents binned together with "best_fit" packing.
+            token_budget: Maximum number of tokens per batch with "best_fit" packing.
+                          Defaults to seq_len.
         """
         self.tokenizer = tokenizer
         self.seq_len = seq_len
@@ -43,8 +63,27 @@ class FineWebDataset(IterableDataset):
         self.shuffle = shuffle
         self.shuffle_buffer_size = shuffle_buffer_size
         self.seed = seed
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        if packing not in ("greedy", "best_fit"):
+            raise ValueError(f"Unknown packing strategy: {packing}")
+        self.packing = packing
+        self.packing_window = packing_window
+        self.token_budget = token_budget
+        
+        # Created lazily, in each DataLoader worker
+        self.token_cache: Optional[TokenCache] = None
+        self._packer: Optional[Union[TokenPacker, BestFitPacker]] = None
+        self._progress: Dict[str, Any] = {}
+        self._loaded_state: Optional[Union[Dict[str, Any], List[Dict[str, Any]]]] = None
+        # Tokens of the current document skipped on resume, before those given to the packer
+        self._doc_skip = 0
     
     def __iter__(self) -> Iterator[Dict[str, Any]]:
+        # Imported here, as importing datasets takes seconds
+        from datasets import load_dataset, IterableDataset as HFIterableDataset
+        from datasets.distributed import split_dataset_by_node
+
         # Load the dataset
         dataset = load_dataset(
             self.dataset_name,
@@ -53,6 +92,8 @@ class FineWebDataset(IterableDataset):
             streaming=self.streaming
         )
         
+        shard_index, num_shards = get_data_shard()
+        
         # Shuffle if enabled
         if self.shuffle:
             if self.streaming:
@@ -60,65 +101,120 @@ class FineWebDataset(IterableDataset):
             else:
                 dataset = dataset.shuffle(seed=self.seed)
         
-        # Define tokenization function
-        def tokenize_batch(batch):
-            return self.tokenizer(
-                batch['text'],
-                add_special_tokens=False,
-                return_attention_mask=False
-            )
+        # Stream map-style datasets as well, so both can be sharded and resumed the same way
+        if not isinstance(dataset, HFIterableDataset):
+            dataset = dataset.to_iterable_dataset(num_shards=num_shards)
         
-        # Apply mapping
-        # remove_columns=['text'] to avoid carrying over massive text data
-        # If features are not available (e.g. some streaming setups), we assume 'text' is there or just try to remove it.
-        # However, map might complain if we try to remove a column that it doesn't know about if strict.
-        # But commonly for FineWeb 'text' is the column.
+        # Give every DataLoader worker on every rank its own disjoint slice of the stream:
+        # whole shard files when there are enough of them, every n-th example otherwise
+        if num_shards > 1:
+            strategy = "shards" if dataset.num_shards >= num_shards else "examples"
+            dataset = split_dataset_by_node(dataset, rank=shard_index, world_size=num_shards, strategy=strategy)
         
-        remove_cols = ['text']
-        if dataset.features is not None:
-             remove_cols = [c for c in dataset.features if c == 'text']
+        # Pack documents into chunks of seq_len + 1 tokens, so that input (0..N-1)
+        # and target (1..N) are views over the same chunk, or into best-fit batches
+        if self.packing == "best_fit":
+            packer = BestFitPacker(self.seq_len, window_size=self.packing_window, token_budget=self.token_budget)
+        else:
+            packer = TokenPacker(self.seq_len)
+        self._packer = packer
         
-        dataset = dataset.map(
-            tokenize_batch,
-            batched=True,
-            batch_size=self.tokenization_batch_size,
-            remove_columns=remove_cols
-        )
+        # Restore the position of this worker, if resuming
+        state = self._resume_state(shard_index, num_shards)
+        # Only the next iteration resumes, later epochs start from the beginning of the shard
+        self._loaded_state = None
+        self._progress = {
+            "shard_index": shard_index,
+            "num_shards": num_shards,
+            # Source position at the start of the current tokenization batch
+            "source": None,
+            # Documents of the current tokenization batch that were fully packed
+            "batch_offset": 0,
+            # Document counter (sequence counter), unique per document in this worker's stream
+            "doc_idx": 0,
+        }
+        skip_docs, self._doc_skip = 0, 0
+        if state is not None:
+            if state["source"] is not None:
+                dataset.load_state_dict(state["source"])
+            packer.load_state_dict(state["packer"])
+            self._progress.update(source=state["source"], doc_idx=state["doc_idx"])
+            skip_docs, self._doc_skip = state["batch_offset"], state["token_offset"]
         
-        # Buffer for flattening
-        # We need seq_len + 1 tokens to create input (0..N-1) and target (1..N)
-        chunk_size = self.seq_len + 1
+        # `iter` reads whole batches and, unlike `__iter__`, does not re-split the
+        # (already sharded) stream among DataLoader workers
+        for batch in dataset.iter(batch_size=self.tokenization_batch_size):
+            # On resume, the first batch is re-read from its start; skip what was already packed
+            self._progress["batch_offset"] = skip_docs
+            for tokens in self.tokenize_batch(batch['text'][skip_docs:]):
+                yield from packer.pack(tokens[self._doc_skip:], self._progress["doc_idx"])
+                self._doc_skip = 0
+                self._progress["batch_offset"] += 1
+                self._progress["doc_idx"] += 1
+            skip_docs = 0
+            self._progress["source"] = dataset.state_dict()
         
-        buffer_ids = []
-        buffer_seq_ids = []
-        
-        # Document counter (sequence counter)
-        # Using enumerate on the iterator gives us a unique ID per document in this stream
-        for doc_idx, sample in enumerate(dataset):
-            tokens = sample['input_ids']
-            
-            # Extend buffers
-            buffer_ids.extend(tokens)
-            buffer_seq_ids.extend([doc_idx] * len(tokens))
-            
-            # Yield chunks
-            while len(buffer_ids) >= chunk_size:
-                chunk_ids = torch.tensor(buffer_ids[:chunk_size], dtype=torch.long)
-                chunk_seq_ids = torch.tensor(buffer_seq_ids[:chunk_size], dtype=torch.long)
-                
-                input_ids = chunk_ids[:-1]
-                target = chunk_ids[1:]
-                
-                # sequence_id for input tokens
-                input_seq_ids = chunk_seq_ids[:-1]
-                
-                yield {
-                    "input": {
-                        "input_ids": input_ids,
-                        "sequence_id": input_seq_ids
-                    },
-                    "target": target
-                }
-                
-                buffer_ids = buffer_ids[self.seq_len:]
-                buffer_seq_ids = buffer_seq_ids[self.seq_len:]
+        yield from packer.flush()
+
+    def state_dict(self) -> Dict[str, Any]:
+        """
+        Returns the position of the current DataLoader worker in the stream.
+
+        The state holds the source shard and offset (through `datasets`' own state), the
+        position inside the current tokenization batch, the leftover packing buffer and
+        `doc_idx`. With greedy packing it is at most one packer buffer plus a few counters,
+        independent of how far the stream has been read; with best-fit packing it also holds
+        the documents of the current packing window. Call it inside the worker (e.g. through
+        `torchdata.stateful_dataloader.StatefulDataLoader`) or with `num_workers=0`.
+
+        Note: with `streaming=True` and `shuffle=True`, the examples held in the `datasets`
+        shuffle buffer are not part of the state, and the buffer is refilled on resume.
+        """
+        if self._packer is None:
+            return self._loaded_state
+        return {
+            **copy.deepcopy(self._progress),
+            # The packer counts from the part of the document it was given
+            "token_offset": self._doc_skip + self._packer.doc_offset,
+            "packer": self._packer.state_dict(),
+        }
+
+    def load_state_dict(self, state_dict: Union[Dict[str, Any], List[Dict[str, Any]]]) -> None:
+        """
+        Restores a state returned by `state_dict`. The next iteration resumes at the exact
+        next sample; the state is consumed by it, so later epochs start from the beginning.
+
+        Args:
+            state_dict: The state of one worker, or a list with the states of all workers
+                        (each worker picks its own by `shard_index`).
+        """
+        self._loaded_state = state_dict
+
+    def _resume_state(self, shard_index: int, num_shards: int) -> Optional[Dict[str, Any]]:
+        states = self._loaded_state
+        if states is None:
+            return None
+        if isinstance(states, dict):
+            states = [states]
+        for state in states:
+            if state["num_shards"] != num_shards:
+                raise ValueError(
+                    f"Cannot resume a state saved with {state['num_shards']} data shards "
+                    f"(ranks x workers) on {num_shards} data shards"
+                )
+            if state["shard_index"] == shard_index:
+                return state
+        return None
+
+    def tokenize_batch(self, texts: List[str]) -> List[np.ndarray]:
+        """
+        Tokenizes a batch of documents, going through the tokenization cache if enabled.
+        Returns one token array (a view into a single flat array) per document.
+        """
+        if self.cache_dir is None:
+            tokens, offsets = self.tokenizer.encode_batch(texts)
+        else:
+            if self.token_cache is None:
+                self.token_cache = TokenCache(self.cache_dir, self.tokenizer, max_bytes=self.cache_max_bytes)
+            tokens, offsets = self.token_cache.get_or_tokenize(texts, self.tokenizer.encode_batch)
+        return [tokens[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
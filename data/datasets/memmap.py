@@ -0,0 +1,88 @@
+import json
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from data.pretokenize import METADATA_FILE
+
+
+class MemmapTokenDataset(Dataset):
+    def __init__(self, tokenizer: Any, data_dir: str, seq_len: int = 2048):
+        """
+        Map-style dataset over token shards written by `data.pretokenize`.
+
+        Shards are opened with `np.memmap`, so no tokenization happens at train time and
+        DataLoader workers share the same pages through the OS page cache. Sample `i` is a
+        window of seq_len + 1 tokens; consecutive windows overlap by one token and never
+        cross a shard boundary.
+
+        Args:
+            tokenizer: The tokenizer instance. Only kept for API compatibility,
+                       the shards are already tokenized.
+            data_dir: Directory containing `metadata.json` and the shards.
+            seq_len: The target sequence length (input length).
+        """
+        self.tokenizer = tokenizer
+        self.data_dir = data_dir
+        self.seq_len = seq_len
+
+        with open(os.path.join(data_dir, METADATA_FILE)) as f:
+            self.metadata = json.load(f)
+        self.dtype = np.dtype(self.metadata["dtype"])
+        self.shards = self.metadata["shards"]
+
+        windows = [max(shard["num_tokens"] - 1, 0) // seq_len for shard in self.shards]
+        # First sample index / first document index of every shard
+        self._window_offsets = np.concatenate([[0], np.cumsum(windows)]).astype(np.int64)
+        self._doc_offsets = np.concatenate(
+            [[0], np.cumsum([shard["num_docs"] for shard in self.shards])]
+        ).astype(np.int64)
+
+        # Opened lazily so that memmaps are created inside each DataLoader worker
+        self._tokens: List[np.memmap] = []
+        self._doc_starts: List[np.ndarray] = []
+
+    def __len__(self) -> int:
+        return int(self._window_offsets[-1])
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Index {index} out of range for dataset of length {len(self)}")
+        if not self._tokens:
+            self._open()
+
+        shard = int(np.searchsorted(self._window_offsets, index, side="right")) - 1
+        start = (index - int(self._window_offsets[shard])) * self.seq_len
+        stop = start + self.seq_len + 1
+
+        chunk_ids = torch.from_numpy(self._tokens[shard][start:stop].astype(np.int64))
+        # Document of every input token = last document starting at or before it
+        local_doc = np.searchsorted(self._doc_starts[shard], np.arange(start, stop - 1), side="right") - 1
+        sequence_id = torch.from_numpy(local_doc + self._doc_offsets[shard])
+
+        return {
+            "input": {
+                "input_ids": chunk_ids[:-1],
+                "sequence_id": sequence_id
+            },
+            "target": chunk_ids[1:]
+        }
+
+    def _open(self) -> None:
+        for shard in self.shards:
+            self._tokens.append(
+                np.memmap(os.path.join(self.data_dir, shard["tokens"]), dtype=self.dtype, mode="r")
+            )
+            self._doc_starts.append(np.load(os.path.join(self.data_dir, shard["index"])))
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Do not pickle open memmaps into DataLoader workers
+        state = self.__dict__.copy()
+        state["_tokens"] = []
+        state["_doc_starts"] = []
+        return state
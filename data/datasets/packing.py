@@ -0,0 +1,296 @@
+import bisect
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+
+class TokenPacker:
+    """
+    Packs a stream of tokenized documents into fixed-length training chunks.
+
+    Tokens are appended as whole arrays into a preallocated buffer, and `sequence_id`
+    is filled with a single vectorized write per document. Each chunk holds `seq_len + 1`
+    tokens, so `input_ids` and `target` are views over one copy of the buffer. Consecutive
+    chunks overlap by one token, i.e. the read position advances by `seq_len`.
+
+    The buffer never grows: when the write position reaches the end, the (at most
+    `seq_len` tokens long) leftover is moved back to the front, so the cost of compaction
+    is amortized over `capacity` tokens.
+    """
+    def __init__(self, seq_len: int, capacity: Optional[int] = None):
+        """
+        Args:
+            seq_len: The target sequence length (input length). Each chunk consumes seq_len + 1 tokens.
+            capacity: Number of tokens the buffer can hold. Must be at least 2 * (seq_len + 1).
+                      Defaults to 64 chunks.
+        """
+        self.seq_len = seq_len
+        self.chunk_size = seq_len + 1
+        if capacity is None:
+            capacity = 64 * self.chunk_size
+        if capacity < 2 * self.chunk_size:
+            raise ValueError(f"capacity must be at least {2 * self.chunk_size} tokens, got {capacity}")
+        self.capacity = capacity
+
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._seq_ids = np.empty(capacity, dtype=np.int64)
+        self._start = 0
+        self._end = 0
+        # Number of tokens of the document being packed that are already in the buffer
+        self.doc_offset = 0
+
+    def __len__(self) -> int:
+        """Number of buffered tokens that have not been emitted yet."""
+        return self._end - self._start
+
+    def pack(self, tokens: Any, doc_idx: int) -> Iterator[Dict[str, Any]]:
+        """
+        Appends the tokens of one document and yields every chunk that becomes complete.
+
+        Args:
+            tokens: Token ids of the document (list or array of ints).
+            doc_idx: Document index, written to `sequence_id` for all tokens of the document.
+
+        Yields:
+            Samples of the form {"input": {"input_ids", "sequence_id"}, "target"}.
+        """
+        tokens = np.asarray(tokens, dtype=np.int64)
+        offset = 0
+        num_tokens = len(tokens)
+        self.doc_offset = 0
+        while offset < num_tokens:
+            if self._end == self.capacity:
+                self._compact()
+
+            # Whole documents are copied in as few slices as the free space allows
+            n = min(num_tokens - offset, self.capacity - self._end)
+            self._ids[self._end:self._end + n] = tokens[offset:offset + n]
+            self._seq_ids[self._end:self._end + n] = doc_idx
+            self._end += n
+            offset += n
+            self.doc_offset = offset
+
+            while self._end - self._start >= self.chunk_size:
+                yield self._pop()
+
+    def flush(self) -> Iterator[Dict[str, Any]]:
+        """
+        Called at the end of the stream. The leftover tokens cannot form a full chunk
+        and are dropped, so nothing is yielded.
+        """
+        return iter(())
+
+    def _pop(self) -> Dict[str, Any]:
+        start = self._start
+        stop = start + self.chunk_size
+        # One copy per buffer; input/target are views over the same chunk.
+        chunk_ids = torch.from_numpy(self._ids[start:stop].copy())
+        chunk_seq_ids = torch.from_numpy(self._seq_ids[start:stop - 1].copy())
+        self._start += self.seq_len
+        return {
+            "input": {
+                "input_ids": chunk_ids[:-1],
+                "sequence_id": chunk_seq_ids
+            },
+            "target": chunk_ids[1:]
+        }
+
+    def _compact(self) -> None:
+        leftover = self._end - self._start
+        self._ids[:leftover] = self._ids[self._start:self._end]
+        self._seq_ids[:leftover] = self._seq_ids[self._start:self._end]
+        self._start = 0
+        self._end = leftover
+
+    def state_dict(self) -> Dict[str, Any]:
+        """
+        Returns the buffered tokens that have not been emitted yet (fewer than `capacity`).
+        """
+        return {
+            "input_ids": torch.from_numpy(self._ids[self._start:self._end].copy()),
+            "sequence_id": torch.from_numpy(self._seq_ids[self._start:self._end].copy()),
+        }
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        """
+        Replaces the buffer content with the tokens of a previous `state_dict`.
+        """
+        ids = np.asarray(state_dict["input_ids"], dtype=np.int64)
+        if len(ids) > self.capacity:
+            raise ValueError(f"Cannot load {len(ids)} buffered tokens into a buffer of capacity {self.capacity}")
+        self._ids[:len(ids)] = ids
+        self._seq_ids[:len(ids)] = np.asarray(state_dict["sequence_id"], dtype=np.int64)
+        self._start = 0
+        self._end = len(ids)
+        self.doc_offset = 0
+
+
+class BestFitPacker:
+    """
+    Packs tokenized documents into variable-length sequences with best-fit-decreasing,
+    and groups the sequences into padding-free batches of at most `token_budget` tokens.
+
+    Documents are held in a window of `window_size` documents. When the window is full,
+    the documents are sorted by length and each one is placed in the sequence with the
+    least remaining room that still fits it (at most `seq_len` input tokens per sequence).
+    Documents are never split across sequences, except those longer than `seq_len + 1`
+    tokens, which are cut into pieces that fit. A sequence can hold several whole
+    documents; their boundaries are given by `sequence_id` and `cu_seqlens`, so that
+    attention masked to them sees no context across documents.
+
+    Every yielded item is a whole batch of concatenated sequences, with a leading batch
+    dimension of 1 and the boundaries in the same format as `PackedCollateFn`:
+        {"input": {"input_ids", "sequence_id", "position_ids", "cu_seqlens", "max_seqlen"}, "target"}
+    so it should be used with `DataLoader(batch_size=None)`.
+    """
+    def __init__(self, seq_len: int, window_size: int = 1000, token_budget: Optional[int] = None):
+        """
+        Args:
+            seq_len: Maximum number of input tokens per sequence.
+            window_size: Number of documents binned together.
+            token_budget: Maximum number of input tokens per batch. Defaults to seq_len.
+        """
+        if token_budget is None:
+            token_budget = seq_len
+        if token_budget < seq_len:
+            raise ValueError(f"token_budget ({token_budget}) must be at least seq_len ({seq_len})")
+        self.seq_len = seq_len
+        self.window_size = window_size
+        self.token_budget = token_budget
+        # Documents are fully added to the window, see `TokenPacker.doc_offset`
+        self.doc_offset = 0
+
+        self._window: List[Tuple[int, np.ndarray]] = []
+        # Packed sequences not emitted yet, as lists of (doc_idx, tokens) pieces
+        self._sequences: List[List[Tuple[int, np.ndarray]]] = []
+
+        self.num_docs = 0
+        self.num_split_docs = 0
+        self.num_sequences = 0
+        self.num_tokens = 0
+
+    def pack(self, tokens: Any, doc_idx: int) -> Iterator[Dict[str, Any]]:
+        """
+        Adds one document to the window and yields batches once the window is full.
+        """
+        tokens = np.asarray(tokens, dtype=np.int64)
+        self.doc_offset = len(tokens)
+        # A single token has no target
+        if len(tokens) >= 2:
+            self._window.append((doc_idx, tokens))
+        if len(self._window) >= self.window_size:
+            yield from self._emit(final=False)
+
+    def flush(self) -> Iterator[Dict[str, Any]]:
+        """
+        Packs and yields the documents left in the window at the end of the stream.
+        """
+        yield from self._emit(final=True)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Packing efficiency: the fraction of real (non-padding) tokens if every sequence
+        were padded to seq_len, and the fraction of documents that had to be split.
+        """
+        return {
+            "real_token_fraction": self.num_tokens / (self.num_sequences * self.seq_len) if self.num_sequences else 0.0,
+            "split_doc_fraction": self.num_split_docs / self.num_docs if self.num_docs else 0.0,
+            "num_sequences": self.num_sequences,
+            "num_docs": self.num_docs,
+        }
+
+    def _emit(self, final: bool) -> Iterator[Dict[str, Any]]:
+        if self._window:
+            self._sequences.extend(self._best_fit(self._window))
+            self._window = []
+        # Without the final flag, keep the last (possibly partial) batch for the next window
+        while self._sequences:
+            num_sequences, num_tokens = 0, 0
+            for sequence in self._sequences:
+                length = sum(len(tokens) - 1 for _, tokens in sequence)
+                if num_tokens + length > self.token_budget:
+                    break
+                num_sequences += 1
+                num_tokens += length
+            if num_sequences == len(self._sequences) and not final:
+                return
+            batch, self._sequences = self._sequences[:num_sequences], self._sequences[num_sequences:]
+            yield self._collate(batch)
+
+    def _best_fit(self, docs: List[Tuple[int, np.ndarray]]) -> List[List[Tuple[int, np.ndarray]]]:
+        # Split documents longer than one sequence; pieces overlap by one token so that no target is lost
+        pieces = []
+        for doc_idx, tokens in docs:
+            self.num_docs += 1
+            if len(tokens) - 1 > self.seq_len:
+                self.num_split_docs += 1
+            for start in range(0, len(tokens) - 1, self.seq_len):
+                pieces.append((doc_idx, tokens[start:start + self.seq_len + 1]))
+        pieces.sort(key=lambda piece: len(piece[1]), reverse=True)
+
+        sequences: List[List[Tuple[int, np.ndarray]]] = []
+        # Sorted (remaining room, sequence index) of the open sequences
+        room: List[Tuple[int, int]] = []
+        for piece in pieces:
+            length = len(piece[1]) - 1
+            i = bisect.bisect_left(room, (length, -1))
+            if i < len(room):
+                remaining, index = room.pop(i)
+                sequences[index].append(piece)
+            else:
+                remaining, index = self.seq_len, len(sequences)
+                sequences.append([piece])
+            if remaining - length > 0:
+                bisect.insort(room, (remaining - length, index))
+
+        self.num_sequences += len(sequences)
+        self.num_tokens += sum(len(tokens) - 1 for _, tokens in pieces)
+        return sequences
+
+    def _collate(self, sequences: List[List[Tuple[int, np.ndarray]]]) -> Dict[str, Any]:
+        pieces = [piece for sequence in sequences for piece in sequence]
+        lengths = np.array([len(tokens) - 1 for _, tokens in pieces], dtype=np.int64)
+        cu_seqlens = np.zeros(len(pieces) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=cu_seqlens[1:])
+
+        input_ids = np.concatenate([tokens[:-1] for _, tokens in pieces])
+        target = np.concatenate([tokens[1:] for _, tokens in pieces])
+        sequence_id = np.repeat([doc_idx for doc_idx, _ in pieces], lengths)
+        position_ids = np.arange(cu_seqlens[-1]) - np.repeat(cu_seqlens[:-1], lengths)
+
+        return {
+            "input": {
+                "input_ids": torch.from_numpy(input_ids)[None],
+                "sequence_id": torch.from_numpy(sequence_id)[None],
+                "position_ids": torch.from_numpy(position_ids)[None],
+                "cu_seqlens": torch.from_numpy(cu_seqlens).to(torch.int32),
+                "max_seqlen": int(lengths.max()),
+            },
+            "target": torch.from_numpy(target)[None]
+        }
+
+    def state_dict(self) -> Dict[str, Any]:
+        """
+        Returns the documents of the window and the packed sequences not emitted yet.
+        """
+        return {
+            "window": [(doc_idx, torch.from_numpy(tokens.copy())) for doc_idx, tokens in self._window],
+            "sequences": [
+                [(doc_idx, torch.from_numpy(tokens.copy())) for doc_idx, tokens in sequence]
+                for sequence in self._sequences
+            ],
+            "stats": [self.num_docs, self.num_split_docs, self.num_sequences, self.num_tokens],
+        }
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        """
+        Restores the window and pending sequences of a previous `state_dict`.
+        """
+        self._window = [(doc_idx, np.asarray(tokens)) for doc_idx, tokens in state_dict["window"]]
+        self._sequences = [
+            [(doc_idx, np.asarray(tokens)) for doc_idx, tokens in sequence]
+            for sequence in state_dict["sequences"]
+        ]
+        self.num_docs, self.num_split_docs, self.num_sequences, self.num_tokens = state_dict["stats"]
+        self.doc_offset = 0
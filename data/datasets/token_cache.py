@@ -0,0 +1,196 @@
+import fcntl
+import hashlib
+import os
+import struct
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_MAGIC = b"TOKC"
+# magic, token itemsize, number of tokens
+_HEADER = struct.Struct("<4sB3xQ")
+_SUFFIX = ".tok"
+# Token dtype of an entry, by item size
+_DTYPES = {2: np.dtype(np.uint16), 4: np.dtype(np.uint32)}
+
+
+def tokenizer_fingerprint(tokenizer: Any) -> str:
+    """
+    Returns a string identifying the tokenizer (name and vocabulary hash).
+
+    Tokenizers can define a `fingerprint` attribute (see `HuggingFaceTokenizer.fingerprint`).
+    """
+    fingerprint = getattr(tokenizer, "fingerprint", None)
+    if fingerprint is None:
+        raise ValueError(
+            f"{type(tokenizer).__name__} does not define a `fingerprint`, which is required to cache its output"
+        )
+    return fingerprint
+
+
+class TokenCache:
+    """
+    Content-addressed on-disk cache of tokenized documents.
+
+    Every document is its own entry, keyed by the tokenizer fingerprint, the encode options
+    (e.g. `append_eot`) and a hash of the document's text, so that a document hits the
+    cache whatever batch it comes in. Entries are stored as a small header followed by the
+    tokens, as `uint16` if every id of the document fits and `uint32` otherwise.
+
+    The cache is safe to share between DataLoader workers and runs on the same machine:
+    entries are written to a temporary file and atomically renamed, and eviction runs
+    under an exclusive file lock. Reads refresh the entry's modification time, and once
+    the cache grows past `max_bytes` the least recently used entries are deleted.
+    """
+    def __init__(self, cache_dir: str, tokenizer: Any, max_bytes: int = 10 * 2**30):
+        """
+        Args:
+            cache_dir: Directory holding the cache. Created if missing.
+            tokenizer: The tokenizer whose output is cached.
+            max_bytes: Size of the cache above which least recently used entries are evicted.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._namespace = hashlib.sha256(tokenizer_fingerprint(tokenizer).encode()).digest()
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_written = 0
+        self._bytes_since_eviction = 0
+
+    def key(self, text: str, **encode_options: Any) -> str:
+        """Cache key of a document encoded with `encode_options`."""
+        h = hashlib.sha256(self._namespace)
+        options = repr(sorted(encode_options.items())).encode("utf-8")
+        h.update(struct.pack("<Q", len(options)))
+        h.update(options)
+        h.update(text.encode("utf-8"))
+        return h.hexdigest()
+
+    def get_or_tokenize(
+        self,
+        texts: Sequence[str],
+        encode_batch: Callable[..., Tuple[np.ndarray, np.ndarray]],
+        **encode_options: Any,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the tokens of a batch of documents. Documents missing from the cache are
+        encoded in a single `encode_batch(missing_texts, **encode_options)` call.
+
+        Returns:
+            The flat tokens and the `len(texts) + 1` document offsets, as returned by
+            `TokenizerTemplate.encode_batch`.
+        """
+        keys = [self.key(text, **encode_options) for text in texts]
+        documents: List[Optional[np.ndarray]] = [None] * len(texts)
+        missing = []
+        for i, key in enumerate(keys):
+            path = self._path(key)
+            try:
+                documents[i] = self._read(path)
+            except (FileNotFoundError, ValueError, struct.error):
+                missing.append(i)
+                continue
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            tokens, offsets = encode_batch([texts[i] for i in missing], **encode_options)
+            tokens = np.asarray(tokens)
+            for i, start, stop in zip(missing, offsets[:-1], offsets[1:]):
+                documents[i] = tokens[start:stop]
+                self._write(self._path(keys[i]), documents[i])
+
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum([len(document) for document in documents], out=offsets[1:])
+        tokens = np.concatenate(documents) if documents else np.empty(0, dtype=np.uint16)
+        return tokens, offsets
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters of this process and the current size of the cache."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "bytes_written": self.bytes_written,
+            "cache_bytes": sum(size for _, _, size in self._entries()),
+        }
+
+    def evict(self) -> None:
+        """Deletes least recently used entries until the cache is below `max_bytes`."""
+        with open(os.path.join(self.cache_dir, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = self._entries()
+            total = sum(size for _, _, size in entries)
+            if total <= self.max_bytes:
+                return
+            # Evict down to 90% so that eviction does not run on every write
+            target = int(0.9 * self.max_bytes)
+            for _, path, size in sorted(entries):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                if total <= target:
+                    break
+        self._bytes_since_eviction = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + _SUFFIX)
+
+    def _entries(self) -> List[tuple]:
+        entries = []
+        for subdir in os.scandir(self.cache_dir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if not entry.name.endswith(_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def _read(self, path: str) -> np.ndarray:
+        with open(path, "rb") as f:
+            magic, itemsize, num_tokens = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC or itemsize not in _DTYPES:
+                raise ValueError(f"Invalid cache entry: {path}")
+            tokens = np.fromfile(f, dtype=_DTYPES[itemsize], count=num_tokens)
+        if len(tokens) != num_tokens:
+            raise ValueError(f"Truncated cache entry: {path}")
+        return tokens
+
+    def _write(self, path: str, tokens: np.ndarray) -> None:
+        if len(tokens) and tokens.min() < 0:
+            raise ValueError(f"Token ids must be non-negative, got {tokens.min()}")
+        max_token_id = tokens.max() if len(tokens) else 0
+        dtype = _DTYPES[2] if max_token_id <= np.iinfo(np.uint16).max else _DTYPES[4]
+        tokens = tokens.astype(dtype, copy=False)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, dtype.itemsize, len(tokens)))
+                tokens.tofile(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        size = _HEADER.size + tokens.nbytes
+        self.bytes_written += size
+        self._bytes_since_eviction += size
+        if self._bytes_since_eviction >= 0.05 * self.max_bytes:
+            self.evict()
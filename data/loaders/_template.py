@@ -0,0 +1,15 @@
+from typing import Any, Dict, Iterator, Protocol, runtime_checkable
+
+@runtime_checkable
+class LoaderTemplate(Protocol):
+    """
+    Protocol describing a loader.
+
+    A loader wraps a `torch.utils.data.DataLoader` and yields batches ready to be consumed
+    by the model (e.g. already on the target device).
+    """
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        ...
+
+    def __len__(self) -> int:
+        ...
@@ -0,0 +1,142 @@
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, Optional, Union
+
+import torch
+from torch.utils.data import DataLoader
+
+_END = object()
+
+
+def _apply(data: Any, fn) -> Any:
+    """Applies `fn` to every tensor of a (nested) dict/list/tuple batch."""
+    if isinstance(data, torch.Tensor):
+        return fn(data)
+    if isinstance(data, dict):
+        return {key: _apply(value, fn) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        items = [_apply(value, fn) for value in data]
+        # Namedtuples take their fields as separate arguments
+        return type(data)(*items) if hasattr(data, "_fields") else type(data)(items)
+    return data
+
+
+class PrefetchLoader:
+    """
+    Wraps a DataLoader and prefetches batches onto the target device in a background thread.
+
+    While the training step k runs, the thread fetches the next batches from the DataLoader,
+    pins them and starts their host-to-device copy with `non_blocking=True` on a side CUDA
+    stream, so that batch k + 1 is transferred while step k computes. Batches can be nested
+    dicts such as {"input": {...}, "target": ...}.
+
+    The time each step waited for data is accumulated into running totals, and the last
+    `wait_window` waits are kept in `wait_times` (seconds), see `stats`.
+    """
+    def __init__(
+        self,
+        dataloader: DataLoader,
+        device: Union[str, torch.device] = "cuda",
+        num_prefetch: int = 2,
+        pin_memory: bool = True,
+        wait_window: int = 1000,
+    ):
+        """
+        Args:
+            dataloader: The DataLoader to wrap.
+            device: Device batches are moved to.
+            num_prefetch: Number of batches prepared ahead of the training step.
+            pin_memory: Whether to pin batches before copying them. Only used for CUDA devices.
+            wait_window: Number of most recent wait times kept in `wait_times`.
+        """
+        if num_prefetch < 1:
+            raise ValueError(f"num_prefetch must be >= 1, got {num_prefetch}")
+        self.dataloader = dataloader
+        self.device = torch.device(device)
+        self.num_prefetch = num_prefetch
+        self.pin_memory = pin_memory and self.device.type == "cuda"
+        self.wait_times: Deque[float] = deque(maxlen=wait_window)
+        self.num_steps = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def __len__(self) -> int:
+        return len(self.dataloader)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        stream = torch.cuda.Stream(self.device) if self.device.type == "cuda" else None
+        batches: queue.Queue = queue.Queue(maxsize=self.num_prefetch)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._worker, args=(batches, stop, stream), daemon=True)
+        thread.start()
+
+        try:
+            while True:
+                start = time.perf_counter()
+                item = batches.get()
+                if item is _END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                batch, event = item
+                if event is not None:
+                    # Make the compute stream wait for the copy, and keep the memory alive
+                    # until the compute stream is done with it
+                    current = torch.cuda.current_stream(self.device)
+                    current.wait_event(event)
+                    _apply(batch, lambda t: t.record_stream(current) if t.is_cuda else None)
+                self._record_wait(time.perf_counter() - start)
+                yield batch
+        finally:
+            stop.set()
+            # Unblock the worker if it is waiting on a full queue
+            while thread.is_alive():
+                try:
+                    batches.get_nowait()
+                except queue.Empty:
+                    thread.join(timeout=0.01)
+
+    def _worker(self, batches: queue.Queue, stop: threading.Event, stream: Optional["torch.cuda.Stream"]) -> None:
+        try:
+            for batch in self.dataloader:
+                if stop.is_set():
+                    return
+                event = None
+                if stream is not None:
+                    with torch.cuda.stream(stream):
+                        batch = self._to_device(batch)
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                else:
+                    batch = self._to_device(batch)
+                batches.put((batch, event))
+        except BaseException as e:
+            batches.put(e)
+            return
+        batches.put(_END)
+
+    def _to_device(self, batch: Any) -> Any:
+        if self.pin_memory:
+            batch = _apply(batch, lambda t: t if t.is_pinned() else t.pin_memory())
+        return _apply(batch, lambda t: t.to(self.device, non_blocking=True))
+
+    def _record_wait(self, wait: float) -> None:
+        self.wait_times.append(wait)
+        self.num_steps += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Summary of the time steps waited for data, in seconds: over all steps, and the mean
+        over the last `wait_window` steps (`recent_mean_wait`).
+        """
+        return {
+            "steps": self.num_steps,
+            "total_wait": self.total_wait,
+            "mean_wait": self.total_wait / self.num_steps if self.num_steps else 0.0,
+            "max_wait": self.max_wait,
+            "recent_mean_wait": sum(self.wait_times) / len(self.wait_times) if self.wait_times else 0.0,
+        }
@@ -0,0 +1,205 @@
+"""
+One-shot pre-tokenization of a HuggingFace dataset into memory-mapped token shards.
+
+Usage:
+    python -m data.pretokenize \\
+        --tokenizer configs/modeling/tokenizers/gpt2.yaml \\
+        --dataset HuggingFaceFW/fineweb --subset sample-10BT --split train \\
+        --output-dir /data/fineweb-gpt2
+
+The output directory contains, for every shard, a flat `shard_XXXXX.bin` token file
+(`uint16` if every token id the tokenizer can produce fits, `uint32` otherwise) and a `shard_XXXXX.idx.npy`
+file with the start offset of every document within the shard, plus a `metadata.json`
+describing the shards. It is read by `data.datasets.memmap.MemmapTokenDataset`.
+"""
+import argparse
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+METADATA_FILE = "metadata.json"
+
+
+def token_dtype(max_token_id: int) -> np.dtype:
+    """Smallest unsigned integer dtype able to store every token id up to `max_token_id`."""
+    return np.dtype(np.uint16) if max_token_id <= np.iinfo(np.uint16).max else np.dtype(np.uint32)
+
+
+class ShardWriter:
+    """
+    Writes documents into fixed-width token shards and a document-boundary index.
+
+    Documents are never split across shards; a shard is closed as soon as it holds
+    at least `max_shard_tokens` tokens. Token ids that do not fit `dtype` raise a
+    ValueError instead of wrapping around.
+    """
+    def __init__(self, output_dir: str, dtype: np.dtype, max_shard_tokens: int = 100_000_000):
+        """
+        Args:
+            output_dir: Directory the shards are written to. Created if missing.
+            dtype: Token dtype (`uint16` or `uint32`).
+            max_shard_tokens: Soft limit on the number of tokens per shard.
+        """
+        self.output_dir = output_dir
+        self.dtype = np.dtype(dtype)
+        self.max_shard_tokens = max_shard_tokens
+        self.shards: List[Dict[str, Any]] = []
+        os.makedirs(output_dir, exist_ok=True)
+
+        self._file = None
+        self._num_tokens = 0
+        self._doc_starts: List[int] = []
+
+    def write(self, tokens: Any) -> None:
+        """Appends one tokenized document."""
+        if self._file is None:
+            self._open()
+        tokens = np.asarray(tokens)
+        if len(tokens) and (tokens.min() < 0 or tokens.max() > np.iinfo(self.dtype).max):
+            raise ValueError(
+                f"Token ids must be in [0, {np.iinfo(self.dtype).max}] to be stored as {self.dtype.name}, "
+                f"got ids in [{tokens.min()}, {tokens.max()}]"
+            )
+        tokens = tokens.astype(self.dtype, copy=False)
+        self._doc_starts.append(self._num_tokens)
+        tokens.tofile(self._file)
+        self._num_tokens += len(tokens)
+        if self._num_tokens >= self.max_shard_tokens:
+            self._close()
+
+    def finalize(self, **metadata: Any) -> None:
+        """Closes the last shard and writes `metadata.json`."""
+        if self._file is not None:
+            self._close()
+        metadata = {
+            "dtype": self.dtype.name,
+            "num_tokens": sum(shard["num_tokens"] for shard in self.shards),
+            "num_docs": sum(shard["num_docs"] for shard in self.shards),
+            "shards": self.shards,
+            **metadata,
+        }
+        with open(os.path.join(self.output_dir, METADATA_FILE), "w") as f:
+            json.dump(metadata, f, indent=2)
+
+    def _open(self) -> None:
+        name = f"shard_{len(self.shards):05d}"
+        self._name = name
+        self._file = open(os.path.join(self.output_dir, f"{name}.bin"), "wb")
+        self._num_tokens = 0
+        self._doc_starts = []
+
+    def _close(self) -> None:
+        self._file.close()
+        self._file = None
+        np.save(
+            os.path.join(self.output_dir, f"{self._name}.idx.npy"),
+            np.asarray(self._doc_starts, dtype=np.int64)
+        )
+        self.shards.append({
+            "tokens": f"{self._name}.bin",
+            "index": f"{self._name}.idx.npy",
+            "num_tokens": self._num_tokens,
+            "num_docs": len(self._doc_starts),
+        })
+
+
+def pretokenize(
+    tokenizer: Any,
+    output_dir: str,
+    dataset_name: str,
+    subset: Optional[str] = None,
+    split: str = "train",
+    text_column: str = "text",
+    tokenization_batch_size: int = 1000,
+    max_shard_tokens: int = 100_000_000,
+    max_docs: Optional[int] = None,
+    append_eot: bool = False,
+) -> Dict[str, Any]:
+    """
+    Streams a HuggingFace dataset through `tokenizer` and writes token shards to `output_dir`.
+
+    Args:
+        tokenizer: The tokenizer instance (see `modeling.tokenizers`).
+        output_dir: Output directory.
+        dataset_name: HuggingFace dataset name.
+        subset: Dataset subset/config name.
+        split: Dataset split to load.
+        text_column: Name of the column holding the raw text.
+        tokenization_batch_size: Number of documents tokenized at once.
+        max_shard_tokens: Soft limit on the number of tokens per shard.
+        max_docs: Optional limit on the number of documents to process.
+        append_eot: Whether to append `tokenizer.eot_token_id` to every document.
+
+    Returns:
+        The metadata written to `metadata.json`.
+    """
+    from datasets import load_dataset
+
+    dataset = load_dataset(dataset_name, name=subset, split=split, streaming=True)
+    # The EOT token can lie outside of `vocab_size`, e.g. when it is an added token
+    max_token_id = max(tokenizer.vocab_size - 1, tokenizer.eot_token_id if append_eot else 0)
+    writer = ShardWriter(output_dir, token_dtype(max_token_id), max_shard_tokens)
+
+    num_docs = 0
+    for batch in dataset.iter(batch_size=tokenization_batch_size):
+        texts = batch[text_column]
+        if max_docs is not None:
+            texts = texts[:max_docs - num_docs]
+        tokens, offsets = tokenizer.encode_batch(texts, append_eot=append_eot)
+        for start, stop in zip(offsets[:-1], offsets[1:]):
+            writer.write(tokens[start:stop])
+        num_docs += len(texts)
+        if max_docs is not None and num_docs >= max_docs:
+            break
+
+    writer.finalize(
+        vocab_size=tokenizer.vocab_size,
+        dataset_name=dataset_name,
+        subset=subset,
+        split=split,
+        append_eot=append_eot,
+    )
+    with open(os.path.join(output_dir, METADATA_FILE)) as f:
+        return json.load(f)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokenizer", required=True, help="Path to a tokenizer config, e.g. configs/modeling/tokenizers/gpt2.yaml")
+    parser.add_argument("--dataset", required=True, help="HuggingFace dataset name")
+    parser.add_argument("--subset", default=None, help="Dataset subset/config name")
+    parser.add_argument("--split", default="train", help="Dataset split")
+    parser.add_argument("--text-column", default="text", help="Column holding the raw text")
+    parser.add_argument("--output-dir", required=True, help="Output directory for the shards")
+    parser.add_argument("--tokenization-batch-size", type=int, default=1000)
+    parser.add_argument("--max-shard-tokens", type=int, default=100_000_000)
+    parser.add_argument("--max-docs", type=int, default=None)
+    parser.add_argument("--append-eot", action="store_true", help="Append the EOT token to every document")
+    args = parser.parse_args(argv)
+
+    from hydra.utils import instantiate
+    from omegaconf import OmegaConf
+
+    tokenizer = instantiate(OmegaConf.load(args.tokenizer))
+    metadata = pretokenize(
+        tokenizer,
+        output_dir=args.output_dir,
+        dataset_name=args.dataset,
+        subset=args.subset,
+        split=args.split,
+        text_column=args.text_column,
+        tokenization_batch_size=args.tokenization_batch_size,
+        max_shard_tokens=args.max_shard_tokens,
+        max_docs=args.max_docs,
+        append_eot=args.append_eot,
+    )
+    print(
+        f"Wrote {metadata['num_tokens']} tokens from {metadata['num_docs']} documents "
+        f"into {len(metadata['shards'])} shards ({metadata['dtype']}) at {args.output_dir}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import inspect
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Sequence
+
+import torch
+import torch.nn as nn
+
+from modeling.generation.kv_cache import PagedKVCache
+from modeling.generation.sampling import sample
+from modeling.models._template import ModelTemplate
+from modeling.tokenizers._template import TokenizerTemplate
+
+
+class _Request:
+    def __init__(self, index: int, prompt: List[int], max_new_tokens: int):
+        self.index = index
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.output: List[int] = []
+        self.first_token_time: Optional[float] = None
+
+
+class GenerationEngine:
+    """
+    Batched autoregressive generation with a paged KV cache and continuous batching.
+
+    Up to `max_batch_size` requests run at once. A request is admitted as soon as a slot is
+    free and the cache has room for its prompt and `max_new_tokens`; its prompt is then
+    processed in one prefill pass, and it joins the batched decode steps of the running
+    requests, which produce one token per request and per step. Every iteration runs one
+    decode step, then the prefill of the requests admitted in the slots it freed. A request
+    leaves the batch when it samples `eot_token_id` (not included in the output), reaches
+    `max_new_tokens` or `max_seq_len`, and its pages go back to the cache for the next request.
+
+    Models whose `forward` accepts `kv_cache` and `position_ids` (e.g. `modeling.models.gpt.GPT`)
+    only process the new tokens at every step. Other models are run on the full sequence of
+    every request at every step, which is quadratic in the length but works with any model.
+    Models may return logits or `{"hidden_states", "lm_head_weight"}`, see `GPT`.
+
+    After every `generate` call, `stats` holds the number of generated tokens, the generation
+    throughput (tokens/s) and the mean and max time to first token, measured from the call.
+    """
+    def __init__(
+        self,
+        model: ModelTemplate,
+        tokenizer: TokenizerTemplate,
+        max_batch_size: int = 8,
+        max_seq_len: int = 1024,
+        max_new_tokens: int = 128,
+        page_size: int = 16,
+        num_pages: Optional[int] = None,
+        temperature: float = 1.0,
+        top_k: Optional[int] = None,
+        top_p: Optional[float] = None,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            model: The model to generate with.
+            tokenizer: Its tokenizer, for `eot_token_id` and the text interface.
+            max_batch_size: Maximum number of requests decoded together.
+            max_seq_len: Maximum length of a request, prompt included.
+            max_new_tokens: Default maximum number of generated tokens per request.
+            page_size: Number of tokens per KV cache page.
+            num_pages: Number of KV cache pages. Defaults to enough pages for
+                       `max_batch_size` requests of `max_seq_len` tokens.
+            temperature: Sampling temperature, 0 for greedy decoding.
+            top_k: Top-k sampling, None to disable.
+            top_p: Nucleus sampling, None to disable.
+            seed: Seed of the sampling generator.
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_seq_len = max_seq_len
+        self.max_new_tokens = max_new_tokens
+        self.page_size = page_size
+        if num_pages is None:
+            num_pages = max_batch_size * -(-max_seq_len // page_size)
+        self.num_pages = num_pages
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.seed = seed
+
+        self.device = next(model.parameters()).device if isinstance(model, nn.Module) else torch.device("cpu")
+        self.use_kv_cache = "kv_cache" in inspect.signature(model.forward).parameters
+        self.kv_cache: Optional[PagedKVCache] = None
+        self.stats: Dict[str, Any] = {}
+
+    @torch.inference_mode()
+    def generate(self, prompts: Sequence[Sequence[int]], max_new_tokens: Optional[int] = None) -> List[List[int]]:
+        """
+        Generates a continuation of every prompt.
+
+        Args:
+            prompts: Token ids of the prompts. They can have different lengths.
+            max_new_tokens: Maximum number of generated tokens per request. Defaults to the
+                            engine's `max_new_tokens`.
+
+        Returns:
+            The generated token ids of every prompt, in order, without the prompt and `eot_token_id`.
+        """
+        max_new_tokens = self.max_new_tokens if max_new_tokens is None else max_new_tokens
+        if max_new_tokens < 1:
+            raise ValueError(f"max_new_tokens must be >= 1, got {max_new_tokens}")
+        generator = torch.Generator(self.device).manual_seed(self.seed)
+        if self.use_kv_cache and self.kv_cache is None:
+            self.kv_cache = PagedKVCache(self.num_pages, self.page_size)
+        eot = self.tokenizer.eot_token_id
+        training = self.model.training
+        self.model.eval()
+
+        pending: Deque[_Request] = deque()
+        for i, prompt in enumerate(prompts):
+            prompt = list(prompt)
+            if not 0 < len(prompt) < self.max_seq_len:
+                raise ValueError(f"Prompt {i} has {len(prompt)} tokens, expected 1 to {self.max_seq_len - 1}")
+            pending.append(_Request(i, prompt, min(max_new_tokens, self.max_seq_len - len(prompt))))
+        running: List[_Request] = []
+        finished: List[_Request] = []
+
+        start = time.perf_counter()
+        try:
+            while pending or running:
+                # Decode step of the running requests, then prefill of the newly admitted ones
+                if running:
+                    logits = self._forward(running, [[r.output[-1]] for r in running])
+                    self._append(running, logits, generator, start)
+                    running = self._retire(running, finished, eot)
+
+                admitted = []
+                while pending and len(running) + len(admitted) < self.max_batch_size and self._can_admit(pending[0]):
+                    request = pending.popleft()
+                    if self.kv_cache is not None:
+                        self.kv_cache.add_sequence(request.index, len(request.prompt) + request.max_new_tokens)
+                    admitted.append(request)
+                if pending and not admitted and not running:
+                    raise RuntimeError("The KV cache is too small for the next request")
+                if admitted:
+                    logits = self._forward(admitted, [r.prompt for r in admitted])
+                    self._append(admitted, logits, generator, start)
+                    running.extend(self._retire(admitted, finished, eot))
+        finally:
+            self.model.train(training)
+            if self.kv_cache is not None:
+                for seq_id in list(self.kv_cache.block_tables):
+                    self.kv_cache.free(seq_id)
+        elapsed = time.perf_counter() - start
+
+        num_tokens = sum(len(r.output) for r in finished)
+        ttft = [r.first_token_time for r in finished]
+        self.stats = {
+            "num_tokens": num_tokens,
+            "time": elapsed,
+            "tokens_per_second": num_tokens / elapsed if elapsed > 0 else 0.0,
+            "mean_time_to_first_token": sum(ttft) / len(ttft) if ttft else 0.0,
+            "max_time_to_first_token": max(ttft) if ttft else 0.0,
+        }
+        outputs = [r.output[:-1] if r.output and r.output[-1] == eot else r.output
+                   for r in sorted(finished, key=lambda r: r.index)]
+        return outputs
+
+    def generate_text(self, texts: List[str], max_new_tokens: Optional[int] = None) -> List[str]:
+        """
+        Encodes the prompts with the tokenizer, generates, and decodes the continuations.
+        """
+        tokens, offsets = self.tokenizer.encode_batch(texts)
+        prompts = [tokens[offsets[i]:offsets[i + 1]].tolist() for i in range(len(texts))]
+        return [self.tokenizer.decode(output) for output in self.generate(prompts, max_new_tokens)]
+
+    def _can_admit(self, request: _Request) -> bool:
+        return self.kv_cache is None or self.kv_cache.can_add(len(request.prompt) + request.max_new_tokens)
+
+    def _forward(self, requests: List[_Request], new_tokens: List[List[int]]) -> torch.Tensor:
+        """Runs the model on the new tokens of the requests and returns their next-token logits."""
+        if not self.use_kv_cache:
+            # Full sequences, right-padded; causal models ignore the padding after the last token
+            sequences = [r.prompt + r.output for r in requests]
+            lengths = [len(s) for s in sequences]
+            num_new = lengths
+            input_ids = torch.tensor([s + [0] * (max(lengths) - len(s)) for s in sequences], device=self.device)
+            output = self.model(input_ids=input_ids)
+        else:
+            num_new = [len(tokens) for tokens in new_tokens]
+            input_ids = torch.tensor(
+                [tokens + [0] * (max(num_new) - len(tokens)) for tokens in new_tokens], device=self.device
+            )
+            position_ids = self.kv_cache.begin_step([r.index for r in requests], num_new, self.device)
+            try:
+                output = self.model(input_ids=input_ids, position_ids=position_ids, kv_cache=self.kv_cache)
+            finally:
+                self.kv_cache.end_step()
+        last = torch.tensor(num_new, device=self.device) - 1
+        rows = torch.arange(len(requests), device=self.device)
+        if isinstance(output, dict):
+            hidden = output["hidden_states"][rows, last]
+            return hidden @ output["lm_head_weight"].t()
+        return output[rows, last]
+
+    def _append(self, requests: List[_Request], logits: torch.Tensor, generator: torch.Generator,
+                start: float) -> None:
+        tokens = sample(logits, self.temperature, self.top_k, self.top_p, generator).tolist()
+        now = time.perf_counter() - start
+        for request, token in zip(requests, tokens):
+            if request.first_token_time is None:
+                request.first_token_time = now
+            request.output.append(token)
+
+    def _retire(self, running: List[_Request], finished: List[_Request], eot: int) -> List[_Request]:
+        still_running = []
+        for request in running:
+            if request.output[-1] == eot or len(request.output) >= request.max_new_tokens:
+                finished.append(request)
+                if self.kv_cache is not None:
+                    self.kv_cache.free(request.index)
+            else:
+                still_running.append(request)
+        return still_running
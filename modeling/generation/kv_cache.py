@@ -0,0 +1,131 @@
+from typing import Dict, List, Optional
+
+import torch
+import torch.nn.functional as F
+
+
+class PagedKVCache:
+    """
+    Preallocated key/value cache split into fixed-size pages.
+
+    Each layer's keys and values live in one flat buffer of `num_pages * page_size` token slots.
+    A sequence owns a list of pages (its block table), reserved when it is added and returned
+    to the free list when it is freed, so sequences of different lengths share the buffer
+    without fragmentation and without reallocating as they grow. The buffers are allocated on
+    the first forward pass, with the number of heads, head dimension, dtype and device of the
+    model's keys.
+
+    A forward pass over new tokens of several sequences is framed by `begin_step` and
+    `end_step`; in between, the model calls `attention(layer_idx, q, k, v)` in every layer,
+    which writes the new keys and values into the sequences' pages and attends over everything
+    cached so far.
+    """
+    def __init__(self, num_pages: int, page_size: int = 16):
+        """
+        Args:
+            num_pages: Number of pages of the cache.
+            page_size: Number of tokens per page.
+        """
+        if num_pages < 1 or page_size < 1:
+            raise ValueError(f"num_pages and page_size must be >= 1, got {num_pages} and {page_size}")
+        self.num_pages = num_pages
+        self.page_size = page_size
+        self.keys: Dict[int, torch.Tensor] = {}
+        self.values: Dict[int, torch.Tensor] = {}
+        self.free_pages: List[int] = list(range(num_pages - 1, -1, -1))
+        self.block_tables: Dict[int, List[int]] = {}
+        self.lengths: Dict[int, int] = {}
+        self._step: Optional[Dict[str, torch.Tensor]] = None
+
+    def pages_needed(self, num_tokens: int) -> int:
+        return -(-num_tokens // self.page_size)
+
+    def can_add(self, num_tokens: int) -> bool:
+        """Whether a sequence of up to `num_tokens` tokens fits in the free pages."""
+        return self.pages_needed(num_tokens) <= len(self.free_pages)
+
+    def add_sequence(self, seq_id: int, max_tokens: int) -> None:
+        """
+        Reserves the pages of a sequence of up to `max_tokens` tokens (prompt and generated).
+        """
+        if seq_id in self.block_tables:
+            raise ValueError(f"Sequence {seq_id} is already in the cache")
+        if not self.can_add(max_tokens):
+            raise RuntimeError(
+                f"Not enough free pages for {max_tokens} tokens ({len(self.free_pages)} of {self.num_pages} free)"
+            )
+        self.block_tables[seq_id] = [self.free_pages.pop() for _ in range(self.pages_needed(max_tokens))]
+        self.lengths[seq_id] = 0
+
+    def free(self, seq_id: int) -> None:
+        """Returns the pages of a sequence to the free list."""
+        self.free_pages.extend(reversed(self.block_tables.pop(seq_id)))
+        del self.lengths[seq_id]
+
+    def begin_step(self, seq_ids: List[int], num_new: List[int], device: torch.device) -> torch.Tensor:
+        """
+        Prepares a forward pass over `num_new[i]` new tokens of every sequence `seq_ids[i]`,
+        laid out as a right-padded [B, max(num_new)] batch.
+
+        Returns:
+            The [B, max(num_new)] position ids of the new tokens.
+        """
+        for seq_id, n in zip(seq_ids, num_new):
+            capacity = len(self.block_tables[seq_id]) * self.page_size
+            if self.lengths[seq_id] + n > capacity:
+                raise RuntimeError(f"Sequence {seq_id} exceeds its {capacity} reserved tokens")
+        num_queries = max(num_new)
+        # Only the pages holding tokens are read, padded with page 0 (masked out)
+        used = [self.block_tables[seq_id][:self.pages_needed(self.lengths[seq_id] + n)]
+                for seq_id, n in zip(seq_ids, num_new)]
+        max_pages = max(len(pages) for pages in used)
+        tables = torch.tensor([pages + [0] * (max_pages - len(pages)) for pages in used], dtype=torch.long)
+        offsets = torch.tensor([self.lengths[seq_id] for seq_id in seq_ids], dtype=torch.long)
+        counts = torch.tensor(num_new, dtype=torch.long)
+
+        positions = offsets[:, None] + torch.arange(num_queries)
+        valid = torch.arange(num_queries) < counts[:, None]
+        # Flat slot of every cached position: page * page_size + offset within the page
+        slots = (tables[:, :, None] * self.page_size + torch.arange(self.page_size)).flatten(1)
+        write_slots = slots.gather(1, positions.clamp(max=slots.size(1) - 1))[valid]
+        kv_positions = torch.arange(slots.size(1))
+        mask = kv_positions <= positions[:, :, None]
+
+        self._step = {
+            "seq_ids": seq_ids,
+            "num_new": num_new,
+            "valid": valid.to(device),
+            "slots": slots.to(device),
+            "write_slots": write_slots.to(device),
+            "mask": mask[:, None].to(device),
+        }
+        return positions.to(device)
+
+    def attention(self, layer_idx: int, q: torch.Tensor, k: torch.Tensor, v: torch.Tensor) -> torch.Tensor:
+        """
+        Stores the new keys and values of a layer and attends over the cache.
+
+        Args:
+            layer_idx: Index of the calling layer.
+            q, k, v: [B, H, T, head_dim] queries, keys and values of the new tokens.
+        """
+        step = self._step
+        if step is None:
+            raise RuntimeError("PagedKVCache.attention called outside of begin_step/end_step")
+        if layer_idx not in self.keys:
+            shape = (self.num_pages * self.page_size, k.size(1), k.size(3))
+            self.keys[layer_idx] = torch.zeros(shape, dtype=k.dtype, device=k.device)
+            self.values[layer_idx] = torch.zeros(shape, dtype=v.dtype, device=v.device)
+        keys, values = self.keys[layer_idx], self.values[layer_idx]
+        keys.index_copy_(0, step["write_slots"], k.transpose(1, 2)[step["valid"]])
+        values.index_copy_(0, step["write_slots"], v.transpose(1, 2)[step["valid"]])
+        # [B, pages * page_size, H, head_dim] -> [B, H, pages * page_size, head_dim]
+        cached_k = keys[step["slots"]].transpose(1, 2)
+        cached_v = values[step["slots"]].transpose(1, 2)
+        return F.scaled_dot_product_attention(q, cached_k, cached_v, attn_mask=step["mask"])
+
+    def end_step(self) -> None:
+        """Commits the new tokens of the step."""
+        for seq_id, n in zip(self._step["seq_ids"], self._step["num_new"]):
+            self.lengths[seq_id] += n
+        self._step = None
@@ -0,0 +1,40 @@
+from typing import Optional
+
+import torch
+
+
+def sample(
+    logits: torch.Tensor,
+    temperature: float = 1.0,
+    top_k: Optional[int] = None,
+    top_p: Optional[float] = None,
+    generator: Optional[torch.Generator] = None,
+) -> torch.Tensor:
+    """
+    Samples one token per row of [B, vocab_size] logits.
+
+    Args:
+        logits: Next-token logits.
+        temperature: Softmax temperature. 0 selects the most likely token (greedy decoding).
+        top_k: Only sample among the `top_k` most likely tokens. None or 0 disables it.
+        top_p: Only sample among the smallest set of most likely tokens whose probability
+               reaches `top_p` (nucleus sampling). None or 1.0 disables it.
+        generator: Random number generator, on the device of `logits`.
+
+    Returns:
+        The [B] sampled token ids.
+    """
+    if temperature == 0:
+        return logits.argmax(dim=-1)
+    logits = logits.float() / temperature
+    if top_k:
+        kth = logits.topk(min(top_k, logits.size(-1)), dim=-1).values[:, -1:]
+        logits = logits.masked_fill(logits < kth, float("-inf"))
+    if top_p is not None and top_p < 1.0:
+        sorted_logits, order = logits.sort(dim=-1, descending=True)
+        cumulative = sorted_logits.softmax(dim=-1).cumsum(dim=-1)
+        # Drop a token when the more likely ones already reach top_p; the first one is always kept
+        drop = cumulative - sorted_logits.softmax(dim=-1) >= top_p
+        logits = logits.scatter(-1, order, sorted_logits.masked_fill(drop, float("-inf")))
+    probs = logits.softmax(dim=-1)
+    return torch.multinomial(probs, 1, generator=generator).squeeze(-1)
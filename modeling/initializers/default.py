@@ -1,13 +1,22 @@
+from typing import Optional
 from modeling.models._template import ModelTemplate
 from modeling.tokenizers._template import TokenizerTemplate
 from modeling.initializers._template import InitializerTemplate
+from modeling.initializers.materialize import initialize
 
 class DefaultInitializer:
     """
     Default initializer that performs no initialization (identity operation).
+
+    A model built on the `meta` device is materialized with the default initialization of its
+    modules (`reset_parameters`), see `modeling.initializers.materialize.initialize`.
     """
-    def __init__(self):
-        pass
+    def __init__(self, device: Optional[str] = None):
+        """
+        Args:
+            device: Device meta parameters are materialized on. Defaults to the default device.
+        """
+        self.device = device
 
     def __call__(self, model: ModelTemplate, tokenizer: TokenizerTemplate) -> None:
-        pass
+        initialize(model, {}, device=self.device)
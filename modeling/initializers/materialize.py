@@ -0,0 +1,221 @@
+import fnmatch
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+import torch
+import torch.nn as nn
+
+# (kind, std): ("normal", std), ("zeros", 0.0) or ("ones", 0.0)
+Init = Tuple[str, float]
+INIT_KINDS = ("normal", "zeros", "ones")
+# Random values are drawn in chunks of this many elements, each from its own generator
+CHUNK_NUMEL = 2**20
+
+
+def compile_patterns(patterns: Sequence[str]) -> Optional["re.Pattern[str]"]:
+    """
+    Compiles glob patterns (`fnmatch` syntax) into one regular expression, or None if there are none.
+    """
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(pattern)})" for pattern in patterns))
+
+
+def apply_order(module: nn.Module) -> Iterator[nn.Module]:
+    """Yields the modules in the order `module.apply` visits them (children first)."""
+    for child in module.children():
+        yield from apply_order(child)
+    yield module
+
+
+def parameter_aliases(model: nn.Module) -> Dict[str, List[str]]:
+    """
+    Returns, for every parameter name of `named_parameters()`, all the names the parameter has
+    in the model (more than one for tied parameters, e.g. a head sharing the embedding matrix).
+    """
+    canonical = {id(param): name for name, param in model.named_parameters()}
+    aliases: Dict[str, List[str]] = {name: [] for name in canonical.values()}
+    for name, param in model.named_parameters(remove_duplicate=False):
+        aliases[canonical[id(param)]].append(name)
+    return aliases
+
+
+def check_untied(aliases: Sequence[str], matched: Sequence[str], what: str) -> None:
+    """
+    Raises a ValueError if only some of the names of a tied parameter are to be initialized as
+    `what`: the initialization would silently apply to all of them.
+    """
+    others = [name for name in aliases if name not in matched]
+    if matched and others:
+        raise ValueError(
+            f"{matched[0]} is tied to {', '.join(others)}: {what} would apply to both. "
+            f"Untie them (e.g. `tie_weights: false` for GPT) or initialize them together."
+        )
+
+
+def chunk_seed(seed: int, name: str, chunk: int) -> int:
+    """Seed of one chunk of a parameter, a function of the parameter name only (not of the order)."""
+    digest = hashlib.blake2b(f"{seed}:{name}:{chunk}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") & (2**63 - 1)
+
+
+def materialize(model: nn.Module, device: Optional[Union[str, torch.device]] = None) -> Set[nn.Module]:
+    """
+    Allocates the parameters and buffers of a model built on the `meta` device (uninitialized),
+    keeping tied parameters tied. Does nothing for tensors that are not on the meta device.
+
+    Args:
+        model: The model.
+        device: Device the tensors are allocated on. Defaults to the default device.
+
+    Returns:
+        The modules that had meta tensors, whose parameters and buffers must now be initialized.
+    """
+    meta_modules = {
+        module for module in model.modules()
+        if any(t.is_meta for t in list(module.parameters(recurse=False)) + list(module.buffers(recurse=False)))
+    }
+    if not meta_modules:
+        return meta_modules
+    if device is None:
+        device = torch.get_default_device()
+    # Only meta tensors are replaced (`model.to_empty` would also discard the values of the
+    # others), once per tensor, so that tied parameters stay tied
+    replaced: Dict[int, torch.Tensor] = {}
+    for module in meta_modules:
+        for name, param in list(module.named_parameters(recurse=False)):
+            if not param.is_meta:
+                continue
+            if id(param) not in replaced:
+                replaced[id(param)] = nn.Parameter(
+                    torch.empty_like(param, device=device), requires_grad=param.requires_grad
+                )
+            setattr(module, name, replaced[id(param)])
+        for name, buffer in list(module.named_buffers(recurse=False)):
+            if buffer.is_meta:
+                if id(buffer) not in replaced:
+                    replaced[id(buffer)] = torch.empty_like(buffer, device=device)
+                module._buffers[name] = replaced[id(buffer)]
+    return meta_modules
+
+
+def _local_view(param: torch.Tensor) -> Tuple[torch.Tensor, Optional[Tuple[int, ...]]]:
+    """Returns the tensor to fill and, for a DTensor, the global offset of the local shard."""
+    from torch.distributed.tensor import DTensor
+    if not isinstance(param, DTensor):
+        return param.data, None
+    from torch.distributed.tensor._utils import compute_local_shape_and_global_offset
+    _, offset = compute_local_shape_and_global_offset(param.shape, param.device_mesh, param.placements)
+    return param.to_local(), tuple(offset)
+
+
+def _fill_normal(target: torch.Tensor, name: str, numel: int, start: int, std: float, seed: int,
+                 chunks: Sequence[int]) -> None:
+    """
+    Fills the contiguous `target`, holding flat elements [start, start + target.numel()) of a
+    parameter of `numel` elements, from the given chunks of the parameter's random stream.
+    """
+    flat = target.view(-1)
+    end = start + flat.numel()
+    for chunk in chunks:
+        chunk_start, chunk_end = chunk * CHUNK_NUMEL, min((chunk + 1) * CHUNK_NUMEL, numel)
+        generator = torch.Generator(target.device).manual_seed(chunk_seed(seed, name, chunk))
+        lo, hi = max(chunk_start, start), min(chunk_end, end)
+        if lo == chunk_start and hi == chunk_end:
+            flat[lo - start:hi - start].normal_(0.0, std, generator=generator)
+        else:
+            values = torch.empty(chunk_end - chunk_start, dtype=target.dtype, device=target.device)
+            values.normal_(0.0, std, generator=generator)
+            flat[lo - start:hi - start].copy_(values[lo - chunk_start:hi - chunk_start])
+
+
+def initialize(
+    model: nn.Module,
+    inits: Dict[str, Init],
+    seed: int = 0,
+    num_threads: Optional[int] = None,
+    device: Optional[Union[str, torch.device]] = None,
+) -> None:
+    """
+    Materializes a (possibly meta) model and writes the initial value of every parameter of
+    `inits` once, directly into its storage.
+
+    Random values depend only on `seed`, the parameter name and the element index: they are drawn
+    in chunks of `CHUNK_NUMEL` elements, each from a generator seeded by (seed, name, chunk). The
+    result is therefore independent of the order and of the parallelism, and a sharded parameter
+    (`DTensor`, e.g. under FSDP) only generates the chunks overlapping its local shard while
+    getting the same values as the full tensor would. Chunks are filled by a thread pool, as
+    the fills release the GIL.
+
+    Meta parameters without an entry in `inits` are reset with their module's
+    `reset_parameters()`, and meta buffers with `reset_buffers()` (or `reset_parameters()`).
+    Parameters that are not on the meta device and have no entry are left untouched.
+
+    Args:
+        model: The model.
+        inits: Initialization of the parameters, by name (as in `named_parameters()`).
+        seed: Seed of the random values.
+        num_threads: Number of threads filling the parameters. Defaults to `torch.get_num_threads()`.
+        device: Device meta tensors are materialized on. Defaults to the default device.
+    """
+    for name, (kind, _) in inits.items():
+        if kind not in INIT_KINDS:
+            raise ValueError(f"Unknown initialization {kind} for {name}, expected one of {INIT_KINDS}")
+    meta_modules = materialize(model, device)
+    initialized = {id(param) for name, param in model.named_parameters() if name in inits}
+    for module in model.modules():
+        if module not in meta_modules:
+            continue
+        missing = [name for name, p in module.named_parameters(recurse=False) if id(p) not in initialized]
+        has_buffers = next(module.buffers(recurse=False), None) is not None
+        if missing or (has_buffers and not hasattr(module, "reset_buffers")):
+            if not hasattr(module, "reset_parameters"):
+                raise ValueError(
+                    f"Cannot initialize {missing or 'the buffers'} of {type(module).__name__}: "
+                    f"no initialization given and no `reset_parameters`"
+                )
+            module.reset_parameters()
+        if has_buffers and hasattr(module, "reset_buffers"):
+            module.reset_buffers()
+
+    jobs = []
+    for name, param in model.named_parameters():
+        if name not in inits:
+            continue
+        kind, std = inits[name]
+        target, offset = _local_view(param)
+        if target.numel() == 0:
+            continue
+        if kind != "normal":
+            jobs.append((target.zero_ if kind == "zeros" else target.fill_, () if kind == "zeros" else (1.0,)))
+            continue
+        numel = param.numel()
+        if offset is None:
+            start = 0
+        elif target.shape[1:] == param.shape[1:] and target.is_contiguous():
+            # Shard of whole rows: a contiguous range of the flattened parameter
+            start = offset[0] * (target[0].numel() if target.dim() else 1)
+        else:
+            start = None
+        if start is None:
+            # Other shardings: generate the full parameter, keep the local block
+            full = torch.empty(param.shape, dtype=target.dtype, device=target.device)
+            _fill_normal(full, name, numel, 0, std, seed, range(-(-numel // CHUNK_NUMEL)))
+            index = tuple(slice(o, o + s) for o, s in zip(offset, target.shape))
+            jobs.append((target.copy_, (full[index],)))
+            continue
+        first, last = start // CHUNK_NUMEL, (start + target.numel() - 1) // CHUNK_NUMEL
+        for chunk in range(first, last + 1):
+            jobs.append((_fill_normal, (target, name, numel, start, std, seed, (chunk,))))
+
+    with torch.no_grad():
+        num_threads = num_threads or torch.get_num_threads()
+        if num_threads <= 1 or len(jobs) <= 1:
+            for fn, args in jobs:
+                fn(*args)
+        else:
+            with ThreadPoolExecutor(num_threads) as executor:
+                for future in [executor.submit(fn, *args) for fn, args in jobs]:
+                    future.result()
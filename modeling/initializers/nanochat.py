@@ -1,8 +1,10 @@
 import math
+from typing import Dict, Optional
 import torch.nn as nn
 from modeling.models._template import ModelTemplate
 from modeling.tokenizers._template import TokenizerTemplate
 from modeling.initializers._template import InitializerTemplate
+from modeling.initializers.materialize import Init, apply_order, check_untied, initialize, parameter_aliases
 
 class NanoChatInitializer:
     """
@@ -16,46 +18,68 @@ class NanoChatInitializer:
     - Special zeroing:
         - Weights of the language model head (identified by `head_name`).
         - Weights of any Linear layer whose name contains `projection_subword`.
+      A zeroed weight tied to another parameter (e.g. a head sharing the embedding matrix) raises
+      a ValueError, as the zeros would also replace the other parameter.
+
+    The final value of every parameter is resolved first, then written once (the zeroed weights
+    are never drawn), which also supports models built on the `meta` device, see
+    `modeling.initializers.materialize.initialize`.
     """
-    def __init__(self, projection_subword: str = "out", head_name: str = "lm_head"):
+    def __init__(self, projection_subword: str = "out", head_name: str = "lm_head", seed: int = 0,
+                 num_threads: Optional[int] = None, device: Optional[str] = None):
         """
         Args:
             projection_subword: Substring to identify projection layers that should be zero-initialized.
                                 Defaults to "out".
             head_name: Name of the language model head attribute in the model.
                        Defaults to "lm_head".
+            seed: Seed of the random values, which are deterministic per parameter name.
+            num_threads: Number of threads filling the parameters. Defaults to `torch.get_num_threads()`.
+            device: Device meta parameters are materialized on. Defaults to the default device.
         """
         self.projection_subword = projection_subword
         self.head_name = head_name
+        self.seed = seed
+        self.num_threads = num_threads
+        self.device = device
 
     def __call__(self, model: ModelTemplate, tokenizer: TokenizerTemplate) -> None:
         """
         Initialize the model weights.
         """
-        # Apply base initialization
-        model.apply(self._init_weights)
-        
-        # Apply special zeroing
+        initialize(model, self._inits(model), self.seed, self.num_threads, self.device)
+
+    def _inits(self, model: nn.Module) -> Dict[str, Init]:
+        inits: Dict[str, Init] = {}
+        names = {id(p): name for name, p in model.named_parameters()}
+        aliases = parameter_aliases(model)
+
+        # Base initialization, in `model.apply` order (later modules win for shared parameters)
+        for module in apply_order(model):
+            if isinstance(module, nn.Linear):
+                # https://arxiv.org/pdf/2310.17813
+                fan_out = module.weight.size(0)
+                fan_in = module.weight.size(1)
+                # NanoChat: std = 1.0 / math.sqrt(fan_in) * min(1.0, math.sqrt(fan_out / fan_in))
+                std = 1.0 / math.sqrt(fan_in) * min(1.0, math.sqrt(fan_out / fan_in))
+                inits[names[id(module.weight)]] = ("normal", std)
+                if module.bias is not None:
+                    inits[names[id(module.bias)]] = ("zeros", 0.0)
+            elif isinstance(module, nn.Embedding):
+                inits[names[id(module.weight)]] = ("normal", 1.0)
+
+        # Special zeroing
         # Zero out classifier weights if they exist
-        if hasattr(model, self.head_name):
-            head = getattr(model, self.head_name)
-            if isinstance(head, nn.Linear):
-                 nn.init.zeros_(head.weight)
-             
-        # Zero out weights of layers matching the projection subword
-        for name, module in model.named_modules():
-            if self.projection_subword in name and isinstance(module, nn.Linear):
-                nn.init.zeros_(module.weight)
+        head = getattr(model, self.head_name, None)
+        if isinstance(head, nn.Linear):
+            name = names[id(head.weight)]
+            check_untied(aliases[name], [f"{self.head_name}.weight"], "zeroing the head")
+            inits[name] = ("zeros", 0.0)
 
-    def _init_weights(self, module):
-        if isinstance(module, nn.Linear):
-            # https://arxiv.org/pdf/2310.17813
-            fan_out = module.weight.size(0)
-            fan_in = module.weight.size(1)
-            # NanoChat: std = 1.0 / math.sqrt(fan_in) * min(1.0, math.sqrt(fan_out / fan_in))
-            std = 1.0 / math.sqrt(fan_in) * min(1.0, math.sqrt(fan_out / fan_in))
-            nn.init.normal_(module.weight, mean=0.0, std=std)
-            if module.bias is not None:
-                nn.init.zeros_(module.bias)
-        elif isinstance(module, nn.Embedding):
-            nn.init.normal_(module.weight, mean=0.0, std=1.0)
+        # Zero out weights of layers matching the projection subword
+        for module_name, module in model.named_modules():
+            if self.projection_subword in module_name and isinstance(module, nn.Linear):
+                name = names[id(module.weight)]
+                check_untied(aliases[name], [f"{module_name}.weight"], "zeroing the projection")
+                inits[name] = ("zeros", 0.0)
+        return inits
@@ -1,29 +1,46 @@
 import math
+from typing import Dict, Optional
 import torch.nn as nn
 from modeling.models._template import ModelTemplate
 from modeling.tokenizers._template import TokenizerTemplate
 from modeling.initializers._template import InitializerTemplate
+from modeling.initializers.materialize import Init, apply_order, initialize
 
 class SimpleInitializer:
     """
     Simple initialier that initializes weights with std = 1.0 / sqrt(fan_in).
     Biases are initialized to zero.
+
+    Supports models built on the `meta` device, see `modeling.initializers.materialize.initialize`.
     """
-    def __init__(self):
-        pass
+    def __init__(self, seed: int = 0, num_threads: Optional[int] = None, device: Optional[str] = None):
+        """
+        Args:
+            seed: Seed of the random values, which are deterministic per parameter name.
+            num_threads: Number of threads filling the parameters. Defaults to `torch.get_num_threads()`.
+            device: Device meta parameters are materialized on. Defaults to the default device.
+        """
+        self.seed = seed
+        self.num_threads = num_threads
+        self.device = device
 
     def __call__(self, model: ModelTemplate, tokenizer: TokenizerTemplate) -> None:
         """
         Initialize the model weights.
         """
-        model.apply(self._init_weights)
+        initialize(model, self._inits(model), self.seed, self.num_threads, self.device)
+
+    def _inits(self, model: nn.Module) -> Dict[str, Init]:
+        inits: Dict[str, Init] = {}
+        names = {id(p): name for name, p in model.named_parameters()}
+        # Same order as `model.apply` (children first), later modules win for shared parameters
+        for module in apply_order(model):
+            if isinstance(module, nn.Linear):
+                fan_in = module.weight.size(1)
+                inits[names[id(module.weight)]] = ("normal", 1.0 / math.sqrt(fan_in))
+                if module.bias is not None:
+                    inits[names[id(module.bias)]] = ("zeros", 0.0)
+            elif isinstance(module, nn.Embedding):
+                inits[names[id(module.weight)]] = ("normal", 1.0)
+        return inits
 
-    def _init_weights(self, module):
-        if isinstance(module, nn.Linear):
-            fan_in = module.weight.size(1)
-            std = 1.0 / math.sqrt(fan_in)
-            nn.init.normal_(module.weight, mean=0.0, std=std)
-            if module.bias is not None:
-                nn.init.zeros_(module.bias)
-        elif isinstance(module, nn.Embedding):
-            nn.init.normal_(module.weight, mean=0.0, std=1.0)
@@ -1,33 +1,43 @@
-from typing import List
-import fnmatch
+from typing import List, Optional
 import torch.nn as nn
 from modeling.models._template import ModelTemplate
 from modeling.tokenizers._template import TokenizerTemplate
 from modeling.initializers._template import InitializerTemplate
+from modeling.initializers.materialize import check_untied, compile_patterns, initialize, parameter_aliases
 
 class ZeroInitializer:
     """
     Initializer that zeroes out parameters matching any of the provided glob patterns.
+
+    The patterns are compiled once into a single regular expression and matched against every
+    name of a parameter, so tied parameters are found under any of their names; zeroing only
+    some of the names of a tied parameter (e.g. `lm_head.weight` tied to the embeddings) raises
+    a ValueError. On a model built on the `meta` device, the other parameters get their modules'
+    default initialization, see `modeling.initializers.materialize.initialize`.
     """
-    def __init__(self, patterns: List[str]):
+    def __init__(self, patterns: List[str], num_threads: Optional[int] = None, device: Optional[str] = None):
         """
         Args:
             patterns: A list of glob patterns. Any parameter whose name matches
                       one of these patterns will be zero-initialized.
                       Example: ['*bias*', 'lm_head.weight', '*.c_proj.weight']
+            num_threads: Number of threads filling the parameters. Defaults to `torch.get_num_threads()`.
+            device: Device meta parameters are materialized on. Defaults to the default device.
         """
         self.patterns = patterns
+        self.num_threads = num_threads
+        self.device = device
+        self._regex = compile_patterns(patterns)
 
     def __call__(self, model: ModelTemplate, tokenizer: TokenizerTemplate) -> None:
         """
         Zero out matching parameters.
         """
-        if not self.patterns:
-            return
-
-        for name, param in model.named_parameters():
-            for pattern in self.patterns:
-                if fnmatch.fnmatch(name, pattern):
-                    nn.init.zeros_(param)
-                    # Break after finding first match to avoid redundant work
-                    break
+        inits = {}
+        if self._regex is not None:
+            for name, aliases in parameter_aliases(model).items():
+                matched = [alias for alias in aliases if self._regex.match(alias)]
+                check_untied(aliases, matched, "zeroing")
+                if matched:
+                    inits[name] = ("zeros", 0.0)
+        initialize(model, inits, num_threads=self.num_threads, device=self.device)
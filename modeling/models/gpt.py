@@ -0,0 +1,266 @@
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+ATTENTION_BACKENDS = ("sdpa", "flex")
+
+_compiled_flex_attention = None
+
+
+def _flex_attention(*args, **kwargs) -> torch.Tensor:
+    # flex_attention only skips masked blocks when compiled; compile it once per process
+    global _compiled_flex_attention
+    if _compiled_flex_attention is None:
+        from torch.nn.attention.flex_attention import flex_attention
+        _compiled_flex_attention = torch.compile(flex_attention, dynamic=False)
+    return _compiled_flex_attention(*args, **kwargs)
+
+
+def document_starts(sequence_id: torch.Tensor) -> torch.Tensor:
+    """
+    Returns, for every token of a [B, T] `sequence_id` tensor, the index of the first token of
+    its document. A document starts at the beginning of every row and wherever the id changes.
+    """
+    index = torch.arange(sequence_id.size(1), device=sequence_id.device).expand_as(sequence_id)
+    is_start = torch.ones_like(sequence_id, dtype=torch.bool)
+    is_start[:, 1:] = sequence_id[:, 1:] != sequence_id[:, :-1]
+    return torch.where(is_start, index, torch.zeros_like(index)).cummax(dim=1).values
+
+
+class AttentionMask:
+    """
+    Document-causal attention mask of a batch: a token attends to the previous tokens of its
+    own document only. Built once per forward pass and shared by all layers.
+
+    For the "sdpa" backend, queries are processed in tiles of `block_size`. A tile only attends
+    to the keys from the start of the earliest document it contains, so the key blocks before it
+    (masked for every query of the tile) are skipped rather than computed and discarded. For
+    the "flex" backend, the mask is a flex-attention `BlockMask`, whose fully masked blocks are
+    skipped by the kernel. The "sdpa" tile bounds are read on the host, once per forward pass.
+    """
+    def __init__(self, sequence_id: Optional[torch.Tensor], seq_len: int, backend: str, block_size: int):
+        self.sequence_id = sequence_id
+        self.seq_len = seq_len
+        self.backend = backend
+        self.block_size = block_size
+        self.block_mask = None
+        self.tiles: List[Tuple[int, int, int]] = []
+        if sequence_id is None:
+            return
+        if backend == "flex":
+            from torch.nn.attention.flex_attention import create_block_mask
+
+            def document_causal(b, h, q_idx, kv_idx):
+                return (q_idx >= kv_idx) & (sequence_id[b, q_idx] == sequence_id[b, kv_idx])
+
+            self.block_mask = create_block_mask(
+                document_causal, sequence_id.size(0), None, seq_len, seq_len,
+                device=sequence_id.device, BLOCK_SIZE=block_size,
+            )
+        else:
+            # Documents are contiguous, so the first query of a tile has the earliest start
+            starts = document_starts(sequence_id)[:, ::block_size].amin(dim=0).tolist()
+            for tile, kv_start in enumerate(starts):
+                q_start = tile * block_size
+                self.tiles.append((q_start, min(q_start + block_size, seq_len), kv_start))
+
+    def attention(self, q: torch.Tensor, k: torch.Tensor, v: torch.Tensor) -> torch.Tensor:
+        """
+        Masked attention of [B, H, T, head_dim] queries, keys and values.
+        """
+        if self.backend == "flex":
+            if self.block_mask is None:
+                from torch.nn.attention.flex_attention import create_block_mask
+                self.block_mask = create_block_mask(
+                    lambda b, h, q_idx, kv_idx: q_idx >= kv_idx, None, None, self.seq_len, self.seq_len,
+                    device=q.device, BLOCK_SIZE=self.block_size,
+                )
+            return _flex_attention(q, k, v, block_mask=self.block_mask)
+        if self.sequence_id is None:
+            return F.scaled_dot_product_attention(q, k, v, is_causal=True)
+        outputs = []
+        for q_start, q_end, kv_start in self.tiles:
+            q_doc = self.sequence_id[:, q_start:q_end, None]
+            kv_doc = self.sequence_id[:, None, kv_start:q_end]
+            q_idx = torch.arange(q_start, q_end, device=q.device)[:, None]
+            kv_idx = torch.arange(kv_start, q_end, device=q.device)[None, :]
+            mask = (q_doc == kv_doc) & (q_idx >= kv_idx)
+            outputs.append(F.scaled_dot_product_attention(
+                q[:, :, q_start:q_end], k[:, :, kv_start:q_end], v[:, :, kv_start:q_end], attn_mask=mask[:, None]
+            ))
+        return torch.cat(outputs, dim=2)
+
+
+def apply_rotary(x: torch.Tensor, cos: torch.Tensor, sin: torch.Tensor) -> torch.Tensor:
+    """Rotates the two halves of the last dimension of [B, H, T, head_dim] `x`."""
+    x1, x2 = x.chunk(2, dim=-1)
+    return torch.cat([x1 * cos - x2 * sin, x1 * sin + x2 * cos], dim=-1).type_as(x)
+
+
+class Attention(nn.Module):
+    def __init__(self, d_model: int, n_heads: int, bias: bool, layer_idx: int):
+        super().__init__()
+        self.layer_idx = layer_idx
+        self.n_heads = n_heads
+        self.head_dim = d_model // n_heads
+        self.qkv = nn.Linear(d_model, 3 * d_model, bias=bias)
+        self.out = nn.Linear(d_model, d_model, bias=bias)
+
+    def forward(self, x: torch.Tensor, cos: torch.Tensor, sin: torch.Tensor, mask: AttentionMask,
+                kv_cache: Optional[Any] = None) -> torch.Tensor:
+        batch_size, seq_len, d_model = x.shape
+        q, k, v = self.qkv(x).view(batch_size, seq_len, 3, self.n_heads, self.head_dim).permute(2, 0, 3, 1, 4)
+        q, k = apply_rotary(q, cos, sin), apply_rotary(k, cos, sin)
+        if kv_cache is not None:
+            y = kv_cache.attention(self.layer_idx, q, k, v)
+        else:
+            y = mask.attention(q, k, v)
+        return self.out(y.transpose(1, 2).reshape(batch_size, seq_len, d_model))
+
+
+class MLP(nn.Module):
+    def __init__(self, d_model: int, hidden_dim: int, bias: bool):
+        super().__init__()
+        self.fc = nn.Linear(d_model, hidden_dim, bias=bias)
+        self.out = nn.Linear(hidden_dim, d_model, bias=bias)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.out(F.gelu(self.fc(x)))
+
+
+class Block(nn.Module):
+    def __init__(self, d_model: int, n_heads: int, hidden_dim: int, bias: bool, norm_eps: float, layer_idx: int):
+        super().__init__()
+        self.attn_norm = nn.RMSNorm(d_model, eps=norm_eps)
+        self.attn = Attention(d_model, n_heads, bias, layer_idx)
+        self.mlp_norm = nn.RMSNorm(d_model, eps=norm_eps)
+        self.mlp = MLP(d_model, hidden_dim, bias)
+
+    def forward(self, x: torch.Tensor, cos: torch.Tensor, sin: torch.Tensor, mask: AttentionMask,
+                kv_cache: Optional[Any] = None) -> torch.Tensor:
+        x = x + self.attn(self.attn_norm(x), cos, sin, mask, kv_cache)
+        return x + self.mlp(self.mlp_norm(x))
+
+
+class GPT(nn.Module):
+    """
+    Reference decoder-only transformer (pre-norm RMSNorm, rotary embeddings, GELU MLP).
+
+    It takes the inputs produced by the datasets, `input_ids` and optionally `sequence_id`,
+    of shape [B, T]. With `sequence_id`, tokens only attend to the previous tokens of their own
+    document, and the rotary positions restart at 0 for every document (unless `position_ids`
+    are given). Masked blocks are skipped, see `AttentionMask`. Other packed inputs
+    (`cu_seqlens`, `max_seqlen`) are accepted and ignored.
+
+    Module names follow the initializers' conventions: `wte`, `blocks.{i}.attn.{qkv,out}`,
+    `blocks.{i}.mlp.{fc,out}`, `norm` and `lm_head`, so the output projections match
+    `NanoChatInitializer`'s "out" subword. With `tie_weights`, `lm_head.weight` is the embedding
+    matrix; initializers zeroing the head (e.g. `NanoChatInitializer`) then raise, as they would
+    also zero the embeddings, so tying is off by default.
+    """
+    def __init__(
+        self,
+        vocab_size: int,
+        d_model: int = 768,
+        n_layers: int = 12,
+        n_heads: int = 12,
+        mlp_ratio: float = 4.0,
+        rope_base: float = 10000.0,
+        norm_eps: float = 1e-6,
+        bias: bool = False,
+        tie_weights: bool = False,
+        attention: str = "sdpa",
+        block_size: int = 128,
+        return_hidden_states: bool = False,
+    ):
+        """
+        Args:
+            vocab_size: Size of the vocabulary.
+            d_model: Width of the residual stream.
+            n_layers: Number of transformer blocks.
+            n_heads: Number of attention heads. Must divide `d_model`, with an even head dimension.
+            mlp_ratio: Hidden width of the MLP, relative to `d_model`.
+            rope_base: Base of the rotary embedding frequencies.
+            norm_eps: Epsilon of the RMSNorm layers.
+            bias: Whether linear layers have a bias.
+            tie_weights: Whether `lm_head` shares its weight with the token embedding.
+            attention: "sdpa" (`scaled_dot_product_attention` over tiles of queries) or "flex"
+                       (compiled flex-attention with a block mask; its backward pass needs a GPU).
+            block_size: Query tile / flex-attention block size, the granularity at which masked
+                        attention is skipped.
+            return_hidden_states: Whether to return the final hidden states and the `lm_head`
+                                  parameters instead of the logits, for `ChunkedCrossEntropy`.
+        """
+        super().__init__()
+        if attention not in ATTENTION_BACKENDS:
+            raise ValueError(f"attention must be one of {ATTENTION_BACKENDS}, got {attention}")
+        if d_model % n_heads != 0 or (d_model // n_heads) % 2 != 0:
+            raise ValueError(f"d_model ({d_model}) must be divisible by n_heads ({n_heads}) into even head dimensions")
+        self.vocab_size = vocab_size
+        self.attention = attention
+        self.block_size = block_size
+        self.return_hidden_states = return_hidden_states
+
+        self.wte = nn.Embedding(vocab_size, d_model)
+        hidden_dim = int(mlp_ratio * d_model)
+        self.blocks = nn.ModuleList(Block(d_model, n_heads, hidden_dim, bias, norm_eps, i) for i in range(n_layers))
+        self.norm = nn.RMSNorm(d_model, eps=norm_eps)
+        self.lm_head = nn.Linear(d_model, vocab_size, bias=False)
+        if tie_weights:
+            self.lm_head.weight = self.wte.weight
+
+        self.rope_base = rope_base
+        self.head_dim = d_model // n_heads
+        self.register_buffer("inv_freq", torch.empty(self.head_dim // 2), persistent=False)
+        self.reset_buffers()
+
+    def reset_buffers(self) -> None:
+        """Computes the rotary frequencies, e.g. after the model is materialized from the `meta` device."""
+        with torch.no_grad():
+            arange = torch.arange(0, self.head_dim, 2, dtype=torch.float32, device=self.inv_freq.device)
+            self.inv_freq.copy_(1.0 / self.rope_base ** (arange / self.head_dim))
+
+    def rotary(self, position_ids: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Returns the [B, 1, T, head_dim / 2] cosines and sines of the positions."""
+        angles = position_ids[:, None, :, None].float() * self.inv_freq
+        return angles.cos(), angles.sin()
+
+    def forward(
+        self,
+        input_ids: torch.Tensor,
+        sequence_id: Optional[torch.Tensor] = None,
+        position_ids: Optional[torch.Tensor] = None,
+        kv_cache: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> Union[torch.Tensor, Dict[str, torch.Tensor]]:
+        """
+        Args:
+            input_ids: Token ids, [B, T].
+            sequence_id: Document ids, [B, T]. None for one document per row.
+            position_ids: Rotary positions, [B, T]. Defaults to the position within the document.
+            kv_cache: Key/value cache used for generation, e.g. a step of
+                      `modeling.generation.kv_cache.PagedKVCache`. Its `attention(layer_idx, q, k, v)`
+                      stores the new keys and values and attends over the cached ones, replacing
+                      the document mask. `position_ids` must then be given.
+
+        Returns:
+            The [B, T, vocab_size] logits, or with `return_hidden_states`
+            {"hidden_states": [B, T, d_model], "lm_head_weight": [vocab_size, d_model]}.
+        """
+        batch_size, seq_len = input_ids.shape
+        if position_ids is None:
+            position_ids = torch.arange(seq_len, device=input_ids.device).expand(batch_size, seq_len)
+            if sequence_id is not None:
+                position_ids = position_ids - document_starts(sequence_id)
+        cos, sin = self.rotary(position_ids)
+        mask = AttentionMask(None if kv_cache is not None else sequence_id, seq_len, self.attention, self.block_size)
+
+        x = self.wte(input_ids)
+        for block in self.blocks:
+            x = block(x, cos, sin, mask, kv_cache)
+        x = self.norm(x)
+        if self.return_hidden_states:
+            return {"hidden_states": x, "lm_head_weight": self.lm_head.weight}
+        return self.lm_head(x)
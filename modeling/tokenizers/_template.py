@@ -1,4 +1,6 @@
-from typing import Protocol, List, Union, runtime_checkable
+from typing import Protocol, List, Tuple, Union, runtime_checkable
+
+import numpy as np
 
 @runtime_checkable
 class TokenizerTemplate(Protocol):
@@ -9,5 +11,23 @@ class TokenizerTemplate(Protocol):
     def vocab_size(self) -> int:
         ...
 
+    @property
+    def eot_token_id(self) -> int:
+        ...
+
+    def encode_batch(self, texts: List[str], append_eot: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Encodes a batch of documents without special tokens.
+
+        Args:
+            texts: The documents to encode.
+            append_eot: Whether to append `eot_token_id` to every document.
+
+        Returns:
+            A flat token array and an array of `len(texts) + 1` offsets, such that
+            document `i` is `tokens[offsets[i]:offsets[i + 1]]`.
+        """
+        ...
+
     def __call__(self, text: Union[str, List[str]]) -> Union[List[int], List[List[int]]]:
         ...
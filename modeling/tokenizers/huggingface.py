@@ -1,10 +1,27 @@
-from typing import List, Union
-from transformers import AutoTokenizer
-from ._template import Tokenizer
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import List, Optional, Tuple, Union
+import numpy as np
+from ._template import TokenizerTemplate
 
 class HuggingFaceTokenizer:
-    def __init__(self, pretrained_model_name_or_path: str, **kwargs):
+    def __init__(self, pretrained_model_name_or_path: str, num_threads: Optional[int] = None, **kwargs):
+        """
+        Args:
+            pretrained_model_name_or_path: Name or path passed to `AutoTokenizer.from_pretrained`.
+            num_threads: Number of threads used by `encode_batch`. If None, the batch is encoded
+                         in a single call, parallelized by the fast tokenizer itself (which is
+                         disabled inside forked DataLoader workers).
+            **kwargs: Passed to `AutoTokenizer.from_pretrained`.
+        """
+        # Imported here, as importing transformers takes seconds
+        from transformers import AutoTokenizer
         self.tokenizer = AutoTokenizer.from_pretrained(pretrained_model_name_or_path, **kwargs)
+        self.num_threads = num_threads
+        self._fingerprint: Optional[str] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
 
     @property
     def vocab_size(self) -> int:
@@ -16,11 +33,72 @@ class HuggingFaceTokenizer:
             return self.tokenizer.eos_token_id
         raise ValueError("Tokenizer does not have an EOS token.")
 
+    @property
+    def fingerprint(self) -> str:
+        """
+        Identifies the tokenizer by name and a hash of its full definition (vocabulary,
+        merges, normalization), e.g. to key caches of its output.
+        """
+        if self._fingerprint is None:
+            if getattr(self.tokenizer, "backend_tokenizer", None) is not None:
+                definition = self.tokenizer.backend_tokenizer.to_str()
+            else:
+                definition = json.dumps(sorted(self.tokenizer.get_vocab().items()))
+            digest = hashlib.sha256(definition.encode("utf-8")).hexdigest()
+            self._fingerprint = f"{self.tokenizer.name_or_path}:{digest}"
+        return self._fingerprint
+
     def encode(self, text: str) -> List[int]:
         return self.tokenizer.encode(text, add_special_tokens=False)
 
+    def encode_batch(self, texts: List[str], append_eot: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Encodes a batch of documents into a ragged layout.
+
+        Args:
+            texts: The documents to encode.
+            append_eot: Whether to append `eot_token_id` to every document.
+
+        Returns:
+            A flat `int64` array with the tokens of all documents, and an `int64` array of
+            `len(texts) + 1` offsets such that document `i` is `tokens[offsets[i]:offsets[i + 1]]`.
+        """
+        if self.num_threads is None or self.num_threads <= 1 or len(texts) <= 1:
+            ids = self._encode_ids(texts)
+        else:
+            # The fast tokenizer releases the GIL, so chunks are encoded in parallel
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.num_threads)
+            chunk_size = -(-len(texts) // self.num_threads)
+            chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+            ids = list(chain.from_iterable(self._executor.map(self._encode_ids, chunks)))
+
+        lengths = np.fromiter((len(x) for x in ids), dtype=np.int64, count=len(ids))
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        tokens = np.fromiter(chain.from_iterable(ids), dtype=np.int64, count=offsets[-1])
+
+        if append_eot:
+            tokens = np.insert(tokens, offsets[1:], self.eot_token_id)
+            offsets += np.arange(len(offsets), dtype=np.int64)
+        return tokens, offsets
+
+    def _encode_ids(self, texts: List[str]) -> List[List[int]]:
+        backend = getattr(self.tokenizer, "backend_tokenizer", None)
+        if backend is None:
+            return self.tokenizer(texts, add_special_tokens=False)["input_ids"]
+        # `encode_batch_fast` skips the computation of character offsets (tokenizers >= 0.21)
+        encode = getattr(backend, "encode_batch_fast", backend.encode_batch)
+        return [encoding.ids for encoding in encode(texts, add_special_tokens=False)]
+
     def decode(self, token_ids: List[int]) -> str:
         return self.tokenizer.decode(token_ids)
 
+    def __getstate__(self):
+        # Thread pools cannot be pickled (e.g. into DataLoader workers); recreated lazily
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        return state
+
     def __call__(self, text: Union[str, List[str]]) -> Union[List[int], List[List[int]]]:
         return self.tokenizer(text)["input_ids"]
@@ -0,0 +1,33 @@
+from typing import Protocol, runtime_checkable
+
+from modeling.tokenizers._template import TokenizerTemplate
+from modeling.models._template import ModelTemplate
+
+@runtime_checkable
+class WrapperTemplate(Protocol):
+    """
+    Protocol for model wrappers.
+
+    A wrapper changes how a model is executed (e.g. activation checkpointing, gradient
+    accumulation) without changing what it computes. Wrappers are applied after the
+    initializers, and can be composed by applying them one after the other.
+    """
+    def __init__(self, **kwargs):
+        """
+        Initialize the Wrapper with specific arguments.
+        """
+        ...
+
+    def __call__(self, model: ModelTemplate, tokenizer: TokenizerTemplate) -> ModelTemplate:
+        """
+        Wrap the model.
+
+        Args:
+            model: The model to wrap.
+            tokenizer: The tokenizer used with the model.
+
+        Returns:
+            The wrapped model. It can be `model` itself, modified in place, in which case the
+            parameter names are unchanged.
+        """
+        ...
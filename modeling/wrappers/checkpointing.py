@@ -0,0 +1,158 @@
+import fnmatch
+import functools
+from typing import Any, Callable, List, Tuple
+
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+from modeling.models._template import ModelTemplate
+from modeling.tokenizers._template import TokenizerTemplate
+from modeling.wrappers._template import WrapperTemplate
+
+
+def match_modules(model: nn.Module, patterns: List[str]) -> List[Tuple[str, nn.Module]]:
+    """
+    Returns the submodules whose name matches any of the glob patterns, in registration order.
+    Submodules of a matched module are skipped, and so is the model itself.
+    """
+    matched: List[Tuple[str, nn.Module]] = []
+    for name, module in model.named_modules():
+        if not name or any(name.startswith(prefix + ".") for prefix, _ in matched):
+            continue
+        if any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+            matched.append((name, module))
+    return matched
+
+
+_FLAGS = ("_activation_checkpointing", "_activation_offloading")
+
+
+def _wrap_forward(module: nn.Module, wrapper: Callable[..., Any], flag: str) -> None:
+    # Patching the instance `forward` keeps the module (and the parameter names) in place.
+    # A module is either checkpointed or offloaded, by whichever wrapper is applied first.
+    if any(getattr(module, f, False) for f in _FLAGS):
+        return
+    module.forward = functools.partial(wrapper, module.forward)
+    setattr(module, flag, True)
+
+
+def _checkpointed_forward(forward: Callable[..., Any], *args, use_reentrant: bool = False, **kwargs) -> Any:
+    if not torch.is_grad_enabled():
+        return forward(*args, **kwargs)
+    return checkpoint(forward, *args, use_reentrant=use_reentrant, **kwargs)
+
+
+class ActivationCheckpointing:
+    """
+    Recomputes the activations of the matched submodules during the backward pass instead of
+    storing them.
+
+    Only the inputs of a checkpointed submodule are kept alive between the forward and the
+    backward pass; everything it computes internally is recomputed, at the cost of one extra
+    forward pass of that submodule. With `every_k > 1`, only every k-th matched submodule is
+    checkpointed, which trades memory back for throughput.
+
+    The model is modified in place (its `forward` methods are patched), so parameter names,
+    state dicts and optimizer patterns are unchanged.
+    """
+    def __init__(self, patterns: List[str], every_k: int = 1, use_reentrant: bool = False):
+        """
+        Args:
+            patterns: Glob patterns of the submodules to checkpoint, e.g. ['blocks.*'].
+                      Submodules of a matched module are not matched again.
+            every_k: Checkpoint the matched submodules 0, k, 2k, ... only.
+            use_reentrant: Whether to use the reentrant implementation of
+                           `torch.utils.checkpoint`. The non-reentrant one supports keyword
+                           arguments and inputs that do not require gradients.
+        """
+        if every_k < 1:
+            raise ValueError(f"every_k must be >= 1, got {every_k}")
+        self.patterns = patterns
+        self.every_k = every_k
+        self.use_reentrant = use_reentrant
+
+    def __call__(self, model: ModelTemplate, tokenizer: TokenizerTemplate) -> ModelTemplate:
+        """
+        Checkpoint the matching submodules.
+        """
+        matched = match_modules(model, self.patterns)
+        if not matched:
+            raise ValueError(f"No submodule matches the patterns {self.patterns}")
+        wrapper = functools.partial(_checkpointed_forward, use_reentrant=self.use_reentrant)
+        for i, (_, module) in enumerate(matched):
+            if i % self.every_k == 0:
+                _wrap_forward(module, wrapper, "_activation_checkpointing")
+        return model
+
+
+class _OffloadHooks(torch.autograd.graph.saved_tensors_hooks):
+    """
+    Moves the tensors saved for the backward pass to pinned host memory, and back on demand.
+
+    Both copies are asynchronous and ordered by the current stream. Tensors already on the CPU
+    and the module's own parameters (saved e.g. by every linear layer) are kept as is.
+    """
+    def __init__(self, param_ptrs: set):
+        super().__init__(functools.partial(self._pack, param_ptrs), self._unpack)
+
+    @staticmethod
+    def _pack(param_ptrs: set, tensor: torch.Tensor) -> Any:
+        if tensor.device.type == "cpu" or tensor.untyped_storage().data_ptr() in param_ptrs:
+            return tensor
+        packed = torch.empty(tensor.size(), dtype=tensor.dtype, layout=tensor.layout, pin_memory=True)
+        packed.copy_(tensor, non_blocking=True)
+        return tensor.device, packed
+
+    @staticmethod
+    def _unpack(packed: Any) -> torch.Tensor:
+        if isinstance(packed, torch.Tensor):
+            return packed
+        device, tensor = packed
+        return tensor.to(device, non_blocking=True)
+
+
+def _offloaded_forward(forward: Callable[..., Any], *args, offloaded_module: nn.Module, **kwargs) -> Any:
+    if not torch.is_grad_enabled():
+        return forward(*args, **kwargs)
+    param_ptrs = {p.untyped_storage().data_ptr() for p in offloaded_module.parameters()}
+    with _OffloadHooks(param_ptrs):
+        return forward(*args, **kwargs)
+
+
+class ActivationOffloading:
+    """
+    Stores the activations saved by the matched submodules in pinned host memory until the
+    backward pass needs them.
+
+    Unlike checkpointing, nothing is recomputed: the cost is the device-to-host and host-to-device
+    copies, which are asynchronous and can overlap with compute when the interconnect is fast
+    enough. It can be combined with `ActivationCheckpointing` on other submodules (e.g. offload
+    the blocks that are not checkpointed with `every_k > 1`); a submodule that is already
+    checkpointed is not offloaded. Activations of CPU models are left untouched.
+
+    The model is modified in place, like `ActivationCheckpointing`.
+    """
+    def __init__(self, patterns: List[str], every_k: int = 1):
+        """
+        Args:
+            patterns: Glob patterns of the submodules to offload, e.g. ['blocks.*'].
+            every_k: Offload the matched submodules 0, k, 2k, ... only.
+        """
+        if every_k < 1:
+            raise ValueError(f"every_k must be >= 1, got {every_k}")
+        self.patterns = patterns
+        self.every_k = every_k
+
+    def __call__(self, model: ModelTemplate, tokenizer: TokenizerTemplate) -> ModelTemplate:
+        """
+        Offload the activations of the matching submodules.
+        """
+        matched = match_modules(model, self.patterns)
+        if not matched:
+            raise ValueError(f"No submodule matches the patterns {self.patterns}")
+        for i, (_, module) in enumerate(matched):
+            if i % self.every_k == 0:
+                wrapper = functools.partial(_offloaded_forward, offloaded_module=module)
+                _wrap_forward(module, wrapper, "_activation_offloading")
+        return model
@@ -0,0 +1,263 @@
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+import time
+from typing import Any, Callable, Dict, Optional
+
+import torch
+import torch.nn as nn
+from torch._dynamo.utils import counters
+
+from data.collate_fns.packed import PackedCollateFn
+from modeling.models._template import ModelTemplate
+from modeling.tokenizers._template import TokenizerTemplate
+from modeling.wrappers._template import WrapperTemplate
+
+# (counter group, hit counter, miss counter) of the compiled-graph caches
+_CACHE_COUNTERS = (
+    ("inductor", "fxgraph_cache_hit", "fxgraph_cache_miss"),
+    ("aot_autograd", "autograd_cache_hit", "autograd_cache_miss"),
+)
+
+
+def _cache_counts() -> Dict[str, int]:
+    hits = sum(counters[group][hit] for group, hit, _ in _CACHE_COUNTERS)
+    misses = sum(counters[group][miss] for group, _, miss in _CACHE_COUNTERS)
+    return {"hits": hits, "misses": misses}
+
+
+def _source(cls: type) -> str:
+    try:
+        return inspect.getsource(cls)
+    except (OSError, TypeError):
+        # Built-in or dynamically created class, its version is covered by the torch version
+        return f"{cls.__module__}.{cls.__qualname__}"
+
+
+def model_fingerprint(model: nn.Module) -> str:
+    """
+    Returns a hash of the model's configuration and code: the module tree (`repr`, which includes
+    the hyperparameters of every layer), the names, shapes, dtypes and devices of its parameters
+    and buffers, and the source code of every module class it uses.
+    """
+    h = hashlib.sha256()
+    h.update(repr(model).encode())
+    for name, tensor in list(model.named_parameters()) + list(model.named_buffers()):
+        h.update(f"{name}:{tuple(tensor.shape)}:{tensor.dtype}:{tensor.device.type}".encode())
+    for cls in sorted({type(module) for module in model.modules()}, key=lambda c: (c.__module__, c.__qualname__)):
+        h.update(_source(cls).encode())
+    return h.hexdigest()
+
+
+class Compile:
+    """
+    Compiles the model with `torch.compile` and warms it up before the first real batch.
+
+    The model is compiled in place (`nn.Module.compile`), so parameter names are unchanged.
+    Warm-up runs `warmup_steps` forward and backward passes on synthetic batches of
+    `batch_size` x `seq_len` random token ids, drawn from the tokenizer's vocabulary, with
+    `packed=True` adding the document boundaries of `PackedCollateFn`. The sequence dimension
+    is marked static, and the batch dimension dynamic if `dynamic_batch`, so real batches of
+    the same layout reuse the warmed-up graphs. Gradients produced by the warm-up are discarded.
+
+    With a `cache_dir`, the compiled artifacts (Inductor kernels and AOTAutograd graphs) are
+    stored in one file per model, keyed by `model_fingerprint`, the compile options, the input
+    layout and the torch version. Restarts and sweep trials with the same model load it before
+    compiling, which turns compilation into cache lookups. Call `save_cache` again after the
+    first training step to include graphs compiled later (criterion, optimizer step).
+
+    `compile_time` holds the wall time of compilation and warm-up, and `stats()` the cache hit rate.
+    """
+    def __init__(
+        self,
+        seq_len: int,
+        batch_size: int = 1,
+        mode: Optional[str] = None,
+        fullgraph: bool = False,
+        backend: str = "inductor",
+        dynamic_batch: bool = False,
+        packed: bool = False,
+        warmup_steps: int = 1,
+        cache_dir: Optional[str] = None,
+    ):
+        """
+        Args:
+            seq_len: Sequence length of the training batches.
+            batch_size: Batch size of the warm-up batches.
+            mode: `torch.compile` mode, e.g. "max-autotune". None for the default.
+            fullgraph: Whether to require a single graph without breaks.
+            backend: `torch.compile` backend.
+            dynamic_batch: Whether to compile the batch dimension as dynamic, e.g. for a last
+                           partial batch or a variable micro-batch size.
+            packed: Whether the model receives packed inputs (`sequence_id`, `position_ids`,
+                    `cu_seqlens`, `max_seqlen`), see `PackedCollateFn`.
+            warmup_steps: Number of synthetic forward and backward passes. 0 disables warm-up,
+                          and compilation then happens on the first real batch.
+            cache_dir: Directory of the compiled-artifact cache. None disables it.
+        """
+        if dynamic_batch and batch_size < 2:
+            raise ValueError("dynamic_batch requires a warm-up batch_size >= 2, size 1 is always specialized")
+        if warmup_steps < 0:
+            raise ValueError(f"warmup_steps must be >= 0, got {warmup_steps}")
+        self.seq_len = seq_len
+        self.batch_size = batch_size
+        self.mode = mode
+        self.fullgraph = fullgraph
+        self.backend = backend
+        self.dynamic_batch = dynamic_batch
+        self.packed = packed
+        self.warmup_steps = warmup_steps
+        self.cache_dir = cache_dir
+
+        self.cache_path: Optional[str] = None
+        self.artifact_cache_hit: Optional[bool] = None
+        self.compile_time = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, model: ModelTemplate, tokenizer: TokenizerTemplate) -> ModelTemplate:
+        """
+        Compile, then warm up the model.
+        """
+        counts = _cache_counts()
+        start = time.perf_counter()
+        if self.cache_dir is not None:
+            self.cache_path = os.path.join(self.cache_dir, self.cache_key(model) + ".bin")
+            self.artifact_cache_hit = os.path.exists(self.cache_path)
+            if self.artifact_cache_hit:
+                with open(self.cache_path, "rb") as f:
+                    torch.compiler.load_cache_artifacts(f.read())
+
+        model.compile(mode=self.mode, fullgraph=self.fullgraph, backend=self.backend,
+                      dynamic=None if self.dynamic_batch else False)
+        self.warmup(model, tokenizer.vocab_size)
+        self.compile_time = time.perf_counter() - start
+
+        if self.cache_path is not None and not self.artifact_cache_hit:
+            self.save_cache()
+        after = _cache_counts()
+        self.hits = after["hits"] - counts["hits"]
+        self.misses = after["misses"] - counts["misses"]
+        return model
+
+    def cache_key(self, model: nn.Module) -> str:
+        """Key of the model's compiled artifacts."""
+        options = {
+            "model": model_fingerprint(model),
+            "torch": torch.__version__,
+            "mode": self.mode,
+            "fullgraph": self.fullgraph,
+            "backend": self.backend,
+            "dynamic_batch": self.dynamic_batch,
+            "packed": self.packed,
+            "seq_len": self.seq_len,
+            "batch_size": self.batch_size,
+        }
+        return hashlib.sha256(json.dumps(options, sort_keys=True).encode()).hexdigest()
+
+    def synthetic_batch(self, vocab_size: int, device: torch.device) -> Dict[str, Any]:
+        """
+        Returns the model inputs of a random batch with the training layout.
+        """
+        input_ids = torch.randint(0, vocab_size, (self.batch_size, self.seq_len), device=device)
+        inputs: Dict[str, Any] = {"input_ids": input_ids}
+        if self.packed:
+            # Two documents per row, so that the boundaries are not trivial
+            sequence_id = (torch.arange(self.seq_len) >= self.seq_len // 2).long()
+            sequence_id = sequence_id + 2 * torch.arange(self.batch_size)[:, None]
+            inputs["sequence_id"] = sequence_id
+            inputs.update(PackedCollateFn.document_boundaries(sequence_id))
+            inputs = {key: value.to(device) if isinstance(value, torch.Tensor) else value
+                      for key, value in inputs.items()}
+        for value in inputs.values():
+            if isinstance(value, torch.Tensor) and value.dim() == 2:
+                torch._dynamo.mark_static(value, 1)
+                if self.dynamic_batch:
+                    torch._dynamo.mark_dynamic(value, 0)
+        return inputs
+
+    def warmup(self, model: nn.Module, vocab_size: int) -> None:
+        """
+        Runs `warmup_steps` forward and backward passes on synthetic batches, then discards the gradients.
+        """
+        if self.warmup_steps == 0:
+            return
+        param = next(model.parameters())
+        grads = {p: p.grad for p in model.parameters()}
+        training = model.training
+        model.train()
+        for _ in range(self.warmup_steps):
+            output = model(**self.synthetic_batch(vocab_size, param.device))
+            outputs = output.values() if isinstance(output, dict) else [output]
+            loss = sum(value.float().mean() for value in outputs
+                       if isinstance(value, torch.Tensor) and value.requires_grad)
+            if isinstance(loss, torch.Tensor):
+                loss.backward()
+        model.train(training)
+        for p, grad in grads.items():
+            p.grad = grad
+
+    def save_cache(self) -> None:
+        """
+        Writes the artifacts compiled so far in this process to the cache, atomically.
+        """
+        if self.cache_path is None:
+            return
+        artifacts = torch.compiler.save_cache_artifacts()
+        if artifacts is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(artifacts[0])
+            os.replace(tmp_path, self.cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def compile_criterion(self, criterion: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        Compiles a criterion with the same options (in place if it is a module).
+        """
+        if isinstance(criterion, nn.Module):
+            criterion.compile(mode=self.mode, fullgraph=self.fullgraph, backend=self.backend)
+            return criterion
+        return torch.compile(criterion, mode=self.mode, fullgraph=self.fullgraph, backend=self.backend)
+
+    def compile_optimizer_step(self, optimizer: torch.optim.Optimizer) -> torch.optim.Optimizer:
+        """
+        Compiles `optimizer.step` in place.
+
+        A float learning rate is a compile-time constant, so every scheduler update would
+        recompile the step; the learning rates are therefore turned into tensors, for optimizers
+        known to accept them: those whose `step` is the one of a `torch.optim` optimizer
+        (including subclasses such as `training.optimizers.adamw.Optimizer`) and those with a
+        true `supports_tensor_lr` class attribute. Other optimizers should keep a constant
+        learning rate, or not be compiled.
+        """
+        if not isinstance(optimizer, torch.optim.Optimizer):
+            raise TypeError(f"Expected a torch.optim.Optimizer, got {type(optimizer).__name__}")
+        stock_step = getattr(type(optimizer).step, "__module__", "").startswith("torch.optim.")
+        if stock_step or getattr(optimizer, "supports_tensor_lr", False):
+            for group in optimizer.param_groups:
+                if not isinstance(group["lr"], torch.Tensor):
+                    group["lr"] = torch.tensor(group["lr"])
+        step = optimizer.step
+        optimizer.step = torch.compile(step, fullgraph=False, backend=self.backend)
+        return optimizer
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the compile time and the compiled-graph cache statistics of the last `__call__`.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "compile_time": self.compile_time,
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "cache_hit_rate": self.hits / lookups if lookups else 0.0,
+            "artifact_cache_hit": self.artifact_cache_hit,
+        }
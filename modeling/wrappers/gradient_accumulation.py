@@ -0,0 +1,213 @@
+import contextlib
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Tuple
+
+import torch
+import torch.nn as nn
+
+from data.collate_fns.packed import PackedCollateFn
+from modeling.models._template import ModelTemplate
+from modeling.tokenizers._template import TokenizerTemplate
+from modeling.wrappers._template import WrapperTemplate
+
+
+def _batch_size(data: Any) -> Optional[int]:
+    """Returns the leading dimension of the first tensor of a (nested) batch."""
+    if isinstance(data, torch.Tensor):
+        return data.size(0) if data.dim() > 0 else None
+    if isinstance(data, dict):
+        data = list(data.values())
+    if isinstance(data, (list, tuple)):
+        for value in data:
+            size = _batch_size(value)
+            if size is not None:
+                return size
+    return None
+
+
+def _slice(data: Any, start: int, end: int, batch_size: int) -> Any:
+    """
+    Slices every tensor with a leading batch dimension, and recomputes packed boundaries.
+
+    Tensors whose leading dimension is a multiple of the batch size are taken as flattened
+    [batch_size * k, ...] tensors (e.g. targets flattened from [B, T] to [B * T]) and sliced
+    by blocks of k.
+    """
+    if isinstance(data, torch.Tensor):
+        if data.dim() == 0 or data.size(0) == 0 or data.size(0) % batch_size:
+            return data
+        rows = data.size(0) // batch_size
+        return data[start * rows:end * rows]
+    if isinstance(data, dict):
+        sliced = {key: _slice(value, start, end, batch_size) for key, value in data.items()}
+        if "cu_seqlens" in sliced and "sequence_id" in sliced:
+            # Boundaries are over the flattened batch, they cannot be sliced row-wise
+            sliced.update(PackedCollateFn.document_boundaries(sliced["sequence_id"]))
+        return sliced
+    if isinstance(data, (list, tuple)):
+        return type(data)(_slice(value, start, end, batch_size) for value in data)
+    return data
+
+
+def _num_targets(data: Any, criterion: Callable[..., Dict[str, Any]]) -> Optional[torch.Tensor]:
+    """
+    Number of targets of a batch the criterion averages over: those under its `target_key`
+    that are not its `ignore_index`. None if the criterion has no `target_key`.
+    """
+    target_key = getattr(criterion, "target_key", None)
+    if target_key is None or not isinstance(data.get(target_key), torch.Tensor):
+        return None
+    targets = data[target_key]
+    ignore_index = getattr(criterion, "ignore_index", None)
+    if ignore_index is None:
+        return torch.tensor(targets.numel(), device=targets.device)
+    return (targets != ignore_index).sum()
+
+
+def _weighted(value: Any, weight: Any) -> Any:
+    """`value * weight`, zero when the weight is (e.g. the nan loss of a micro-batch without targets)."""
+    if isinstance(weight, torch.Tensor):
+        return torch.where(weight > 0, value * weight, 0.0)
+    return value * weight
+
+
+class GradientAccumulationModel(nn.Module):
+    """
+    Model running the forward and backward passes of a batch as several micro-batches.
+
+    Calling it is the same as calling the wrapped model. `forward_backward` splits the batch along
+    its leading dimension, and for every micro-batch runs the model on `batch[input_key]`
+    (as keyword arguments if it is a dict), the criterion, and the backward pass of the loss
+    scaled by the micro-batch's share of the batch. The gradients are therefore those of the
+    whole batch, while only one micro-batch of activations is alive at a time.
+
+    The share of a micro-batch is its number of targets that are not ignored, when the
+    criterion has a `target_key` (and optionally an `ignore_index`), like `CrossEntropy`:
+    the loss is then exactly the mean over the non-ignored targets of the whole batch, even
+    if micro-batches hold different numbers of them. Otherwise it is its share of the rows,
+    which is exact for criteria averaging over rows.
+
+    If the wrapped model has a `no_sync` context manager (e.g. `DataParallel`), gradient
+    synchronization is skipped for all but the last micro-batch.
+
+    `named_parameters`, `named_buffers`, `state_dict` and `load_state_dict` are those of the
+    wrapped model, without a "module." prefix, so checkpoints and name patterns (e.g. of
+    `MuonAdamW`) are the same with and without the wrapper.
+    """
+    def __init__(self, module: nn.Module, num_micro_batches: int = 1, micro_batch_size: Optional[int] = None,
+                 input_key: str = "input"):
+        """
+        Args:
+            module: The model to wrap.
+            num_micro_batches: Number of micro-batches a batch is split into (at most, rows are
+                               divided evenly rounding up).
+            micro_batch_size: Number of rows per micro-batch. Overrides `num_micro_batches`.
+            input_key: Key of the model inputs in the batch.
+        """
+        super().__init__()
+        if num_micro_batches < 1:
+            raise ValueError(f"num_micro_batches must be >= 1, got {num_micro_batches}")
+        if micro_batch_size is not None and micro_batch_size < 1:
+            raise ValueError(f"micro_batch_size must be >= 1, got {micro_batch_size}")
+        self.module = module
+        self.num_micro_batches = num_micro_batches
+        self.micro_batch_size = micro_batch_size
+        self.input_key = input_key
+
+    def forward(self, *args, **kwargs) -> Any:
+        return self.module(*args, **kwargs)
+
+    def named_parameters(self, *args, **kwargs) -> Iterator[Tuple[str, nn.Parameter]]:
+        return self.module.named_parameters(*args, **kwargs)
+
+    def named_buffers(self, *args, **kwargs) -> Iterator[Tuple[str, torch.Tensor]]:
+        return self.module.named_buffers(*args, **kwargs)
+
+    def state_dict(self, *args, **kwargs) -> Dict[str, Any]:
+        return self.module.state_dict(*args, **kwargs)
+
+    def load_state_dict(self, state_dict: Mapping[str, Any], *args, **kwargs) -> Any:
+        return self.module.load_state_dict(state_dict, *args, **kwargs)
+
+    def split(self, batch: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Splits a batch into micro-batches along its leading dimension.
+        """
+        batch_size = _batch_size(batch)
+        if batch_size is None:
+            raise ValueError("The batch has no tensor with a batch dimension")
+        if self.micro_batch_size is not None:
+            size = self.micro_batch_size
+        else:
+            if batch_size < self.num_micro_batches:
+                raise ValueError(
+                    f"Cannot split a batch of {batch_size} rows into {self.num_micro_batches} micro-batches"
+                )
+            size = -(-batch_size // self.num_micro_batches)
+        return [_slice(batch, start, min(start + size, batch_size), batch_size) for start in range(0, batch_size, size)]
+
+    def forward_backward(self, batch: Dict[str, Any], criterion: Callable[..., Dict[str, Any]],
+                         mode: str = "train") -> Dict[str, Any]:
+        """
+        Runs the forward and backward passes of the batch, one micro-batch at a time.
+
+        Args:
+            batch: The batch, e.g. {"input": {...}, "target": ...}.
+            criterion: Called as `criterion(micro_batch, prediction, mode)`, see
+                       `training.criteria._template.Criterion`.
+            mode: The execution mode passed to the criterion.
+
+        Returns:
+            {"loss": detached loss of the batch, "logs": logs averaged over the micro-batches},
+            weighted by the micro-batches' shares of the batch.
+        """
+        batch_size = _batch_size(batch)
+        num_targets = _num_targets(batch, criterion)
+        micro_batches = self.split(batch)
+        no_sync = getattr(self.module, "no_sync", None)
+        total_loss: Optional[torch.Tensor] = None
+        logs: Dict[str, Any] = {}
+        for i, micro_batch in enumerate(micro_batches):
+            if num_targets is None:
+                weight = _batch_size(micro_batch) / batch_size
+            else:
+                weight = _num_targets(micro_batch, criterion) / num_targets.clamp(min=1)
+            last = i == len(micro_batches) - 1
+            context = no_sync() if no_sync is not None and not last else contextlib.nullcontext()
+            with context:
+                inputs = micro_batch[self.input_key]
+                prediction = self.module(**inputs) if isinstance(inputs, dict) else self.module(inputs)
+                output = criterion(micro_batch, prediction, mode)
+                loss = output["loss"]
+                (loss * weight).backward()
+            loss = _weighted(loss.detach(), weight)
+            total_loss = loss if total_loss is None else total_loss + loss
+            for key, value in output.get("logs", {}).items():
+                value = _weighted(value.detach() if isinstance(value, torch.Tensor) else value, weight)
+                logs[key] = logs[key] + value if key in logs else value
+        return {"loss": total_loss, "logs": logs}
+
+
+class GradientAccumulation:
+    """
+    Wraps the model in a `GradientAccumulationModel`.
+
+    Apply it last, after data parallelism if any, so that it can skip the gradient
+    synchronization of the intermediate micro-batches.
+    """
+    def __init__(self, num_micro_batches: int = 1, micro_batch_size: Optional[int] = None, input_key: str = "input"):
+        """
+        Args:
+            num_micro_batches: Number of micro-batches a batch is split into (at most, rows are
+                               divided evenly rounding up).
+            micro_batch_size: Number of rows per micro-batch. Overrides `num_micro_batches`.
+            input_key: Key of the model inputs in the batch.
+        """
+        self.num_micro_batches = num_micro_batches
+        self.micro_batch_size = micro_batch_size
+        self.input_key = input_key
+
+    def __call__(self, model: ModelTemplate, tokenizer: TokenizerTemplate) -> GradientAccumulationModel:
+        """
+        Wrap the model.
+        """
+        return GradientAccumulationModel(model, self.num_micro_batches, self.micro_batch_size, self.input_key)
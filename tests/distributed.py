@@ -0,0 +1,61 @@
+import io
+import os
+import socket
+import traceback
+from typing import Any, Callable, Dict
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _worker(fn: Callable, rank: int, world_size: int, port: int, results: Any, args: tuple) -> None:
+    os.environ.update(MASTER_ADDR="127.0.0.1", MASTER_PORT=str(port), RANK=str(rank), WORLD_SIZE=str(world_size))
+    torch.set_num_threads(1)
+    try:
+        dist.init_process_group("gloo", rank=rank, world_size=world_size)
+        try:
+            # Serialized, as tensors shared through the queue would not outlive this process
+            buffer = io.BytesIO()
+            torch.save(fn(rank, world_size, *args), buffer)
+            results.put((rank, buffer.getvalue(), None))
+        finally:
+            dist.destroy_process_group()
+    except BaseException:
+        results.put((rank, None, traceback.format_exc()))
+
+
+def run_distributed(fn: Callable, world_size: int = 2, *args: Any, timeout: float = 120.0) -> Dict[int, Any]:
+    """
+    Runs `fn(rank, world_size, *args)` in `world_size` forked processes joined in a `gloo`
+    process group, and returns the return value of every rank. Raises if any rank fails.
+    """
+    ctx = mp.get_context("fork")
+    results = ctx.Queue()
+    port = _free_port()
+    processes = [
+        ctx.Process(target=_worker, args=(fn, rank, world_size, port, results, args)) for rank in range(world_size)
+    ]
+    for process in processes:
+        process.start()
+    outputs, errors = {}, []
+    try:
+        for _ in range(world_size):
+            rank, output, error = results.get(timeout=timeout)
+            if error is not None:
+                errors.append(f"rank {rank}:\n{error}")
+            outputs[rank] = None if output is None else torch.load(io.BytesIO(output), weights_only=False)
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+    if errors:
+        raise AssertionError("\n".join(errors))
+    return outputs
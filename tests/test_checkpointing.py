@@ -0,0 +1,189 @@
+import os
+import subprocess
+import sys
+
+import pytest
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from data.datasets.packing import TokenPacker
+from modeling.models.gpt import GPT
+from tests.distributed import run_distributed
+from training.optimizers.muon_adamw import MuonAdamW
+from training.schedulers.cosine import Scheduler
+from utils.checkpointing import Checkpointer, load_file
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _build():
+    torch.manual_seed(0)
+    model = GPT(vocab_size=97, d_model=64, n_layers=2, n_heads=4)
+    optimizer = MuonAdamW(model)
+    return model, optimizer, Scheduler(optimizer, T_max=20)
+
+
+def _train_step(model, optimizer, scheduler, generator):
+    tokens = torch.randint(0, 97, (2, 17), generator=generator)
+    logits = model(input_ids=tokens[:, :-1])
+    F.cross_entropy(logits.flatten(0, 1), tokens[:, 1:].flatten()).backward()
+    optimizer.step()
+    optimizer.zero_grad()
+    scheduler.step()
+
+
+@pytest.mark.parametrize("async_save", [True, False])
+def test_restore_continues_like_uninterrupted_training(tmp_path, async_save):
+    model, optimizer, scheduler = _build()
+    packer = TokenPacker(8)
+    list(packer.pack(list(range(13)), 0))
+    generator = torch.Generator().manual_seed(1)
+    checkpointer = Checkpointer(str(tmp_path), keep_last=2, async_save=async_save)
+    for step in range(1, 6):
+        _train_step(model, optimizer, scheduler, generator)
+        checkpointer.save(step, model, optimizer, scheduler, packer, extra={"rng": generator.get_state()})
+    checkpointer.wait()
+    assert checkpointer.committed_steps() == [4, 5]
+    assert sorted(os.listdir(tmp_path)) == ["step_00000004", "step_00000005"]
+
+    restored_model, restored_optimizer, restored_scheduler = _build()
+    restored_packer = TokenPacker(8)
+    info = Checkpointer(str(tmp_path)).load(None, restored_model, restored_optimizer, restored_scheduler,
+                                            restored_packer)
+    assert info["step"] == 5
+    assert restored_packer.state_dict().keys() == packer.state_dict().keys()
+    assert len(restored_packer) == len(packer)
+    restored_generator = torch.Generator()
+    restored_generator.set_state(info["extra"]["rng"])
+
+    for _ in range(3):
+        _train_step(model, optimizer, scheduler, generator)
+        _train_step(restored_model, restored_optimizer, restored_scheduler, restored_generator)
+    for (name, value), restored in zip(model.state_dict().items(), restored_model.state_dict().values()):
+        assert torch.equal(value, restored), name
+
+
+def test_files_are_safetensors(tmp_path):
+    safetensors = pytest.importorskip("safetensors.torch")
+    model, optimizer, scheduler = _build()
+    _train_step(model, optimizer, scheduler, torch.Generator().manual_seed(1))
+    checkpointer = Checkpointer(str(tmp_path), async_save=False)
+    checkpointer.save(1, model, optimizer, scheduler)
+    path = os.path.join(tmp_path, "step_00000001", "rank_00000.safetensors")
+    ours, theirs = load_file(path), safetensors.load_file(path)
+    assert ours.keys() == theirs.keys()
+    assert all(torch.equal(ours[key], theirs[key]) for key in ours)
+
+
+_KILLED_WRITER = r"""
+import sys, time
+import torch
+import utils.checkpointing as checkpointing
+
+save_file = checkpointing.save_file
+
+def save_file_then_hang(tensors, path):
+    save_file(tensors, path)
+    print("written", flush=True)
+    time.sleep(60)
+
+checkpointing.save_file = save_file_then_hang
+checkpointer = checkpointing.Checkpointer(sys.argv[1], keep_last=2)
+checkpointer.save(int(sys.argv[2]), torch.nn.Linear(4, 4))
+checkpointer.wait()
+"""
+
+
+def test_interrupted_save_keeps_the_last_checkpoint(tmp_path):
+    model, optimizer, scheduler = _build()
+    checkpointer = Checkpointer(str(tmp_path), keep_last=2)
+    checkpointer.save(1, model, optimizer, scheduler)
+    checkpointer.wait()
+
+    # A process killed after writing its tensors, before its marker and the commit
+    writer = subprocess.Popen([sys.executable, "-c", _KILLED_WRITER, str(tmp_path), "2"], cwd=ROOT,
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        assert writer.stdout.readline().strip() == "written"
+    finally:
+        writer.kill()
+        writer.wait()
+    assert sorted(os.listdir(tmp_path)) == ["step_00000001", "step_00000002.tmp"]
+    assert Checkpointer(str(tmp_path)).latest_step() == 1
+
+    restored_model, restored_optimizer, restored_scheduler = _build()
+    assert Checkpointer(str(tmp_path)).load(None, restored_model, restored_optimizer, restored_scheduler)["step"] == 1
+    for value, restored in zip(model.state_dict().values(), restored_model.state_dict().values()):
+        assert torch.equal(value, restored)
+
+    # The next committed save removes the leftover
+    checkpointer.save(3, model, optimizer, scheduler)
+    checkpointer.wait()
+    assert sorted(os.listdir(tmp_path)) == ["step_00000001", "step_00000003"]
+
+
+def _sharded_model(mesh):
+    from torch.distributed.tensor import Replicate, Shard, distribute_tensor
+    torch.manual_seed(0)
+    model = nn.Linear(8, 6)
+    model.weight = nn.Parameter(distribute_tensor(model.weight.detach(), mesh, [Shard(0)]))
+    model.bias = nn.Parameter(distribute_tensor(model.bias.detach(), mesh, [Replicate()]))
+    return model
+
+
+def _dtensor_save_and_restore(rank, world_size, checkpoint_dir):
+    from torch.distributed.device_mesh import init_device_mesh
+    from torch.distributed.tensor import DTensor, Replicate
+    mesh = init_device_mesh("cpu", (world_size,))
+
+    def train_step(model, optimizer, generator):
+        inputs = DTensor.from_local(torch.randn(4, 8, generator=generator), mesh, [Replicate()])
+        model(inputs).square().mean().backward()
+        optimizer.step()
+        optimizer.zero_grad()
+
+    model = _sharded_model(mesh)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=0.1)
+    generator = torch.Generator().manual_seed(1)
+    train_step(model, optimizer, generator)
+    # The model is "replicated" by default, but holds shards: every rank saves its own
+    checkpointer = Checkpointer(checkpoint_dir, async_save=False)
+    checkpointer.save(1, model, optimizer)
+    saved = load_file(os.path.join(checkpoint_dir, "step_00000001", f"rank_{rank:05d}.safetensors"))
+
+    # Restored into a fresh model and an optimizer without state yet
+    restored_model = _sharded_model(mesh)
+    restored_optimizer = torch.optim.AdamW(restored_model.parameters(), lr=0.1)
+    checkpointer.load(1, restored_model, restored_optimizer)
+    restored_generator = torch.Generator().manual_seed(2)
+    generator.manual_seed(2)
+    train_step(model, optimizer, generator)
+    train_step(restored_model, restored_optimizer, restored_generator)
+    return {
+        "saved_weight": saved["model/weight"],
+        "weight": model.weight.full_tensor(),
+        "restored_weight": restored_model.weight.full_tensor(),
+        "restored_state_type": type(restored_optimizer.state[restored_model.weight]["exp_avg"]).__name__,
+    }
+
+
+def test_dtensor_model_is_saved_and_restored_per_rank(tmp_path):
+    results = run_distributed(_dtensor_save_and_restore, 2, str(tmp_path))
+    full = results[0]["weight"]
+    saved = torch.cat([results[0]["saved_weight"], results[1]["saved_weight"]])
+    torch.testing.assert_close(saved, _full_initial_weight(full))
+    for rank in (0, 1):
+        assert torch.equal(results[rank]["restored_weight"], full)
+        assert results[rank]["restored_state_type"] == "DTensor"
+
+
+def _full_initial_weight(like):
+    # The saved shards are those of the weight after the first step, recomputed here without shards
+    torch.manual_seed(0)
+    model = nn.Linear(8, 6)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=0.1)
+    generator = torch.Generator().manual_seed(1)
+    model(torch.randn(4, 8, generator=generator)).square().mean().backward()
+    optimizer.step()
+    return model.weight.detach().to(like.dtype)
@@ -0,0 +1,100 @@
+import pytest
+import torch
+import torch.nn.functional as F
+from torch.utils._python_dispatch import TorchDispatchMode
+
+from training.criteria.chunked_cross_entropy import ChunkedCrossEntropy
+
+VOCAB_SIZE = 50
+D_MODEL = 16
+
+
+class CountMatmuls(TorchDispatchMode):
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        if func.overloadpacket in (torch.ops.aten.mm, torch.ops.aten.addmm, torch.ops.aten.addmm_):
+            self.count += 1
+        return func(*args, **(kwargs or {}))
+
+
+def _inputs(bias=False, ignored=True):
+    generator = torch.Generator().manual_seed(0)
+    hidden = torch.randn(3, 7, D_MODEL, generator=generator, requires_grad=True)
+    weight = torch.randn(VOCAB_SIZE, D_MODEL, generator=generator).requires_grad_()
+    prediction = {"hidden_states": hidden, "lm_head_weight": weight}
+    if bias:
+        prediction["lm_head_bias"] = torch.randn(VOCAB_SIZE, generator=generator).requires_grad_()
+    labels = torch.randint(0, VOCAB_SIZE, (3, 7), generator=generator)
+    if ignored:
+        labels[0, :4] = -100
+        labels[2, -1] = -100
+    return prediction, labels
+
+
+def _reference(prediction, labels, z_loss_weight):
+    logits = prediction["hidden_states"] @ prediction["lm_head_weight"].T
+    if "lm_head_bias" in prediction:
+        logits = logits + prediction["lm_head_bias"]
+    logits, labels = logits.flatten(0, 1), labels.flatten()
+    valid = labels != -100
+    z_loss = torch.logsumexp(logits, dim=-1)[valid].square().mean()
+    return F.cross_entropy(logits, labels, ignore_index=-100) + z_loss_weight * z_loss
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 21, 64])
+@pytest.mark.parametrize("z_loss_weight", [0.0, 1e-2])
+@pytest.mark.parametrize("bias", [False, True])
+def test_matches_cross_entropy_on_full_logits(chunk_size, z_loss_weight, bias):
+    prediction, labels = _inputs(bias)
+    criterion = ChunkedCrossEntropy(chunk_size=chunk_size, z_loss_weight=z_loss_weight)
+    output = criterion({"labels": labels}, prediction, "train")
+    output["loss"].backward()
+    grads = [tensor.grad for tensor in prediction.values()]
+    for tensor in prediction.values():
+        tensor.grad = None
+
+    expected = _reference(prediction, labels, z_loss_weight)
+    expected.backward()
+    torch.testing.assert_close(output["loss"], expected)
+    for grad, tensor in zip(grads, prediction.values()):
+        torch.testing.assert_close(grad, tensor.grad)
+    torch.testing.assert_close(output["logs"]["cross_entropy"], _reference(prediction, labels, 0.0))
+    assert ("z_loss" in output["logs"]) == bool(z_loss_weight)
+
+
+def test_ignored_targets_do_not_contribute():
+    prediction, labels = _inputs()
+    loss = ChunkedCrossEntropy(chunk_size=4)({"labels": labels}, prediction, "train")["loss"]
+    loss.backward()
+    # Ignored positions get no gradient, and changing their hidden states does not change the loss
+    assert torch.equal(prediction["hidden_states"].grad[0, :4], torch.zeros(4, D_MODEL))
+    with torch.no_grad():
+        prediction["hidden_states"][0, :4] += 1
+    moved = ChunkedCrossEntropy(chunk_size=4)({"labels": labels}, prediction, "train")["loss"]
+    torch.testing.assert_close(moved, loss)
+
+    # Like `F.cross_entropy`: a nan loss, but zero gradients
+    labels.fill_(-100)
+    prediction["hidden_states"].grad = None
+    loss = ChunkedCrossEntropy()({"labels": labels}, prediction, "train")["loss"]
+    assert loss.isnan()
+    loss.backward()
+    assert torch.equal(prediction["hidden_states"].grad, torch.zeros_like(prediction["hidden_states"]))
+
+
+def test_no_grad_skips_the_gradient_matmuls():
+    prediction, labels = _inputs()
+    criterion = ChunkedCrossEntropy(chunk_size=6)
+    num_chunks = 4
+    with CountMatmuls() as counter:
+        criterion({"labels": labels}, prediction, "train")
+    # Logits, and the gradients of the weight and of the hidden states
+    assert counter.count == 3 * num_chunks
+    with torch.no_grad(), CountMatmuls() as counter:
+        loss = criterion({"labels": labels}, prediction, "eval")["loss"]
+    assert counter.count == num_chunks
+    assert loss.grad_fn is None
+    torch.testing.assert_close(loss, _reference(prediction, labels, 0.0))
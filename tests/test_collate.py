@@ -0,0 +1,73 @@
+import pytest
+import torch
+
+from data.collate_fns.packed import PackedCollateFn
+
+
+def _samples(sequence_ids):
+    return [
+        {"input": {"input_ids": torch.arange(len(ids)), "sequence_id": torch.tensor(ids)}, "target": torch.arange(len(ids))}
+        for ids in sequence_ids
+    ]
+
+
+def _reference(sequence_ids):
+    """Document segments of every row, one Python loop at a time."""
+    lengths, positions = [], []
+    for row in sequence_ids:
+        row_positions = []
+        for i, doc in enumerate(row):
+            if i == 0 or doc != row[i - 1]:
+                lengths.append(0)
+            row_positions.append(lengths[-1])
+            lengths[-1] += 1
+        positions.append(row_positions)
+    cu_seqlens = [0]
+    for length in lengths:
+        cu_seqlens.append(cu_seqlens[-1] + length)
+    return cu_seqlens, max(lengths), positions
+
+
+def test_hand_built_batch():
+    batch = PackedCollateFn()(_samples([[0, 0, 1, 1, 1, 2], [2, 2, 2, 3, 4, 4]]))
+    # Document 2 continues on the second row, but rows are always split
+    assert batch["input"]["cu_seqlens"].tolist() == [0, 2, 5, 6, 9, 10, 12]
+    assert batch["input"]["cu_seqlens"].dtype == torch.int32
+    assert batch["input"]["max_seqlen"] == 3
+    assert batch["input"]["position_ids"].tolist() == [[0, 1, 0, 1, 2, 0], [0, 1, 2, 0, 0, 1]]
+    # The default collation is kept
+    assert batch["input"]["input_ids"].shape == (2, 6)
+    assert torch.equal(batch["target"], torch.arange(6).expand(2, 6))
+
+
+@pytest.mark.parametrize("sequence_ids", [
+    [[5, 5, 5, 5]],                      # one document
+    [[0, 1, 2, 3], [4, 5, 6, 7]],        # one token per document
+    [[0, 1, 0, 0], [1, 1, 1, 1]],        # a reused id is a new document
+    [[7, 7, 7, 7], [7, 7, 7, 7]],        # a document spanning rows
+])
+def test_edge_cases_match_the_reference(sequence_ids):
+    batch = PackedCollateFn()(_samples(sequence_ids))
+    cu_seqlens, max_seqlen, positions = _reference(sequence_ids)
+    assert batch["input"]["cu_seqlens"].tolist() == cu_seqlens
+    assert batch["input"]["max_seqlen"] == max_seqlen
+    assert batch["input"]["position_ids"].tolist() == positions
+
+
+def test_random_batches_match_the_reference():
+    generator = torch.Generator().manual_seed(0)
+    for _ in range(20):
+        batch_size, seq_len = (int(x) for x in torch.randint(1, 9, (2,), generator=generator))
+        # Few distinct ids, so that documents of 1 to several tokens follow each other
+        sequence_ids = torch.randint(0, 3, (batch_size, seq_len), generator=generator).tolist()
+        batch = PackedCollateFn()(_samples(sequence_ids))
+        cu_seqlens, max_seqlen, positions = _reference(sequence_ids)
+        assert batch["input"]["cu_seqlens"].tolist() == cu_seqlens
+        assert batch["input"]["max_seqlen"] == max_seqlen
+        assert batch["input"]["position_ids"].tolist() == positions
+
+
+def test_custom_sequence_id_key():
+    samples = [{"input": {"doc": torch.tensor([0, 0, 1])}, "target": torch.zeros(3)}]
+    batch = PackedCollateFn(sequence_id_key="doc")(samples)
+    assert batch["input"]["cu_seqlens"].tolist() == [0, 2, 3]
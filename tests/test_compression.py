@@ -0,0 +1,129 @@
+import pytest
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from tests.distributed import run_distributed
+from training.parallelism.compression import BF16CompressionHook, PowerSGDHook, TopKCompressionHook
+from training.parallelism.data_parallel import DataParallel
+
+VOCAB_SIZE = 32
+STEPS = 60
+
+HOOKS = {
+    "none": lambda: None,
+    "bf16": lambda: BF16CompressionHook(),
+    "topk": lambda: TopKCompressionHook(ratio=0.1, uncompressed_patterns=["embed*"]),
+    "powersgd": lambda: PowerSGDHook(rank=2, start_step=5, uncompressed_patterns=["embed*"]),
+}
+
+
+class Net(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.embed = nn.Embedding(VOCAB_SIZE, 32)
+        self.hidden = nn.Linear(32, 64)
+        self.out = nn.Linear(64, VOCAB_SIZE)
+
+    def forward(self, tokens):
+        return self.out(F.gelu(self.hidden(self.embed(tokens))))
+
+
+def _model():
+    torch.manual_seed(0)
+    return Net()
+
+
+def _train(rank, world_size, hook_name):
+    model = _model()
+    hook = HOOKS[hook_name]()
+    wrapped = DataParallel(model, comm_hook=hook)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-2)
+    # Every rank learns the same mapping from its own samples
+    generator = torch.Generator().manual_seed(rank)
+    losses = []
+    for _ in range(STEPS):
+        tokens = torch.randint(0, VOCAB_SIZE, (32,), generator=generator)
+        loss = F.cross_entropy(wrapped(tokens), (7 * tokens + 3) % VOCAB_SIZE)
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        losses.append(loss.item())
+    return {
+        "losses": losses,
+        "stats": hook.stats() if hook is not None else None,
+        "params": [p.detach() for p in model.parameters()],
+    }
+
+
+@pytest.fixture(scope="module")
+def uncompressed():
+    return run_distributed(_train, 2, "none")
+
+
+@pytest.mark.parametrize("hook_name", ["bf16", "topk", "powersgd"])
+def test_compressed_training_converges_like_uncompressed(uncompressed, hook_name):
+    results = run_distributed(_train, 2, hook_name)
+    # The replicas receive the same averaged gradients
+    assert all(torch.equal(a, b) for a, b in zip(results[0]["params"], results[1]["params"]))
+
+    reference = uncompressed[0]["losses"]
+    losses = results[0]["losses"]
+    initial = sum(reference[:5]) / 5
+    final, reference_final = sum(losses[-10:]) / 10, sum(reference[-10:]) / 10
+    assert reference_final < 0.3 * initial
+    assert final < 0.4 * initial
+    assert abs(final - reference_final) < 0.1 * initial
+
+
+def test_bytes_sent_are_reported():
+    num_params = sum(p.numel() for p in _model().parameters())
+    uncompressed_bytes = 4 * num_params
+    embedding = VOCAB_SIZE * 32
+
+    stats = run_distributed(_train, 2, "bf16")[0]["stats"]
+    assert stats["bytes_sent_per_step"] == 2 * num_params
+    assert stats["compression_ratio"] == 2
+
+    stats = run_distributed(_train, 2, "topk")[0]["stats"]
+    # Values and int32 indices of 10% of the compressed entries, the embedding in full
+    k = int(0.1 * (num_params - embedding))
+    assert stats["bytes_sent_per_step"] == 8 * k + 4 * embedding
+    assert stats["compression_ratio"] == pytest.approx(uncompressed_bytes / stats["bytes_sent_per_step"])
+
+    stats = run_distributed(_train, 2, "powersgd")[0]["stats"]
+    # Plain all-reduces for the first steps, then the P and Q factors of both matrices, and the rest
+    compressed = sum((rows + cols) * 2 for rows, cols in [(64, 32), (VOCAB_SIZE, 64)])
+    rest = embedding + 64 + VOCAB_SIZE
+    expected = 5 * uncompressed_bytes + (STEPS - 5) * 4 * (compressed + rest)
+    assert stats["bytes_sent"] == expected
+    assert stats["compression_ratio"] > 2
+
+
+def _uncompressed_gradients(rank, world_size, hook_name):
+    model = _model()
+    wrapped = DataParallel(model, comm_hook=HOOKS[hook_name]())
+    for step in range(8):
+        model.zero_grad()
+        tokens = torch.randint(0, VOCAB_SIZE, (16,), generator=torch.Generator().manual_seed(10 * step + rank))
+        F.cross_entropy(wrapped(tokens), tokens).backward()
+    return model.embed.weight.grad
+
+
+@pytest.mark.parametrize("hook_name", ["topk", "powersgd"])
+def test_uncompressed_patterns_are_averaged_exactly(hook_name):
+    expected = run_distributed(_uncompressed_gradients, 2, "none")[0]
+    for grad in run_distributed(_uncompressed_gradients, 2, hook_name).values():
+        torch.testing.assert_close(grad, expected)
+
+
+def test_state_dict_roundtrip():
+    hook = PowerSGDHook(rank=2)
+    hook.bytes_sent, hook.num_steps = 100, 3
+    hook.qs[(0, 1)] = torch.ones(4, 2)
+    restored = PowerSGDHook(rank=2)
+    restored.load_state_dict(hook.state_dict())
+    assert restored.stats() == hook.stats()
+    assert torch.equal(restored.qs[(0, 1)], hook.qs[(0, 1)])
+    with pytest.raises(ValueError, match="ratio"):
+        TopKCompressionHook(ratio=0)
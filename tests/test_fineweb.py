@@ -0,0 +1,157 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+import torch
+from torch.utils.data import DataLoader
+
+from data.datasets.fineweb import FineWebDataset
+
+datasets = pytest.importorskip("datasets")
+
+NUM_DOCS = 120
+SEQ_LEN = 16
+
+
+class DocumentTokenizer:
+    """Tokenizes document "i" into 40 to 99 tokens that are unique to it: i * 1000 + position."""
+    vocab_size = NUM_DOCS * 1000
+
+    @staticmethod
+    def encode_batch(texts):
+        tokens = [int(text) * 1000 + np.arange(40 + 7 * int(text) % 60) for text in texts]
+        offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in tokens], out=offsets[1:])
+        return np.concatenate(tokens).astype(np.int64), offsets
+
+
+@pytest.fixture
+def local_fineweb(monkeypatch):
+    """Replaces the hub dataset by a local one, streamed from a single shard when `streaming`."""
+    def load_dataset(*args, streaming=False, **kwargs):
+        dataset = datasets.Dataset.from_dict({"text": [str(i) for i in range(NUM_DOCS)]})
+        return dataset.to_iterable_dataset(num_shards=1) if streaming else dataset
+
+    monkeypatch.setattr(datasets, "load_dataset", load_dataset)
+    monkeypatch.delenv("RANK", raising=False)
+    monkeypatch.delenv("WORLD_SIZE", raising=False)
+
+
+class LongDocumentTokenizer:
+    """Like `DocumentTokenizer`, but the first two documents are longer than the packer buffer."""
+    vocab_size = NUM_DOCS * 10000
+
+    @staticmethod
+    def encode_batch(texts):
+        tokens = [int(text) * 10000 + np.arange(2500 if int(text) < 2 else 50) for text in texts]
+        offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in tokens], out=offsets[1:])
+        return np.concatenate(tokens).astype(np.int64), offsets
+
+
+def _dataset(streaming, tokenizer=None, **kwargs):
+    return FineWebDataset(tokenizer or DocumentTokenizer(), seq_len=SEQ_LEN, streaming=streaming,
+                          shuffle_buffer_size=32, tokenization_batch_size=8, **kwargs)
+
+
+def _resumed(state, streaming, **kwargs):
+    dataset = _dataset(streaming, **kwargs)
+    dataset.load_state_dict(state)
+    return dataset
+
+
+def _state_after(dataset, num_samples):
+    iterator = iter(dataset)
+    for _ in range(num_samples):
+        next(iterator)
+    return dataset.state_dict()
+
+
+def _tokens(samples):
+    return [token for sample in samples for token in sample["input"]["input_ids"].tolist()]
+
+
+# Map-style sources are split by shard files, a single-shard stream by strided examples
+@pytest.mark.parametrize("streaming", [False, True])
+def test_workers_and_ranks_read_disjoint_slices_covering_the_data(local_fineweb, monkeypatch, streaming):
+    tokens = []
+    for rank in range(2):
+        monkeypatch.setenv("RANK", str(rank))
+        monkeypatch.setenv("WORLD_SIZE", "2")
+        loader = DataLoader(_dataset(streaming), batch_size=None, num_workers=2, multiprocessing_context="fork")
+        tokens += _tokens(loader)
+
+    # Token ids are unique, and consecutive inputs of one stream do not overlap
+    duplicated = [token for token, count in Counter(tokens).items() if count > 1]
+    assert not duplicated
+    # Every document has at least one full chunk of tokens, even the last one of a stream
+    assert {token // 1000 for token in tokens} == set(range(NUM_DOCS))
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_iteration_is_deterministic(local_fineweb, streaming):
+    first = [sample["target"] for sample in _dataset(streaming)]
+    second = [sample["target"] for sample in _dataset(streaming)]
+    assert len(first) == len(second) > 0
+    assert all(torch.equal(a, b) for a, b in zip(first, second))
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize("packing", ["greedy", "best_fit"])
+def test_resume_yields_exactly_the_remaining_samples(local_fineweb, streaming, packing):
+    # Resuming a stream refills its shuffle buffer (see `state_dict`), so it is not shuffled here
+    kwargs = {"shuffle": not streaming, "packing": packing}
+    if packing == "best_fit":
+        kwargs["packing_window"] = 10
+    full = [sample["target"] for sample in _dataset(streaming, **kwargs)]
+    for cut in (0, 1, 7, len(full) // 2, len(full) - 1):
+        dataset = _dataset(streaming, **kwargs)
+        iterator = iter(dataset)
+        for _ in range(cut + 1):
+            next(iterator)
+        state = dataset.state_dict()
+
+        resumed = _dataset(streaming, **kwargs)
+        resumed.load_state_dict(state)
+        rest = [sample["target"] for sample in resumed]
+        assert len(rest) == len(full) - cut - 1, cut
+        assert all(torch.equal(a, b) for a, b in zip(rest, full[cut + 1:])), cut
+
+
+def test_resume_rejects_another_number_of_shards(local_fineweb, monkeypatch):
+    dataset = _dataset(False)
+    next(iter(dataset))
+    state = dataset.state_dict()
+    monkeypatch.setenv("RANK", "0")
+    monkeypatch.setenv("WORLD_SIZE", "2")
+    resumed = _dataset(False)
+    resumed.load_state_dict(state)
+    with pytest.raises(ValueError, match="data shards"):
+        next(iter(resumed))
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_resume_applies_to_the_next_epoch_only(local_fineweb, streaming):
+    kwargs = {"shuffle": not streaming}
+    full = [sample["target"] for sample in _dataset(streaming, **kwargs)]
+    resumed = _resumed(_state_after(_dataset(streaming, **kwargs), 8), streaming, **kwargs)
+    first = [sample["target"] for sample in resumed]
+    second = [sample["target"] for sample in resumed]
+    assert len(first) == len(full) - 8
+    assert len(second) == len(full)
+    assert all(torch.equal(a, b) for a, b in zip(second, full))
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_resume_twice_inside_a_long_document(local_fineweb, streaming):
+    # The packer buffer holds 64 samples: past it, resuming slices the document before packing it
+    kwargs = {"shuffle": False, "tokenizer": LongDocumentTokenizer()}
+    full = [sample["target"] for sample in _dataset(streaming, **kwargs)]
+    for cut in (70, 100, 200):
+        state = _state_after(_dataset(streaming, **kwargs), cut)
+        assert 0 < state["token_offset"] < 2500, cut
+        # Resumed, then checkpointed again a few samples later, in the same document
+        state = _state_after(_resumed(state, streaming, **kwargs), 5)
+        rest = [sample["target"] for sample in _resumed(state, streaming, **kwargs)]
+        assert len(rest) == len(full) - cut - 5, cut
+        assert all(torch.equal(a, b) for a, b in zip(rest, full[cut + 5:])), cut
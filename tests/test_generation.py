@@ -0,0 +1,142 @@
+import pytest
+import torch
+import torch.nn as nn
+
+from modeling.generation.engine import GenerationEngine
+from modeling.generation.kv_cache import PagedKVCache
+from modeling.generation.sampling import sample
+from modeling.models.gpt import GPT
+
+VOCAB_SIZE = 64
+# Prompts of different lengths, some spanning several pages of 4 tokens
+PROMPTS = [[1, 2, 3], [5] * 9, [7, 8], [9, 10, 11, 12, 13], [20, 21, 22, 23, 24, 25, 26], [30]]
+
+
+class Tokenizer:
+    def __init__(self, eot_token_id=VOCAB_SIZE):
+        # Out of the vocabulary by default: generation never stops early
+        self.eot_token_id = eot_token_id
+
+
+class FullSequenceModel(nn.Module):
+    """Hides the `kv_cache` argument, so the engine recomputes the whole sequence at every step."""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids):
+        return self.model(input_ids=input_ids)
+
+
+def _model(**kwargs):
+    torch.manual_seed(0)
+    # Double precision, so that batching and caching cannot flip a greedy choice
+    return GPT(VOCAB_SIZE, d_model=32, n_layers=2, n_heads=2, **kwargs).double()
+
+
+def _engine(model=None, eot_token_id=VOCAB_SIZE, **kwargs):
+    kwargs = {"max_seq_len": 32, "page_size": 4, "temperature": 0, **kwargs}
+    return GenerationEngine(model or _model(), Tokenizer(eot_token_id), **kwargs)
+
+
+def _greedy_reference(model, prompt, max_new_tokens):
+    tokens = list(prompt)
+    for _ in range(max_new_tokens):
+        tokens.append(model(input_ids=torch.tensor([tokens]))[0, -1].argmax().item())
+    return tokens[len(prompt):]
+
+
+@torch.no_grad()
+def test_paged_kv_cache_matches_full_recompute():
+    model = _model()
+    cached = _engine(model, max_batch_size=4).generate(PROMPTS, max_new_tokens=10)
+    recomputed = _engine(FullSequenceModel(model), max_batch_size=4).generate(PROMPTS, max_new_tokens=10)
+    assert cached == recomputed
+    assert cached == [_greedy_reference(model, prompt, 10) for prompt in PROMPTS]
+
+
+def test_hidden_state_outputs_match_logits():
+    expected = _engine().generate(PROMPTS, max_new_tokens=6)
+    assert _engine(_model(return_hidden_states=True)).generate(PROMPTS, max_new_tokens=6) == expected
+
+
+def test_stops_on_max_new_tokens_and_max_seq_len():
+    engine = _engine(max_seq_len=10)
+    outputs = engine.generate(PROMPTS, max_new_tokens=4)
+    # The 9-token prompt only has room for 1 token
+    assert [len(output) for output in outputs] == [4, 1, 4, 4, 3, 4]
+    assert engine.stats["num_tokens"] == 20
+    with pytest.raises(ValueError, match="max_new_tokens"):
+        engine.generate(PROMPTS, max_new_tokens=0)
+    with pytest.raises(ValueError, match="Prompt 0"):
+        engine.generate([[1] * 10])
+
+
+def test_stops_on_eot():
+    outputs = _engine().generate(PROMPTS, max_new_tokens=8)
+    eot = outputs[0][3]
+    stopped = _engine(eot_token_id=eot).generate(PROMPTS, max_new_tokens=8)
+    for output, full in zip(stopped, outputs):
+        # Up to the first end-of-text token, which is not returned
+        assert output == (full[:full.index(eot)] if eot in full else full)
+    assert len(stopped[0]) <= 3
+
+
+@pytest.mark.parametrize("max_batch_size, num_pages", [(2, None), (4, None), (4, 8)])
+def test_continuous_batching_matches_requests_run_alone(max_batch_size, num_pages):
+    model = _model()
+    alone = [_engine(model, max_batch_size=1).generate([prompt], max_new_tokens=12)[0] for prompt in PROMPTS]
+    # Requests join the batch as earlier ones finish (fewer slots, or fewer pages, than requests)
+    engine = _engine(model, max_batch_size=max_batch_size, num_pages=num_pages)
+    assert engine.generate(PROMPTS, max_new_tokens=12) == alone
+    assert len(engine.kv_cache.free_pages) == engine.num_pages
+    assert not engine.kv_cache.block_tables
+
+
+def test_a_request_larger_than_the_cache_is_rejected():
+    with pytest.raises(RuntimeError, match="too small"):
+        _engine(num_pages=2).generate([[1] * 9], max_new_tokens=4)
+
+
+def test_page_allocation_and_freeing():
+    cache = PagedKVCache(num_pages=5, page_size=4)
+    cache.add_sequence(0, 9)
+    assert cache.block_tables[0] == [0, 1, 2]
+    assert not cache.can_add(9) and cache.can_add(8)
+    with pytest.raises(RuntimeError, match="Not enough free pages"):
+        cache.add_sequence(1, 9)
+    with pytest.raises(ValueError, match="already"):
+        cache.add_sequence(0, 1)
+    cache.add_sequence(1, 5)
+    assert cache.block_tables[1] == [3, 4]
+    assert cache.free_pages == []
+
+    cache.free(0)
+    assert sorted(cache.free_pages) == [0, 1, 2]
+    cache.add_sequence(2, 4)
+    assert cache.block_tables[2] == [0]
+    # A sequence cannot grow past the pages it reserved
+    with pytest.raises(RuntimeError, match="exceeds"):
+        cache.begin_step([2], [5], torch.device("cpu"))
+    with pytest.raises(ValueError):
+        PagedKVCache(num_pages=0)
+
+
+def _draws(logits, **kwargs):
+    rows = logits.expand(4000, -1)
+    return set(sample(rows, generator=torch.Generator().manual_seed(0), **kwargs).tolist())
+
+
+def test_top_k_and_top_p_masking():
+    probs = torch.tensor([[0.05, 0.5, 0.15, 0.3]])
+    logits = probs.log()
+    assert _draws(logits) == {0, 1, 2, 3}
+    assert _draws(logits, top_k=2) == {1, 3}
+    assert _draws(logits, top_k=1) == {1}
+    # 0.5 + 0.3 reach 0.7; the most likely token is always kept
+    assert _draws(logits, top_p=0.7) == {1, 3}
+    assert _draws(logits, top_p=0.8) == {1, 3}
+    assert _draws(logits, top_p=0.81) == {1, 2, 3}
+    assert _draws(logits, top_p=0.1) == {1}
+    assert _draws(logits, top_k=3, top_p=0.95) == {1, 2, 3}
+    assert sample(logits, temperature=0).tolist() == [1]
@@ -0,0 +1,87 @@
+import pytest
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from modeling.models.gpt import GPT
+from modeling.wrappers.gradient_accumulation import GradientAccumulation
+from training.criteria.chunked_cross_entropy import ChunkedCrossEntropy
+from training.criteria.cross_entropy import CrossEntropy
+
+VOCAB_SIZE = 48
+BATCH_SIZE = 5
+SEQ_LEN = 6
+
+
+class FlatLogits(nn.Module):
+    """GPT returning [B * T, vocab_size] logits, as `CrossEntropy` takes them."""
+    def __init__(self):
+        super().__init__()
+        self.gpt = GPT(VOCAB_SIZE, d_model=32, n_layers=2, n_heads=2)
+
+    def forward(self, input_ids):
+        return self.gpt(input_ids).flatten(0, 1)
+
+
+def _batch(flat_targets):
+    generator = torch.Generator().manual_seed(0)
+    tokens = torch.randint(0, VOCAB_SIZE, (BATCH_SIZE, SEQ_LEN + 1), generator=generator)
+    targets = tokens[:, 1:].clone()
+    # Rows hold very different numbers of targets: row 1 has a single one, row 3 none
+    targets[0, :2] = -100
+    targets[1, 1:] = -100
+    targets[3] = -100
+    return {"input": {"input_ids": tokens[:, :-1]}, "target": targets.flatten() if flat_targets else targets}
+
+
+def _gradients(model, batch, criterion, **accumulation):
+    model.zero_grad()
+    if accumulation:
+        output = GradientAccumulation(**accumulation)(model, None).forward_backward(batch, criterion)
+    else:
+        output = criterion(batch, model(**batch["input"]), "train")
+        output["loss"].backward()
+    return output, [p.grad.clone() for p in model.parameters() if p.grad is not None]
+
+
+@pytest.mark.parametrize("accumulation", [
+    {"num_micro_batches": 2},
+    {"num_micro_batches": 5},
+    # Rows 2-3 hold the targets of row 2 only
+    {"micro_batch_size": 2},
+])
+@pytest.mark.parametrize("chunked", [False, True])
+def test_matches_the_unwrapped_model_with_ignored_targets(accumulation, chunked):
+    torch.manual_seed(0)
+    if chunked:
+        model = GPT(VOCAB_SIZE, d_model=32, n_layers=2, n_heads=2, return_hidden_states=True)
+        criterion = ChunkedCrossEntropy(target_key="target", chunk_size=4)
+    else:
+        model = FlatLogits()
+        criterion = CrossEntropy(target_key="target")
+    batch = _batch(flat_targets=not chunked)
+
+    expected, expected_grads = _gradients(model, batch, criterion)
+    output, grads = _gradients(model, batch, criterion, **accumulation)
+    torch.testing.assert_close(output["loss"], expected["loss"].detach())
+    torch.testing.assert_close(output["logs"]["loss"], expected["logs"]["loss"])
+    assert len(grads) == len(expected_grads)
+    for grad, expected_grad in zip(grads, expected_grads):
+        torch.testing.assert_close(grad, expected_grad, rtol=1e-4, atol=1e-6)
+
+
+def _row_mean_criterion(data, prediction, mode):
+    loss = F.cross_entropy(prediction, data["target"], reduction="none").view(-1, SEQ_LEN).sum(1).mean()
+    return {"loss": loss, "logs": {"loss": loss.detach()}}
+
+
+def test_criteria_without_target_key_are_weighted_by_rows():
+    torch.manual_seed(0)
+    model = FlatLogits()
+    batch = _batch(flat_targets=True)
+    batch["target"].clamp_(min=0)
+    expected, expected_grads = _gradients(model, batch, _row_mean_criterion)
+    output, grads = _gradients(model, batch, _row_mean_criterion, micro_batch_size=2)
+    torch.testing.assert_close(output["loss"], expected["loss"].detach())
+    for grad, expected_grad in zip(grads, expected_grads):
+        torch.testing.assert_close(grad, expected_grad, rtol=1e-4, atol=1e-6)
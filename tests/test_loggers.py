@@ -0,0 +1,135 @@
+import csv
+import json
+
+import pytest
+import torch
+import torch.nn as nn
+from torch.overrides import TorchFunctionMode
+
+from tests.distributed import run_distributed
+from training.criteria.cross_entropy import CrossEntropy
+from training.loggers.buffered import BufferedLogger
+from training.optimizers.adamw8bit import AdamW8bit
+
+# Everything that copies a tensor value to the host, and so waits for the device
+_HOST_READS = {
+    torch.Tensor.item, torch.Tensor.tolist, torch.Tensor.numpy, torch.Tensor.cpu,
+    torch.Tensor.__float__, torch.Tensor.__int__, torch.Tensor.__bool__, torch.Tensor.__index__,
+}
+
+
+class NoHostReads(TorchFunctionMode):
+    """Raises on any read of a tensor value by the host. Modes are per thread: the writer thread is not checked."""
+    def __torch_function__(self, func, types, args=(), kwargs=None):
+        if func in _HOST_READS:
+            raise AssertionError(f"{func.__name__} reads a tensor on the host")
+        return func(*args, **(kwargs or {}))
+
+
+def _records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def _train(logger, steps, generator):
+    torch.manual_seed(0)
+    model = nn.Linear(16, 8)
+    criterion = CrossEntropy()
+    optimizer = AdamW8bit(model.parameters())
+    losses = []
+    for step in range(1, steps + 1):
+        data = {"input": torch.randn(4, 16, generator=generator), "labels": torch.randint(0, 8, (4,), generator=generator)}
+        with NoHostReads():
+            outputs = criterion(data, model(data["input"]), "train")
+            outputs["loss"].backward()
+            optimizer.step()
+            optimizer.zero_grad()
+            logger.log({**outputs["logs"], "lr": 0.5}, step)
+        losses.append(outputs["logs"]["loss"].item())
+    logger.close()
+    return losses
+
+
+def test_the_check_catches_a_host_read():
+    with pytest.raises(AssertionError, match="item"), NoHostReads():
+        torch.ones(()).item()
+    with pytest.raises(AssertionError, match="__float__"), NoHostReads():
+        float(torch.ones(()))
+
+
+def test_training_step_does_not_read_metrics_on_the_host(tmp_path):
+    logger = BufferedLogger(str(tmp_path), log_every=4, formats=("jsonl", "csv"))
+    losses = _train(logger, 10, torch.Generator().manual_seed(1))
+
+    # Two full windows and the partial one flushed by `close`
+    records = _records(tmp_path / "metrics.jsonl")
+    assert [record["step"] for record in records] == [4, 8, 10]
+    for record, window in zip(records, (losses[0:4], losses[4:8], losses[8:10])):
+        assert record["loss"] == pytest.approx(sum(window) / len(window))
+        assert record["lr"] == 0.5
+        assert record["steps_per_second"] > 0
+    with open(tmp_path / "metrics.csv", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [float(row["loss"]) for row in rows] == pytest.approx([record["loss"] for record in records])
+
+
+def test_sum_reduction(tmp_path):
+    logger = BufferedLogger(str(tmp_path), log_every=3, reduction="sum")
+    for step in range(1, 4):
+        logger.log({"tokens": torch.tensor([step, step]), "samples": 2}, step)
+    logger.close()
+    assert _records(tmp_path / "metrics.jsonl")[0]["tokens"] == 12
+    assert _records(tmp_path / "metrics.jsonl")[0]["samples"] == 6
+
+
+def test_writer_errors_are_raised(tmp_path):
+    (tmp_path / "file").write_text("")
+    logger = BufferedLogger(str(tmp_path / "file"), log_every=1)
+    logger.log({"loss": torch.ones(())}, 1)
+    with pytest.raises(RuntimeError, match="writer thread failed"):
+        logger.close()
+
+
+def _distributed_logging(rank, world_size, output_dir):
+    import torch.distributed as dist
+    all_reduce = dist.all_reduce
+    calls = []
+
+    def counting_all_reduce(*args, **kwargs):
+        calls.append(args[0].shape)
+        return all_reduce(*args, **kwargs)
+
+    dist.all_reduce = counting_all_reduce
+    try:
+        logger = BufferedLogger(output_dir, log_every=2)
+        for step in (1, 2):
+            with NoHostReads():
+                logger.log({"loss": torch.tensor(float(rank + step)), "accuracy": torch.tensor(float(rank))}, step)
+        logger.close()
+    finally:
+        dist.all_reduce = all_reduce
+    return calls
+
+
+def test_metrics_are_reduced_across_ranks_in_one_collective(tmp_path):
+    results = run_distributed(_distributed_logging, 2, str(tmp_path))
+    # One all-reduce per window, of every metric at once
+    assert results[0] == results[1] == [torch.Size([2])]
+    # Only rank 0 writes: the mean of 1, 2 (rank 0) and 2, 3 (rank 1)
+    (record,) = _records(tmp_path / "metrics.jsonl")
+    del record["steps_per_second"]
+    assert record == {"step": 2, "accuracy": 0.5, "loss": 2.0}
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="CUDA is not available")
+def test_cuda_step_does_not_synchronize(tmp_path):
+    logger = BufferedLogger(str(tmp_path), log_every=4)
+    loss = torch.ones((), device="cuda")
+    torch.cuda.set_sync_debug_mode("error")
+    try:
+        for step in range(1, 10):
+            logger.log({"loss": loss * step}, step)
+    finally:
+        torch.cuda.set_sync_debug_mode("default")
+    logger.close()
+    assert [record["step"] for record in _records(tmp_path / "metrics.jsonl")] == [4, 8, 9]
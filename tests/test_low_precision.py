@@ -0,0 +1,172 @@
+import pytest
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from tests.distributed import run_distributed
+from training.optimizers.adamw8bit import AdamW8bit
+from training.optimizers.low_precision import (
+    dequantize_blockwise,
+    optimizer_state_bytes,
+    quantize_blockwise,
+    stochastic_round_,
+)
+from training.optimizers.muon import Muon
+from training.optimizers.muon_adamw import MuonAdamW
+
+
+def _model(dtype=torch.float32):
+    torch.manual_seed(0)
+    return nn.Sequential(nn.Linear(32, 128), nn.GELU(), nn.Linear(128, 128), nn.GELU(), nn.Linear(128, 1)).to(dtype)
+
+
+def _data():
+    generator = torch.Generator().manual_seed(1)
+    inputs = torch.randn(256, 32, generator=generator)
+    targets = torch.sin(inputs @ torch.randn(32, 1, generator=generator))
+    return inputs, targets
+
+
+def _train(model, optimizer, steps=150):
+    inputs, targets = _data()
+    dtype = next(model.parameters()).dtype
+    losses = []
+    for _ in range(steps):
+        loss = F.mse_loss(model(inputs.to(dtype)).float(), targets)
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        losses.append(loss.item())
+    return losses
+
+
+@pytest.mark.parametrize("signed", [True, False])
+def test_blockwise_quantization_roundtrip(signed):
+    x = torch.randn(1000, generator=torch.Generator().manual_seed(0))
+    if not signed:
+        x = x.abs()
+    codes, absmax = quantize_blockwise(x, block_size=64, signed=signed)
+    assert codes.dtype == (torch.int8 if signed else torch.uint8)
+    assert codes.shape == (16, 64) and absmax.shape == (16,)
+    restored = dequantize_blockwise(codes, absmax, x.shape)
+    # The square-root code has a step of at most 2/127 (2/255) of the block maximum
+    bound = (2 / 127 if signed else 2 / 255) * absmax.repeat_interleave(64)[:1000]
+    assert ((restored - x).abs() <= bound).all()
+    assert torch.equal(dequantize_blockwise(*quantize_blockwise(torch.zeros(10)), torch.Size([10])), torch.zeros(10))
+
+
+def test_stochastic_rounding_is_unbiased():
+    # Halfway between two bfloat16 values, far below the resolution of the first one
+    value = torch.full((100_000,), 1 + 2 ** -9)
+    target = torch.empty_like(value, dtype=torch.bfloat16)
+    stochastic_round_(target, value, generator=torch.Generator().manual_seed(0))
+    assert set(target.float().unique().tolist()) == {1.0, 1 + 2 ** -7}
+    assert abs(target.float().mean().item() - value[0].item()) < 1e-4
+    with pytest.raises(ValueError, match="bfloat16"):
+        stochastic_round_(value.clone(), value)
+
+
+def test_adamw8bit_converges_like_adamw():
+    reference = _train(model := _model(), torch.optim.AdamW(model.parameters(), lr=3e-3))
+    quantized = _train(model := _model(), AdamW8bit(model.parameters(), lr=3e-3, min_8bit_size=1024))
+    assert reference[-1] < 0.2 * reference[0]
+    assert quantized[-1] < 0.2 * quantized[0]
+    assert abs(quantized[-1] - reference[-1]) < 0.25 * reference[-1]
+
+
+def test_adamw8bit_float32_parameters_match_adamw():
+    # Without 8-bit moments, the update is that of AdamW
+    reference = _model()
+    _train(reference, torch.optim.AdamW(reference.parameters(), lr=3e-3), steps=5)
+    model = _model()
+    _train(model, AdamW8bit(model.parameters(), lr=3e-3, min_8bit_size=10 ** 9), steps=5)
+    for a, b in zip(reference.parameters(), model.parameters()):
+        torch.testing.assert_close(a, b)
+
+
+def test_adamw8bit_trains_bfloat16_parameters():
+    model = _model(torch.bfloat16)
+    losses = _train(model, AdamW8bit(model.parameters(), lr=3e-3, min_8bit_size=1024))
+    assert losses[-1] < 0.3 * losses[0]
+    assert all(p.dtype == torch.bfloat16 for p in model.parameters())
+
+
+def test_bfloat16_muon_momentum_converges_like_float32():
+    losses = {}
+    for momentum_dtype in (None, "bfloat16"):
+        model = _model()
+        optimizer = MuonAdamW(model.named_parameters(), lr=0.02, adamw_lr=3e-3, momentum_dtype=momentum_dtype)
+        losses[momentum_dtype] = _train(model, optimizer)
+        buffers = [state["momentum_buffer"] for state in optimizer.state.values() if "momentum_buffer" in state]
+        assert buffers and all(b.dtype == (torch.bfloat16 if momentum_dtype else torch.float32) for b in buffers)
+    assert losses["bfloat16"][-1] < 0.2 * losses["bfloat16"][0]
+    assert abs(losses["bfloat16"][-1] - losses[None][-1]) < 0.25 * losses[None][-1]
+
+
+def _muon_small_updates(dtype, steps=50, **kwargs):
+    """A 64x64 matrix of ones stepped with a fixed gradient, by updates below the bfloat16 resolution."""
+    gradient = torch.randn(64, 64, generator=torch.Generator().manual_seed(0)).bfloat16().float()
+    param = nn.Parameter(torch.ones(64, 64, dtype=dtype))
+    optimizer = Muon([param], lr=1e-3, weight_decay=0.0, **kwargs)
+    for _ in range(steps):
+        param.grad = gradient.to(dtype)
+        optimizer.step()
+    return param.detach().float()
+
+
+@pytest.mark.parametrize("foreach", [False, True])
+def test_muon_stochastic_rounding_keeps_updates_below_bfloat16_resolution(foreach):
+    reference = _muon_small_updates(torch.float32, foreach=foreach) - 1
+    assert reference.abs().mean() > 1e-3
+    # Rounded to nearest, every update is lost
+    nearest = _muon_small_updates(torch.bfloat16, foreach=foreach, stochastic_rounding=False)
+    assert torch.equal(nearest, torch.ones(64, 64))
+    # Stochastically rounded, the updates are kept on average
+    moved = _muon_small_updates(torch.bfloat16, foreach=foreach) - 1
+    assert (moved * reference).sum() > 0.8 * reference.square().sum()
+    assert abs(moved.mean() - reference.mean()) < 0.1 * reference.abs().mean()
+
+
+def _distributed_bfloat16_muon(rank, world_size, foreach):
+    # Ranks consume the global generator differently, the rounding noise must not depend on it
+    torch.rand(rank + 1)
+    return _muon_small_updates(torch.bfloat16, steps=10, foreach=foreach, distributed=True)
+
+
+@pytest.mark.parametrize("foreach", [False, True])
+def test_muon_stochastic_rounding_keeps_replicas_identical(foreach):
+    results = run_distributed(_distributed_bfloat16_muon, 2, foreach)
+    assert torch.equal(results[0], results[1])
+    assert not torch.equal(results[0], torch.ones(64, 64))
+
+
+def test_muon_adamw_trains_bfloat16_parameters():
+    model = _model(torch.bfloat16)
+    optimizer = MuonAdamW(model.named_parameters(), lr=0.02, adamw_lr=3e-3)
+    losses = _train(model, optimizer)
+    assert losses[-1] < 0.3 * losses[0]
+    assert all(p.dtype == torch.bfloat16 for p in model.parameters())
+    assert all(group["stochastic_rounding"] for group in optimizer.param_groups if group["use_muon"])
+
+
+def test_state_bytes():
+    model = _model()
+    params = sum(p.numel() for p in model.parameters())
+    large = sum(p.numel() for p in model.parameters() if p.numel() >= 1024)
+    small = params - large
+
+    adamw = torch.optim.AdamW(model.parameters())
+    _train(model, adamw, steps=1)
+    # Two float32 moments and a float32 step per parameter
+    assert optimizer_state_bytes(adamw)["state"] == 8 * params + 4 * len(adamw.state)
+    assert optimizer_state_bytes(adamw)["params"] == 4 * params
+
+    quantized = AdamW8bit(model.parameters(), min_8bit_size=1024, block_size=64)
+    _train(model, quantized, steps=1)
+    accounted = optimizer_state_bytes(quantized)
+    # One byte per moment and value, plus one float32 scale per block and moment
+    num_blocks = sum(-(-p.numel() // 64) for p in model.parameters() if p.numel() >= 1024)
+    assert accounted["per_key"]["exp_avg_codes"] == accounted["per_key"]["exp_avg_sq_codes"] == 64 * num_blocks
+    assert accounted["per_key"]["exp_avg_absmax"] == 4 * num_blocks
+    assert accounted["state"] == 2 * (64 + 4) * num_blocks + 8 * small
+    assert accounted["state"] < 0.3 * optimizer_state_bytes(adamw)["state"]
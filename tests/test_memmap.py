@@ -0,0 +1,137 @@
+import json
+
+import numpy as np
+import pytest
+import torch
+from torch.utils.data import DistributedSampler
+
+from data.datasets.memmap import MemmapTokenDataset
+from data.pretokenize import METADATA_FILE, ShardWriter, pretokenize, token_dtype
+
+datasets = pytest.importorskip("datasets")
+
+NUM_DOCS = 50
+SEQ_LEN = 8
+
+
+class Tokenizer:
+    """Tokenizes document "i" into 3 to 19 tokens: `first_id` + 100 * i + position."""
+    eot_token_id = 1
+
+    def __init__(self, vocab_size=2000, first_id=0):
+        self.vocab_size = vocab_size
+        self.first_id = first_id
+
+    def document(self, text):
+        i = int(text)
+        return self.first_id + 100 * i + np.arange(3 + 7 * i % 17)
+
+    def encode_batch(self, texts, append_eot=False):
+        tokens = [self.document(text) for text in texts]
+        if append_eot:
+            tokens = [np.append(t, self.eot_token_id) for t in tokens]
+        offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in tokens], out=offsets[1:])
+        return np.concatenate(tokens), offsets
+
+
+@pytest.fixture
+def local_dataset(monkeypatch):
+    def load_dataset(*args, **kwargs):
+        return datasets.Dataset.from_dict({"text": [str(i) for i in range(NUM_DOCS)]}).to_iterable_dataset()
+
+    monkeypatch.setattr(datasets, "load_dataset", load_dataset)
+
+
+def _pretokenize(tokenizer, output_dir, **kwargs):
+    return pretokenize(tokenizer, str(output_dir), "local", tokenization_batch_size=7, **kwargs)
+
+
+def _stream(tokenizer, append_eot=False):
+    """Token stream and document of every token, in the order of the dataset."""
+    tokens, offsets = tokenizer.encode_batch([str(i) for i in range(NUM_DOCS)], append_eot=append_eot)
+    return tokens, np.repeat(np.arange(NUM_DOCS), np.diff(offsets))
+
+
+@pytest.mark.parametrize("vocab_size, first_id, append_eot, dtype", [
+    (2000, 0, False, "uint16"),
+    (2000, 0, True, "uint16"),
+    # Ids past the uint16 range must not wrap around
+    (80000, 70000, False, "uint32"),
+])
+def test_pretokenize_round_trip(local_dataset, tmp_path, vocab_size, first_id, append_eot, dtype):
+    tokenizer = Tokenizer(vocab_size, first_id)
+    metadata = _pretokenize(tokenizer, tmp_path, append_eot=append_eot, max_shard_tokens=100)
+    assert metadata["dtype"] == dtype
+    assert metadata["num_docs"] == NUM_DOCS and len(metadata["shards"]) > 1
+
+    tokens, docs = _stream(tokenizer, append_eot)
+    assert metadata["num_tokens"] == len(tokens)
+    dataset = MemmapTokenDataset(None, str(tmp_path), seq_len=SEQ_LEN)
+    # Documents are never split across shards, so every shard is a slice of the stream
+    start = 0
+    for shard in dataset.shards:
+        stored = np.fromfile(tmp_path / shard["tokens"], dtype=dtype)
+        assert np.array_equal(stored, tokens[start:start + shard["num_tokens"]])
+        start += shard["num_tokens"]
+
+    for index in range(len(dataset)):
+        sample = dataset[index]
+        ids = torch.cat([sample["input"]["input_ids"], sample["target"][-1:]]).numpy()
+        position = _find(tokens, ids)
+        assert np.array_equal(sample["input"]["sequence_id"].numpy(), docs[position:position + SEQ_LEN])
+        assert torch.equal(sample["input"]["input_ids"][1:], sample["target"][:-1])
+
+
+def _find(tokens, window):
+    for position in np.flatnonzero(tokens == window[0]):
+        if np.array_equal(tokens[position:position + len(window)], window):
+            return position
+    raise AssertionError(f"Window {window} is not in the token stream")
+
+
+def test_token_ids_are_checked_on_write(local_dataset, tmp_path):
+    # The EOT token lies outside of the vocabulary, as added tokens do
+    tokenizer = Tokenizer(vocab_size=2**16)
+    tokenizer.eot_token_id = 2**16
+    assert _pretokenize(tokenizer, tmp_path / "eot", append_eot=True)["dtype"] == "uint32"
+
+    # A tokenizer reporting a vocabulary smaller than its ids
+    with pytest.raises(ValueError, match="uint16"):
+        _pretokenize(Tokenizer(vocab_size=1000, first_id=2**16 - 10), tmp_path / "wrap")
+    writer = ShardWriter(str(tmp_path / "negative"), np.uint32)
+    with pytest.raises(ValueError, match="uint32"):
+        writer.write([1, -1])
+    assert token_dtype(2**16 - 1) == np.uint16 and token_dtype(2**16) == np.uint32
+
+
+def test_windows_and_ranks_are_disjoint(local_dataset, tmp_path):
+    tokenizer = Tokenizer()
+    _pretokenize(tokenizer, tmp_path, max_shard_tokens=100)
+    dataset = MemmapTokenDataset(None, str(tmp_path), seq_len=SEQ_LEN)
+    with open(tmp_path / METADATA_FILE) as f:
+        shards = json.load(f)["shards"]
+    assert len(dataset) == sum((shard["num_tokens"] - 1) // SEQ_LEN for shard in shards)
+
+    # Every input token is served once: windows overlap by their target token only and
+    # never cross a shard boundary
+    tokens, _ = _stream(tokenizer)
+    shard_ends = np.cumsum([shard["num_tokens"] for shard in shards])
+    positions = []
+    for index in range(len(dataset)):
+        window = torch.cat([dataset[index]["input"]["input_ids"], dataset[index]["target"][-1:]]).numpy()
+        start = _find(tokens, window)
+        assert start + SEQ_LEN < shard_ends[np.searchsorted(shard_ends, start, side="right")]
+        positions.extend(range(start, start + SEQ_LEN))
+    assert len(positions) == len(set(positions)) == len(dataset) * SEQ_LEN
+
+    # Ranks read disjoint samples that together cover the dataset
+    samples = [
+        list(DistributedSampler(dataset, num_replicas=3, rank=rank, shuffle=True, seed=0, drop_last=True))
+        for rank in range(3)
+    ]
+    flat = [index for rank_samples in samples for index in rank_samples]
+    assert len(flat) == len(set(flat)) == 3 * (len(dataset) // 3)
+    with pytest.raises(IndexError):
+        dataset[len(dataset)]
+    assert torch.equal(dataset[-1]["target"], dataset[len(dataset) - 1]["target"])
@@ -0,0 +1,153 @@
+import pytest
+import torch
+
+from tests.distributed import run_distributed
+from training.optimizers.muon import (
+    DEFAULT_A,
+    DEFAULT_B,
+    DEFAULT_C,
+    EPS,
+    Muon,
+    _batched_zeropower_via_newtonschulz,
+    _zeropower_via_newtonschulz,
+)
+
+COEFFICIENTS = (DEFAULT_A, DEFAULT_B, DEFAULT_C)
+# Repeated shapes (batched together), tall and wide ones (transposed), and a square one
+SHAPES = [(24, 48), (48, 24), (24, 48), (36, 36), (48, 24), (12, 60), (36, 36)]
+
+
+def _allocating_newtonschulz(grad, ns_steps, ns_dtype):
+    """The textbook iteration, with new tensors for every product."""
+    a, b, c = COEFFICIENTS
+    ortho = grad.to(ns_dtype)
+    if grad.size(0) > grad.size(1):
+        ortho = ortho.T.contiguous()
+    ortho = ortho / ortho.norm().clamp(min=EPS)
+    for _ in range(ns_steps):
+        gram = ortho @ ortho.T
+        gram_update = torch.addmm(gram, gram, gram, beta=b, alpha=c)
+        ortho = torch.addmm(ortho, gram_update, ortho, beta=a)
+    return ortho.T if grad.size(0) > grad.size(1) else ortho
+
+
+@pytest.mark.parametrize("shape", [(32, 64), (64, 32), (48, 48)])
+def test_newtonschulz_matches_the_allocating_iteration(shape):
+    grad = torch.randn(shape, generator=torch.Generator().manual_seed(0))
+    expected = _allocating_newtonschulz(grad, 5, torch.float32)
+    assert torch.equal(_zeropower_via_newtonschulz(grad, COEFFICIENTS, 5, EPS, torch.float32), expected)
+    # Cached workspaces give the same result, also when reused
+    workspaces = {}
+    for _ in range(2):
+        result = _zeropower_via_newtonschulz(grad, COEFFICIENTS, 5, EPS, torch.float32, workspaces)
+        assert torch.equal(result, expected)
+    assert len(workspaces) == 1
+
+
+@pytest.mark.parametrize("ns_dtype", [torch.float32, torch.bfloat16])
+def test_newtonschulz_orthogonalizes(ns_dtype):
+    grad = torch.randn(64, 128, generator=torch.Generator().manual_seed(0))
+    singular_values = torch.linalg.svdvals(_zeropower_via_newtonschulz(grad, COEFFICIENTS, 5, EPS, ns_dtype).float())
+    # The quintic iteration maps every singular value to roughly [0.5, 1.5], not exactly to 1
+    assert singular_values.min() > 0.4
+    assert singular_values.max() < 1.6
+
+
+def test_newtonschulz_of_a_transpose_is_the_transpose():
+    grad = torch.randn(32, 80, generator=torch.Generator().manual_seed(0))
+    wide = _zeropower_via_newtonschulz(grad, COEFFICIENTS, 5, EPS, torch.float32)
+    tall = _zeropower_via_newtonschulz(grad.T, COEFFICIENTS, 5, EPS, torch.float32)
+    assert torch.equal(tall, wide.T)
+
+
+def test_batched_newtonschulz_matches_one_matrix_at_a_time():
+    grads = torch.randn(5, 24, 40, generator=torch.Generator().manual_seed(0))
+    expected = [_zeropower_via_newtonschulz(grad, COEFFICIENTS, 5, EPS, torch.float32) for grad in grads]
+    for inputs in (grads, list(grads.unbind(0))):
+        batched = _batched_zeropower_via_newtonschulz(inputs, COEFFICIENTS, 5, EPS, torch.float32)
+        assert all(torch.equal(a, b) for a, b in zip(batched.unbind(0), expected))
+    with pytest.raises(ValueError, match="rows <= columns"):
+        _batched_zeropower_via_newtonschulz(grads.transpose(1, 2), COEFFICIENTS, 5, EPS, torch.float32)
+
+
+def _train(params, steps=3, **kwargs):
+    optimizer = Muon(params, lr=0.02, ns_dtype="float32", **kwargs)
+    generator = torch.Generator().manual_seed(1)
+    for _ in range(steps):
+        for param in params:
+            param.grad = torch.randn(param.shape, generator=generator)
+        optimizer.step()
+    return optimizer
+
+
+def _params(shapes=SHAPES):
+    generator = torch.Generator().manual_seed(0)
+    return [torch.nn.Parameter(torch.randn(shape, generator=generator)) for shape in shapes]
+
+
+@pytest.mark.parametrize("nesterov", [True, False])
+def test_foreach_matches_single_tensor(nesterov):
+    single, batched = _params(), _params()
+    _train(single, foreach=False, nesterov=nesterov)
+    _train(batched, foreach=True, nesterov=nesterov)
+    assert all(torch.equal(a, b) for a, b in zip(single, batched))
+
+
+@pytest.mark.parametrize("foreach", [False, True])
+def test_workspaces_are_only_kept_when_cached(foreach):
+    assert not _train(_params(), foreach=foreach, cache_workspaces=False)._ns_workspaces
+    cached = _params()
+    # Cached by default
+    optimizer = _train(cached, foreach=foreach)
+    assert optimizer._ns_workspaces
+    reference = _params()
+    _train(reference, foreach=foreach, cache_workspaces=False)
+    assert all(torch.equal(a, b) for a, b in zip(cached, reference))
+
+
+def _distributed_plain(rank, world_size, foreach):
+    params = _params()
+    _train(params, foreach=foreach, distributed=True)
+    return [param.detach() for param in params]
+
+
+@pytest.mark.parametrize("world_size", [2, 3])
+@pytest.mark.parametrize("foreach", [False, True])
+def test_distributed_plain_parameters_are_bit_identical(world_size, foreach):
+    reference = _params()
+    _train(reference, foreach=foreach)
+    for params in run_distributed(_distributed_plain, world_size, foreach).values():
+        assert all(torch.equal(a, b) for a, b in zip(reference, params))
+
+
+# Sharded by rows or columns (divisible by 2 and 3), replicated, and one uneven sharding that
+# takes the fallback path
+DTENSOR_LAYOUTS = [((24, 48), 0), ((48, 24), 1), ((24, 48), 0), ((36, 36), None), ((48, 24), 0), ((12, 60), 1),
+                   ((36, 36), 0), ((25, 40), 0)]
+
+
+def _distributed_dtensors(rank, world_size, foreach):
+    from torch.distributed.device_mesh import init_device_mesh
+    from torch.distributed.tensor import Replicate, Shard, distribute_tensor
+    mesh = init_device_mesh("cpu", (world_size,))
+    placements = [[Replicate()] if dim is None else [Shard(dim)] for _, dim in DTENSOR_LAYOUTS]
+    params = [
+        torch.nn.Parameter(distribute_tensor(param.detach(), mesh, placement))
+        for param, placement in zip(_params([shape for shape, _ in DTENSOR_LAYOUTS]), placements)
+    ]
+    optimizer = Muon(params, lr=0.02, ns_dtype="float32", foreach=foreach, distributed=True)
+    generator = torch.Generator().manual_seed(1)
+    for _ in range(3):
+        for param, placement in zip(params, placements):
+            param.grad = distribute_tensor(torch.randn(param.shape, generator=generator), mesh, placement)
+        optimizer.step()
+    return [param.full_tensor().detach() for param in params]
+
+
+@pytest.mark.parametrize("world_size", [2, 3])
+@pytest.mark.parametrize("foreach", [False, True])
+def test_distributed_dtensors_are_bit_identical(world_size, foreach):
+    reference = _params([shape for shape, _ in DTENSOR_LAYOUTS])
+    _train(reference, foreach=foreach)
+    for params in run_distributed(_distributed_dtensors, world_size, foreach).values():
+        assert all(torch.equal(a, b) for a, b in zip(reference, params))
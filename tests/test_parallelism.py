@@ -0,0 +1,178 @@
+import pytest
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from tests.distributed import run_distributed
+from training.optimizers.adamw8bit import AdamW8bit
+from training.optimizers.low_precision import optimizer_state_bytes
+from training.optimizers.muon_adamw import MuonAdamW
+from training.parallelism.data_parallel import DataParallel
+from training.parallelism.zero import ZeroOptimizer, partition_parameters
+
+BATCH_SIZE = 12
+STEPS = 3
+
+
+class Net(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.embed = nn.Embedding(16, 24)
+        self.hidden = nn.Linear(24, 48)
+        self.out = nn.Linear(48, 16)
+        # Never used in the forward pass
+        self.unused = nn.Linear(4, 4)
+
+    def forward(self, tokens):
+        return self.out(F.gelu(self.hidden(self.embed(tokens))))
+
+
+def _model():
+    torch.manual_seed(0)
+    return Net()
+
+
+def _batch(step):
+    generator = torch.Generator().manual_seed(step)
+    return torch.randint(0, 16, (BATCH_SIZE, 5), generator=generator), torch.randint(0, 16, (BATCH_SIZE, 5), generator=generator)
+
+
+def _loss(model, tokens, targets):
+    return F.cross_entropy(model(tokens).flatten(0, 1), targets.flatten())
+
+
+OPTIMIZERS = {
+    "adamw": lambda model: torch.optim.AdamW(model.parameters(), lr=1e-2),
+    "adamw8bit": lambda model: AdamW8bit(model.parameters(), lr=1e-2, min_8bit_size=512),
+    # float32 Newton-Schulz, as bfloat16 rounds the differences of the reduction order up to visible ones
+    "muon_adamw": lambda model: MuonAdamW(model, lr=0.02, adamw_lr=1e-2, ns_dtype="float32"),
+}
+
+
+def _backward(model, batch):
+    _loss(model, *batch).backward()
+    # `DataParallel` gives unused parameters zero gradients, which weight decay still applies to
+    for p in model.parameters():
+        if p.grad is None:
+            p.grad = torch.zeros_like(p)
+
+
+def _reference(optimizer_name):
+    """Parameters and gradients of a single process training on the whole batches."""
+    model = _model()
+    optimizer = OPTIMIZERS[optimizer_name](model)
+    grads = []
+    for step in range(STEPS):
+        _backward(model, _batch(step))
+        grads.append({name: p.grad.clone() for name, p in model.named_parameters()})
+        optimizer.step()
+        optimizer.zero_grad()
+    return {"params": dict(model.named_parameters()), "grads": grads}
+
+
+def _data_parallel(rank, world_size, optimizer_name, zero, accumulate):
+    model = _model()
+    # Small buckets, several per step
+    wrapped = DataParallel(model, bucket_cap_mb=0.005)
+    optimizer = OPTIMIZERS[optimizer_name](model)
+    if zero:
+        optimizer = ZeroOptimizer(optimizer)
+    grads = []
+    for step in range(STEPS):
+        tokens, targets = (x.chunk(world_size)[rank] for x in _batch(step))
+        if accumulate:
+            # Two micro-batches, synchronized on the second backward only
+            with wrapped.no_sync():
+                (_loss(wrapped, tokens[::2], targets[::2]) / 2).backward()
+            (_loss(wrapped, tokens[1::2], targets[1::2]) / 2).backward()
+        else:
+            _loss(wrapped, tokens, targets).backward()
+        grads.append({name: p.grad.clone() for name, p in model.named_parameters()})
+        optimizer.step()
+        optimizer.zero_grad()
+    return {
+        "params": {name: p.detach() for name, p in model.named_parameters()},
+        "grads": grads,
+        "num_buckets": len(wrapped.buckets),
+        "state_params": sum(p.numel() for group in optimizer.param_groups for p in group["params"]),
+        "state_bytes": optimizer_state_bytes(optimizer)["state"],
+    }
+
+
+def _check(results, reference):
+    for result in results.values():
+        assert result["num_buckets"] > 2
+        for grads, reference_grads in zip(result["grads"], reference["grads"]):
+            for name, grad in grads.items():
+                torch.testing.assert_close(grad, reference_grads[name], msg=name)
+        for name, param in result["params"].items():
+            torch.testing.assert_close(param, reference["params"][name].detach(), msg=name)
+    # The replicas stay identical
+    for result in list(results.values())[1:]:
+        for name, param in result["params"].items():
+            assert torch.equal(param, results[0]["params"][name]), name
+
+
+@pytest.mark.parametrize("world_size", [2, 3])
+def test_data_parallel_matches_a_single_process(world_size):
+    # 12 samples of 5 tokens: the mean over the ranks' equal chunks is the mean over the batch
+    results = run_distributed(_data_parallel, world_size, "adamw", False, False)
+    _check(results, _reference("adamw"))
+
+
+def test_no_sync_accumulates_gradients():
+    _check(run_distributed(_data_parallel, 2, "adamw", False, True), _reference("adamw"))
+
+
+@pytest.mark.parametrize("optimizer_name", list(OPTIMIZERS))
+@pytest.mark.parametrize("world_size", [2, 3])
+def test_zero_matches_a_single_process(optimizer_name, world_size):
+    results = run_distributed(_data_parallel, world_size, optimizer_name, True, False)
+    _check(results, _reference(optimizer_name))
+
+    # Every parameter is stepped by exactly one rank, which alone holds its state
+    num_params = sum(p.numel() for p in _model().parameters())
+    assert sum(result["state_params"] for result in results.values()) == num_params
+    model = _model()
+    optimizer = OPTIMIZERS[optimizer_name](model)
+    _backward(model, _batch(0))
+    optimizer.step()
+    full_state = optimizer_state_bytes(optimizer)["state"]
+    # The step counters of the optimizers (one per parameter) do not shrink with the shards
+    assert sum(result["state_bytes"] for result in results.values()) <= full_state + 8 * len(optimizer.state)
+    assert max(result["state_bytes"] for result in results.values()) < full_state / world_size * 1.5
+
+
+def test_partition_is_balanced_and_deterministic():
+    params = [nn.Parameter(torch.empty(n)) for n in (100, 10, 60, 50, 5, 40)]
+    owners = partition_parameters(params, 2)
+    assert owners == partition_parameters(params, 2)
+    loads = [sum(p.numel() for p, owner in zip(params, owners) if owner == rank) for rank in range(2)]
+    # Largest first, to the least loaded rank: 100 + 40 and 60 + 50 + 10 + 5
+    assert loads == [140, 125]
+
+
+def _zero_errors(rank, world_size):
+    model = _model()
+    optimizer = torch.optim.AdamW(model.parameters())
+    _loss(model, *_batch(0)).backward()
+    optimizer.step()
+    errors = []
+    try:
+        ZeroOptimizer(optimizer)
+    except ValueError as error:
+        errors.append(str(error))
+    sharded = ZeroOptimizer(torch.optim.AdamW(model.parameters()))
+    state = sharded.state_dict()
+    state["rank"] = 1 - rank
+    try:
+        sharded.load_state_dict(state)
+    except ValueError as error:
+        errors.append(str(error))
+    return errors
+
+
+def test_zero_rejects_a_stepped_optimizer_and_another_shard():
+    for errors in run_distributed(_zero_errors, 2).values():
+        assert "before its first step" in errors[0]
+        assert "Cannot load the optimizer shard" in errors[1]
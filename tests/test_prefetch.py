@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import namedtuple
+
+import pytest
+import torch
+from torch.utils.data import DataLoader, Dataset, IterableDataset
+
+from data.loaders.prefetch import PrefetchLoader
+
+Batch = namedtuple("Batch", ["input_ids", "labels"])
+
+
+class Numbers(Dataset):
+    def __init__(self, size, fail_at=None, delay=0.0):
+        self.size = size
+        self.fail_at = fail_at
+        self.delay = delay
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index == self.fail_at:
+            raise KeyError(f"sample {index}")
+        time.sleep(self.delay)
+        return {"input": {"input_ids": torch.full((3,), index)}, "target": torch.tensor(index)}
+
+
+class Endless(IterableDataset):
+    def __iter__(self):
+        index = 0
+        while True:
+            yield torch.tensor(index)
+            index += 1
+
+
+def _prefetch_threads():
+    return [thread for thread in threading.enumerate() if thread.name.endswith("(_worker)")]
+
+
+def test_order_and_content_are_preserved():
+    loader = PrefetchLoader(DataLoader(Numbers(10), batch_size=3), device="cpu", num_prefetch=2)
+    assert len(loader) == 4
+    for _ in range(2):
+        batches = list(loader)
+        assert [batch["target"].tolist() for batch in batches] == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+        for batch in batches:
+            assert torch.equal(batch["input"]["input_ids"], batch["target"][:, None].expand(-1, 3))
+
+
+def test_namedtuple_dict_and_list_batches():
+    batches = [
+        Batch(torch.arange(4), torch.ones(4)),
+        {"input": [torch.zeros(2), (torch.ones(1), "text")], "target": 7},
+    ]
+    first, second = list(PrefetchLoader(batches, device="cpu"))
+    assert type(first) is Batch
+    assert torch.equal(first.input_ids, torch.arange(4)) and torch.equal(first.labels, torch.ones(4))
+    assert isinstance(second["input"], list) and isinstance(second["input"][1], tuple)
+    assert torch.equal(second["input"][0], torch.zeros(2))
+    assert second["input"][1][1] == "text" and second["target"] == 7
+
+
+def test_worker_exceptions_are_raised_in_the_training_loop():
+    loader = PrefetchLoader(DataLoader(Numbers(10, fail_at=7), batch_size=2), device="cpu")
+    seen = []
+    with pytest.raises(KeyError, match="sample 7"):
+        for batch in loader:
+            seen.append(batch["target"].tolist())
+    # Every batch before the failing one is delivered
+    assert seen == [[0, 1], [2, 3], [4, 5]]
+    assert not _prefetch_threads()
+
+
+def test_early_break_stops_the_worker():
+    loader = PrefetchLoader(DataLoader(Endless(), batch_size=2), device="cpu", num_prefetch=2)
+    iterator = iter(loader)
+    assert next(iterator).tolist() == [0, 1]
+    # Give the worker time to fill the queue and block on it
+    time.sleep(0.1)
+    assert len(_prefetch_threads()) == 1
+    iterator.close()
+    assert not _prefetch_threads()
+
+    for step, batch in enumerate(loader):
+        if step == 2:
+            break
+    del batch
+    assert not _prefetch_threads()
+    # A new epoch starts from the beginning
+    assert next(iter(loader)).tolist() == [0, 1]
+
+
+def test_wait_time_stats():
+    loader = PrefetchLoader(DataLoader(Numbers(6, delay=0.02), batch_size=1), device="cpu", wait_window=2)
+    assert loader.stats() == {"steps": 0, "total_wait": 0.0, "mean_wait": 0.0, "max_wait": 0.0, "recent_mean_wait": 0.0}
+    for _ in loader:
+        pass
+    stats = loader.stats()
+    assert stats["steps"] == 6
+    assert len(loader.wait_times) == 2
+    # The training loop does no work, so it waits for every slow sample
+    assert stats["total_wait"] >= 6 * 0.01
+    assert stats["max_wait"] >= max(loader.wait_times)
+    assert stats["mean_wait"] == pytest.approx(stats["total_wait"] / 6)
+    assert stats["recent_mean_wait"] == pytest.approx(sum(loader.wait_times) / 2)
+    with pytest.raises(ValueError, match="num_prefetch"):
+        PrefetchLoader([], device="cpu", num_prefetch=0)
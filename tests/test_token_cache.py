@@ -0,0 +1,153 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+
+from data.datasets.token_cache import TokenCache, tokenizer_fingerprint
+
+
+class Tokenizer:
+    """Encodes a document "i" into i + 1 tokens: i * 100 + position, and records every call."""
+    vocab_size = 50000
+    eot_token_id = 99
+
+    def __init__(self, fingerprint="test:0"):
+        self.fingerprint = fingerprint
+        self.calls = []
+
+    def encode_batch(self, texts, append_eot=False):
+        self.calls.append(list(texts))
+        tokens = [_document(text, append_eot) for text in texts]
+        offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in tokens], out=offsets[1:])
+        return np.concatenate(tokens) if tokens else np.empty(0, dtype=np.int64), offsets
+
+
+def _document(text, append_eot=False):
+    tokens = int(text) * 100 + np.arange(int(text) + 1)
+    return np.append(tokens, Tokenizer.eot_token_id) if append_eot else tokens
+
+
+def _split(tokens, offsets):
+    return [tokens[start:stop].tolist() for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+def _entries(cache_dir):
+    return sorted(name for _, _, names in os.walk(cache_dir) for name in names if name.endswith(".tok"))
+
+
+def test_documents_hit_in_any_batch(tmp_path):
+    tokenizer = Tokenizer()
+    cache = TokenCache(str(tmp_path), tokenizer)
+    tokens, offsets = cache.get_or_tokenize(["1", "2", "3"], tokenizer.encode_batch)
+    assert _split(tokens, offsets) == [_document(t).tolist() for t in "123"]
+    assert (cache.hits, cache.misses) == (0, 3)
+
+    # Only the new documents are encoded, in a single call, and the batch keeps its order
+    tokens, offsets = cache.get_or_tokenize(["3", "4", "1", "5"], tokenizer.encode_batch)
+    assert _split(tokens, offsets) == [_document(t).tolist() for t in "3415"]
+    assert tokenizer.calls[-1] == ["4", "5"]
+    assert (cache.hits, cache.misses) == (2, 5)
+
+    cache.get_or_tokenize(["5", "4"], tokenizer.encode_batch)
+    assert len(tokenizer.calls) == 2
+    stats = cache.stats()
+    assert stats["hits"] == 4 and stats["misses"] == 5 and stats["hit_rate"] == pytest.approx(4 / 9)
+    assert len(_entries(tmp_path)) == 5
+    assert stats["cache_bytes"] == stats["bytes_written"]
+
+    tokens, offsets = cache.get_or_tokenize([], tokenizer.encode_batch)
+    assert len(tokens) == 0 and offsets.tolist() == [0]
+
+
+def test_encode_options_and_tokenizer_are_part_of_the_key(tmp_path):
+    tokenizer = Tokenizer()
+    cache = TokenCache(str(tmp_path), tokenizer)
+    cache.get_or_tokenize(["1", "2"], tokenizer.encode_batch)
+    tokens, offsets = cache.get_or_tokenize(["1", "2"], tokenizer.encode_batch, append_eot=True)
+    assert _split(tokens, offsets) == [_document(t, append_eot=True).tolist() for t in "12"]
+    assert cache.misses == 4
+    cache.get_or_tokenize(["2"], tokenizer.encode_batch, append_eot=True)
+    assert cache.hits == 1
+
+    other = Tokenizer(fingerprint="test:1")
+    other_cache = TokenCache(str(tmp_path), other)
+    other_cache.get_or_tokenize(["1"], other.encode_batch)
+    assert (other_cache.hits, other_cache.misses) == (0, 1)
+    with pytest.raises(ValueError, match="fingerprint"):
+        tokenizer_fingerprint(object())
+
+
+def test_ids_past_uint16_are_not_wrapped(tmp_path):
+    tokenizer = Tokenizer()
+    cache = TokenCache(str(tmp_path), tokenizer)
+    # Documents "700" and up have ids of 70000 and more, even if `vocab_size` says otherwise
+    texts = ["3", "700", "701"]
+    for _ in range(2):
+        tokens, offsets = cache.get_or_tokenize(texts, tokenizer.encode_batch)
+        assert _split(tokens, offsets) == [_document(text).tolist() for text in texts]
+    assert cache.hits == 3
+    assert os.path.getsize(cache._path(cache.key("3"))) == 16 + 2 * 4
+    assert os.path.getsize(cache._path(cache.key("700"))) == 16 + 4 * 701
+
+
+def test_corrupted_entries_are_re_encoded(tmp_path):
+    tokenizer = Tokenizer()
+    cache = TokenCache(str(tmp_path), tokenizer)
+    cache.get_or_tokenize(["7"], tokenizer.encode_batch)
+    path = cache._path(cache.key("7"))
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 2)
+    tokens, offsets = cache.get_or_tokenize(["7"], tokenizer.encode_batch)
+    assert _split(tokens, offsets) == [_document("7").tolist()]
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    tokenizer = Tokenizer()
+    # An entry is a 16-byte header and 2 bytes per token: documents "10" to "13" take 38 to 44 bytes
+    cache = TokenCache(str(tmp_path), tokenizer, max_bytes=130)
+    for i, text in enumerate(["10", "11", "12"]):
+        cache.get_or_tokenize([text], tokenizer.encode_batch)
+        os.utime(cache._path(cache.key(text)), (i, i))
+    # Reading "10" makes it the most recently used
+    cache.get_or_tokenize(["10"], tokenizer.encode_batch)
+    cache.get_or_tokenize(["13"], tokenizer.encode_batch)
+
+    assert cache.stats()["cache_bytes"] <= 0.9 * cache.max_bytes
+    cached = {text for text in ["10", "11", "12", "13"] if os.path.exists(cache._path(cache.key(text)))}
+    assert cached == {"10", "13"}
+    cache.get_or_tokenize(["11"], tokenizer.encode_batch)
+    assert tokenizer.calls[-1] == ["11"]
+
+
+def _tokenize_concurrently(cache_dir, worker):
+    tokenizer = Tokenizer()
+    cache = TokenCache(cache_dir, tokenizer, max_bytes=4000)
+    rng = np.random.default_rng(worker)
+    outputs = []
+    for _ in range(40):
+        texts = [str(i) for i in rng.integers(0, 60, size=5)]
+        tokens, offsets = cache.get_or_tokenize(texts, tokenizer.encode_batch)
+        outputs.append((texts, _split(tokens, offsets)))
+    return outputs, cache.hits, cache.misses
+
+
+def test_concurrent_writers(tmp_path):
+    context = multiprocessing.get_context("fork")
+    with context.Pool(4) as pool:
+        results = pool.starmap(_tokenize_concurrently, [(str(tmp_path), worker) for worker in range(4)])
+
+    for outputs, hits, misses in results:
+        assert hits + misses == 40 * 5
+        for texts, documents in outputs:
+            assert documents == [_document(text).tolist() for text in texts]
+    # Writes are atomic: no temporary file is left and every entry reads back whole
+    assert not [name for _, _, names in os.walk(tmp_path) for name in names if name.endswith(".tmp")]
+    tokenizer = Tokenizer()
+    cache = TokenCache(str(tmp_path), tokenizer)
+    texts = [str(i) for i in range(60)]
+    tokens, offsets = cache.get_or_tokenize(texts, tokenizer.encode_batch)
+    assert _split(tokens, offsets) == [_document(text).tolist() for text in texts]
+    assert cache.hits > 0 and len(_entries(tmp_path)) == 60
@@ -0,0 +1,166 @@
+import torch
+import torch.nn as nn
+from typing import Any, Dict, Optional, Tuple
+
+
+class ChunkedLinearCrossEntropyFunction(torch.autograd.Function):
+    """
+    Fused `lm_head` projection + cross-entropy, computed over chunks of rows.
+
+    The forward pass computes, for one chunk of `chunk_size` rows at a time, the logits, the loss
+    and the gradient of the loss with respect to the logits, and immediately reduces the latter
+    into the gradients of the hidden states and of the weight. The `[N, V]` logits are therefore
+    never materialized: peak memory is O(chunk_size x V) on top of the gradients themselves.
+    The backward pass only scales the saved gradients by the incoming gradient.
+    """
+    @staticmethod
+    def forward(
+        ctx,
+        hidden: torch.Tensor,
+        weight: torch.Tensor,
+        bias: Optional[torch.Tensor],
+        targets: torch.Tensor,
+        ignore_index: int,
+        z_loss_weight: float,
+        chunk_size: int,
+        grad_enabled: bool = True,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Args:
+            hidden: Final hidden states, [N, D].
+            weight: `lm_head` weight, [V, D].
+            bias: Optional `lm_head` bias, [V].
+            targets: Target token ids, [N].
+            ignore_index: Targets with this value do not contribute to the loss.
+            z_loss_weight: Weight of the z-loss, `logsumexp(logits) ** 2`. 0 disables it.
+            chunk_size: Number of rows per chunk.
+            grad_enabled: Whether grad mode is enabled for the caller (it is always disabled
+                          inside `forward`). Without it, e.g. under `torch.no_grad()` for
+                          evaluation, the gradients are not computed.
+
+        Returns:
+            The total loss (mean cross-entropy + weighted mean z-loss), and the mean
+            cross-entropy and mean z-loss alone (for logging, not differentiable).
+        """
+        compute_grad = grad_enabled and any(ctx.needs_input_grad[:3])
+        num_valid = (targets != ignore_index).sum()
+        # Mean over the non-ignored targets; nan if there are none, like `F.cross_entropy`
+        scale = 1.0 / num_valid.float()
+
+        ce_sum = torch.zeros((), dtype=torch.float32, device=hidden.device)
+        z_sum = torch.zeros((), dtype=torch.float32, device=hidden.device)
+        grad_hidden = torch.empty_like(hidden) if compute_grad else None
+        grad_weight = torch.zeros_like(weight, dtype=torch.float32) if compute_grad else None
+        grad_bias = torch.zeros_like(bias, dtype=torch.float32) if compute_grad and bias is not None else None
+
+        # The matmuls run in the dtype of the hidden states (e.g. bf16 under autocast)
+        compute_weight = weight.to(hidden.dtype)
+        compute_bias = bias.to(hidden.dtype) if bias is not None else None
+        for start in range(0, hidden.size(0), chunk_size):
+            stop = min(start + chunk_size, hidden.size(0))
+            hidden_chunk = hidden[start:stop]
+            logits = hidden_chunk @ compute_weight.T
+            if compute_bias is not None:
+                logits = logits + compute_bias
+            logits = logits.float()
+
+            chunk_targets = targets[start:stop]
+            valid = chunk_targets != ignore_index
+            safe_targets = torch.where(valid, chunk_targets, 0)
+            lse = torch.logsumexp(logits, dim=-1)
+            target_logits = logits.gather(1, safe_targets[:, None]).squeeze(1)
+            ce_sum += torch.where(valid, lse - target_logits, 0.0).sum()
+            if z_loss_weight:
+                z_sum += torch.where(valid, lse.square(), 0.0).sum()
+
+            if not compute_grad:
+                continue
+            # d(lse - logit_t)/d(logits) = softmax - onehot, d(z * lse^2)/d(logits) = 2 z lse softmax
+            grad_logits = logits.sub_(lse[:, None]).exp_()
+            if z_loss_weight:
+                grad_logits.mul_((1 + 2 * z_loss_weight * lse)[:, None])
+            grad_logits.scatter_add_(1, safe_targets[:, None], torch.full_like(lse, -1.0)[:, None])
+            # Ignored targets get a zero gradient, even when all of them are ignored (scale is inf)
+            grad_logits.mul_(torch.where(valid, scale, 0.0)[:, None])
+            if grad_bias is not None:
+                grad_bias += grad_logits.sum(0)
+            grad_weight.addmm_(grad_logits.T, hidden_chunk.float())
+            grad_hidden[start:stop] = grad_logits.to(hidden.dtype) @ compute_weight
+
+        ce = ce_sum * scale
+        z_loss = z_sum * scale
+        loss = ce + z_loss_weight * z_loss
+        ctx.mark_non_differentiable(ce, z_loss)
+        if compute_grad:
+            ctx.save_for_backward(
+                grad_hidden,
+                grad_weight.to(weight.dtype),
+                grad_bias.to(bias.dtype) if grad_bias is not None else None,
+            )
+        return loss, ce, z_loss
+
+    @staticmethod
+    def backward(ctx, grad_loss: torch.Tensor, grad_ce: torch.Tensor, grad_z_loss: torch.Tensor):
+        grad_hidden, grad_weight, grad_bias = ctx.saved_tensors
+        grad_hidden = grad_hidden * grad_loss.to(grad_hidden.dtype) if ctx.needs_input_grad[0] else None
+        grad_weight = grad_weight * grad_loss.to(grad_weight.dtype) if ctx.needs_input_grad[1] else None
+        if grad_bias is not None and ctx.needs_input_grad[2]:
+            grad_bias = grad_bias * grad_loss.to(grad_bias.dtype)
+        return grad_hidden, grad_weight, grad_bias, None, None, None, None, None
+
+
+class ChunkedCrossEntropy(nn.Module):
+    """
+    Cross-entropy over the vocabulary computed from the final hidden states and the `lm_head`
+    weight, without materializing the `[B, T, V]` logits (see `ChunkedLinearCrossEntropyFunction`).
+
+    The model must return a dictionary holding the hidden states before the `lm_head` and the
+    `lm_head` weight (and optionally its bias) instead of the logits.
+    """
+    def __init__(
+        self,
+        target_key: str = "labels",
+        ignore_index: int = -100,
+        chunk_size: int = 1024,
+        z_loss_weight: float = 0.0,
+        hidden_states_key: str = "hidden_states",
+        weight_key: str = "lm_head_weight",
+        bias_key: str = "lm_head_bias",
+    ):
+        """
+        Args:
+            target_key: Key of the targets in the batch.
+            ignore_index: Targets with this value do not contribute to the loss.
+            chunk_size: Number of tokens whose logits are computed at once.
+            z_loss_weight: Weight of the z-loss (`logsumexp(logits) ** 2`). 0 disables it.
+            hidden_states_key: Key of the final hidden states, [..., D], in the prediction.
+            weight_key: Key of the `lm_head` weight, [V, D], in the prediction.
+            bias_key: Key of the optional `lm_head` bias, [V], in the prediction.
+        """
+        super().__init__()
+        self.target_key = target_key
+        self.ignore_index = ignore_index
+        self.chunk_size = chunk_size
+        self.z_loss_weight = z_loss_weight
+        self.hidden_states_key = hidden_states_key
+        self.weight_key = weight_key
+        self.bias_key = bias_key
+
+    def forward(self, data: Dict[str, Any], prediction: Dict[str, torch.Tensor], mode: str) -> Dict[str, Any]:
+        targets = data[self.target_key]
+        hidden = prediction[self.hidden_states_key]
+        hidden = hidden.reshape(-1, hidden.size(-1))
+        loss, ce, z_loss = ChunkedLinearCrossEntropyFunction.apply(
+            hidden,
+            prediction[self.weight_key],
+            prediction.get(self.bias_key),
+            targets.reshape(-1),
+            self.ignore_index,
+            self.z_loss_weight,
+            self.chunk_size,
+            torch.is_grad_enabled(),
+        )
+        logs = {"loss": loss.detach(), "cross_entropy": ce}
+        if self.z_loss_weight:
+            logs["z_loss"] = z_loss
+        return {"loss": loss, "logs": logs}
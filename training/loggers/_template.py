@@ -0,0 +1,32 @@
+from typing import Any, Dict, Protocol, runtime_checkable
+
+@runtime_checkable
+class LoggerTemplate(Protocol):
+    """
+    Protocol describing a metric logger.
+
+    `log` is called on every training step with the "logs" returned by the criterion, so it
+    must be cheap: implementations should not move tensors to the host (e.g. with `.item()`),
+    which would force a device synchronization.
+    """
+    def log(self, logs: Dict[str, Any], step: int) -> None:
+        """
+        Records the metrics of one step.
+
+        Args:
+            logs: Metric name to value (scalar tensor or Python number).
+            step: The global training step.
+        """
+        ...
+
+    def flush(self) -> None:
+        """
+        Writes the metrics recorded so far.
+        """
+        ...
+
+    def close(self) -> None:
+        """
+        Flushes and releases the logger's resources.
+        """
+        ...
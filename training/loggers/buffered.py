@@ -0,0 +1,215 @@
+import csv
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional, Sequence
+
+import torch
+import torch.distributed as dist
+
+_END = object()
+FORMATS = ("jsonl", "csv", "tensorboard")
+
+
+class BufferedLogger:
+    """
+    Metric logger that never synchronizes the training step with the device.
+
+    `log` adds every tensor metric to a running sum that stays on its device, so a step only
+    enqueues a few tiny kernels. Every `log_every` calls, the sums of all metrics are stacked
+    into one tensor, all-reduced across ranks in a single collective, and copied to pinned host
+    memory with `non_blocking=True`. A background thread waits for that copy, computes the
+    window averages and writes them (JSONL, CSV and/or TensorBoard event files) on rank 0.
+
+    All ranks must log the same tensor metrics the same number of times, as the collective is
+    matched by position. Python numbers (e.g. the learning rate) are averaged locally.
+    """
+    def __init__(
+        self,
+        output_dir: str,
+        log_every: int = 100,
+        formats: Sequence[str] = ("jsonl",),
+        reduction: str = "mean",
+        distributed: bool = True,
+        process_group: Optional[dist.ProcessGroup] = None,
+        max_pending: int = 16,
+    ):
+        """
+        Args:
+            output_dir: Directory the metric files are written to (`metrics.jsonl`,
+                        `metrics.csv`, TensorBoard event files).
+            log_every: Number of `log` calls averaged into one record.
+            formats: Any of "jsonl", "csv" and "tensorboard".
+            reduction: "mean" to average metrics over the window (and the ranks), or "sum".
+            distributed: Whether to all-reduce metrics across ranks when a process group is initialized.
+            process_group: Process group used for the reduction. Defaults to the world.
+            max_pending: Maximum number of records waiting for the writer thread. `log`
+                         blocks when the writer falls this far behind.
+        """
+        unknown = set(formats) - set(FORMATS)
+        if unknown:
+            raise ValueError(f"Unknown formats {sorted(unknown)}, expected a subset of {FORMATS}")
+        if reduction not in ("mean", "sum"):
+            raise ValueError(f"reduction must be 'mean' or 'sum', got {reduction}")
+        if log_every < 1:
+            raise ValueError(f"log_every must be >= 1, got {log_every}")
+        self.output_dir = output_dir
+        self.log_every = log_every
+        self.formats = tuple(formats)
+        self.reduction = reduction
+        self.distributed = distributed
+        self.process_group = process_group
+
+        self._sums: Dict[str, torch.Tensor] = {}
+        self._host_sums: Dict[str, float] = {}
+        self._counts: Dict[str, int] = {}
+        self._num_logged = 0
+        self._last_step = 0
+        self._window_start = time.perf_counter()
+
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_pending)
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+
+    def log(self, logs: Dict[str, Any], step: int) -> None:
+        """
+        Adds the metrics of one step to the current window, and emits the window every
+        `log_every` calls. Does not synchronize with the device.
+        """
+        if self._error is not None:
+            raise RuntimeError("The metric writer thread failed") from self._error
+        for key, value in logs.items():
+            if isinstance(value, torch.Tensor):
+                value = value.detach().float().sum()
+                if key in self._sums:
+                    self._sums[key].add_(value)
+                else:
+                    self._sums[key] = value
+            else:
+                self._host_sums[key] = self._host_sums.get(key, 0.0) + float(value)
+            self._counts[key] = self._counts.get(key, 0) + 1
+        self._num_logged += 1
+        self._last_step = step
+        if self._num_logged >= self.log_every:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Emits the current (possibly partial) window. Called by `log` every `log_every` calls.
+        """
+        if self._num_logged == 0:
+            return
+        keys = sorted(self._sums)
+        sums = torch.stack([self._sums[key] for key in keys]) if keys else None
+        world_size = 1
+        if sums is not None and self.distributed and dist.is_available() and dist.is_initialized():
+            # Enqueued on the current stream, the host does not wait for it
+            dist.all_reduce(sums, group=self.process_group)
+            world_size = dist.get_world_size(self.process_group)
+
+        event = None
+        if sums is not None and sums.device.type == "cuda":
+            host_sums = torch.empty(sums.shape, dtype=sums.dtype, pin_memory=True)
+            host_sums.copy_(sums, non_blocking=True)
+            event = torch.cuda.Event()
+            event.record()
+        elif sums is not None:
+            host_sums = sums
+        else:
+            host_sums = None
+
+        elapsed = time.perf_counter() - self._window_start
+        record = {
+            "step": self._last_step,
+            "keys": keys,
+            "sums": host_sums,
+            "event": event,
+            "world_size": world_size,
+            "host_sums": self._host_sums,
+            "counts": self._counts,
+            "num_logged": self._num_logged,
+            "elapsed": elapsed,
+        }
+        self._sums, self._host_sums, self._counts = {}, {}, {}
+        self._num_logged = 0
+        self._window_start = time.perf_counter()
+
+        if not self._is_writer():
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write_loop, daemon=True)
+            self._thread.start()
+        self._queue.put(record)
+
+    def close(self) -> None:
+        """
+        Flushes the last window and waits for the writer thread to finish.
+        """
+        self.flush()
+        if self._thread is not None:
+            self._queue.put(_END)
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            raise RuntimeError("The metric writer thread failed") from self._error
+
+    def _is_writer(self) -> bool:
+        return not (dist.is_available() and dist.is_initialized()) or dist.get_rank() == 0
+
+    def _reduce(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        if record["event"] is not None:
+            record["event"].synchronize()
+        values: Dict[str, Any] = {"step": record["step"]}
+        sums = record["sums"].tolist() if record["sums"] is not None else []
+        for key, total in zip(record["keys"], sums):
+            count = record["counts"][key] * record["world_size"]
+            values[key] = total / count if self.reduction == "mean" else total
+        for key, total in record["host_sums"].items():
+            values[key] = total / record["counts"][key] if self.reduction == "mean" else total
+        values["steps_per_second"] = record["num_logged"] / record["elapsed"] if record["elapsed"] > 0 else 0.0
+        return values
+
+    def _write_loop(self) -> None:
+        jsonl_file, csv_file, csv_writer, tb_writer = None, None, None, None
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            if "jsonl" in self.formats:
+                jsonl_file = open(os.path.join(self.output_dir, "metrics.jsonl"), "a")
+            if "tensorboard" in self.formats:
+                from torch.utils.tensorboard import SummaryWriter
+                tb_writer = SummaryWriter(self.output_dir)
+            while True:
+                record = self._queue.get()
+                if record is _END:
+                    break
+                values = self._reduce(record)
+                if jsonl_file is not None:
+                    jsonl_file.write(json.dumps(values) + "\n")
+                    jsonl_file.flush()
+                if "csv" in self.formats:
+                    if csv_writer is None:
+                        path = os.path.join(self.output_dir, "metrics.csv")
+                        write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+                        csv_file = open(path, "a", newline="")
+                        # Columns are fixed by the first record, later keys are dropped
+                        csv_writer = csv.DictWriter(csv_file, fieldnames=list(values), extrasaction="ignore")
+                        if write_header:
+                            csv_writer.writeheader()
+                    csv_writer.writerow(values)
+                    csv_file.flush()
+                if tb_writer is not None:
+                    for key, value in values.items():
+                        if key != "step":
+                            tb_writer.add_scalar(key, value, global_step=values["step"])
+                    tb_writer.flush()
+        except BaseException as error:
+            self._error = error
+            # Keep draining so that `log` never blocks on a dead writer
+            while self._queue.get() is not _END:
+                pass
+        finally:
+            for f in (jsonl_file, csv_file, tb_writer):
+                if f is not None:
+                    f.close()
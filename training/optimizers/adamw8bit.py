@@ -0,0 +1,187 @@
+"""AdamW with blockwise 8-bit moments."""
+
+import math
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+import torch
+from torch import Tensor
+from torch.optim.optimizer import Optimizer, ParamsT
+
+from training.optimizers.low_precision import (
+    DEFAULT_BLOCK_SIZE,
+    dequantize_blockwise,
+    quantize_blockwise,
+    restore_state_dtypes,
+    stochastic_round_,
+)
+
+
+__all__ = ["AdamW8bit"]
+
+# State entries whose dtype must survive `load_state_dict`
+_STATE_KEYS = ("exp_avg_codes", "exp_avg_absmax", "exp_avg_sq_codes", "exp_avg_sq_absmax", "exp_avg", "exp_avg_sq")
+
+
+class AdamW8bit(Optimizer):
+    """
+    AdamW that stores both moments as 8-bit codes with one float32 scale per block, i.e. about
+    2 bytes of state per parameter instead of 8.
+
+    The first moment is stored signed and the second one as its square root, unsigned (see
+    `quantize_blockwise`). Every step dequantizes the moments, runs the AdamW update in float32
+    and quantizes them again. Parameters with fewer than `min_8bit_size` elements (biases,
+    norms) keep float32 moments; the float32 ones among them are updated together with foreach
+    kernels, batched by device and step. bfloat16 parameters are updated with stochastic
+    rounding. The step count is kept as a Python int, so no step syncs with the device.
+    """
+    # The learning rate may be a tensor, see `Compile.compile_optimizer_step`
+    supports_tensor_lr = True
+
+    def __init__(
+        self,
+        params: ParamsT,
+        lr: float = 1e-3,
+        betas: tuple[float, float] = (0.9, 0.999),
+        eps: float = 1e-8,
+        weight_decay: float = 1e-2,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        min_8bit_size: int = 4096,
+        stochastic_rounding: bool = True,
+    ) -> None:
+        """
+        Args:
+            params: Parameters or parameter groups to optimize.
+            lr: Learning rate.
+            betas: Coefficients of the running averages of the gradient and its square.
+            eps: Term added to the denominator.
+            weight_decay: Decoupled weight decay.
+            block_size: Number of values sharing a quantization scale.
+            min_8bit_size: Parameters with fewer elements keep float32 moments.
+            stochastic_rounding: Whether to round updates of bfloat16 parameters stochastically.
+        """
+        if not 0.0 <= lr:
+            raise ValueError(f"Invalid learning rate: {lr}")
+        if not 0.0 <= eps:
+            raise ValueError(f"Invalid epsilon value: {eps}")
+        if not 0.0 <= betas[0] < 1.0 or not 0.0 <= betas[1] < 1.0:
+            raise ValueError(f"Invalid betas: {betas}")
+        if not 0.0 <= weight_decay:
+            raise ValueError(f"Invalid weight_decay value: {weight_decay}")
+        defaults = {
+            "lr": lr,
+            "betas": tuple(betas),
+            "eps": eps,
+            "weight_decay": weight_decay,
+            "block_size": block_size,
+            "min_8bit_size": min_8bit_size,
+            "stochastic_rounding": stochastic_rounding,
+        }
+        super().__init__(params, defaults)
+
+    def _init_state(self, p: Tensor, group: Dict[str, Any]) -> Dict[str, Tensor]:
+        state = self.state[p]
+        state["step"] = 0
+        if p.numel() >= group["min_8bit_size"]:
+            zeros = torch.zeros(p.shape, dtype=torch.float32, device=p.device)
+            state["exp_avg_codes"], state["exp_avg_absmax"] = quantize_blockwise(zeros, group["block_size"], signed=True)
+            state["exp_avg_sq_codes"], state["exp_avg_sq_absmax"] = quantize_blockwise(
+                zeros, group["block_size"], signed=False
+            )
+        else:
+            state["exp_avg"] = torch.zeros_like(p, dtype=torch.float32, memory_format=torch.preserve_format)
+            state["exp_avg_sq"] = torch.zeros_like(p, dtype=torch.float32, memory_format=torch.preserve_format)
+        return state
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        """Performs a single optimization step."""
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            beta1, beta2 = group["betas"]
+            # float32 parameters with float32 moments, batched by (device, step)
+            batches: Dict[Tuple[torch.device, int], List[Tensor]] = defaultdict(list)
+            for p in group["params"]:
+                if p.grad is None:
+                    continue
+                if p.grad.is_sparse:
+                    raise RuntimeError("AdamW8bit does not support sparse gradients")
+                state = self.state[p] if self.state[p] else self._init_state(p, group)
+                state["step"] += 1
+                step = state["step"]
+
+                quantized = "exp_avg_codes" in state
+                if not quantized and p.dtype == torch.float32 and p.grad.dtype == torch.float32:
+                    batches[(p.device, step)].append(p)
+                    continue
+
+                grad = p.grad.float()
+                if quantized:
+                    exp_avg = dequantize_blockwise(state["exp_avg_codes"], state["exp_avg_absmax"], p.shape)
+                    # The second moment is stored as its square root
+                    exp_avg_sq = dequantize_blockwise(
+                        state["exp_avg_sq_codes"], state["exp_avg_sq_absmax"], p.shape
+                    ).square_()
+                else:
+                    exp_avg, exp_avg_sq = state["exp_avg"], state["exp_avg_sq"]
+
+                exp_avg.lerp_(grad, 1 - beta1)
+                exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+                denom = exp_avg_sq.sqrt()
+                if quantized:
+                    state["exp_avg_codes"], state["exp_avg_absmax"] = quantize_blockwise(
+                        exp_avg, group["block_size"], signed=True
+                    )
+                    state["exp_avg_sq_codes"], state["exp_avg_sq_absmax"] = quantize_blockwise(
+                        denom, group["block_size"], signed=False
+                    )
+
+                bias_correction1 = 1 - beta1 ** step
+                bias_correction2 = 1 - beta2 ** step
+                denom.div_(math.sqrt(bias_correction2)).add_(group["eps"])
+
+                # `float()` returns the parameter itself if it already is float32
+                param = p.float()
+                param.mul_(1 - group["lr"] * group["weight_decay"])
+                param.addcdiv_(exp_avg, denom, value=-group["lr"] / bias_correction1)
+                if param is not p:
+                    if p.dtype == torch.bfloat16 and group["stochastic_rounding"]:
+                        stochastic_round_(p, param)
+                    else:
+                        p.copy_(param)
+
+            for (_, step), params in batches.items():
+                self._foreach_step(params, group, step)
+        return loss
+
+    def _foreach_step(self, params: List[Tensor], group: Dict[str, Any], step: int) -> None:
+        """The same update as `step` for float32 parameters with float32 moments, batched."""
+        beta1, beta2 = group["betas"]
+        grads = [p.grad for p in params]
+        exp_avgs = [self.state[p]["exp_avg"] for p in params]
+        exp_avg_sqs = [self.state[p]["exp_avg_sq"] for p in params]
+
+        torch._foreach_lerp_(exp_avgs, grads, 1 - beta1)
+        torch._foreach_mul_(exp_avg_sqs, beta2)
+        torch._foreach_addcmul_(exp_avg_sqs, grads, grads, value=1 - beta2)
+        denoms = torch._foreach_sqrt(exp_avg_sqs)
+
+        bias_correction1 = 1 - beta1 ** step
+        bias_correction2 = 1 - beta2 ** step
+        torch._foreach_div_(denoms, math.sqrt(bias_correction2))
+        torch._foreach_add_(denoms, group["eps"])
+
+        torch._foreach_mul_(params, 1 - group["lr"] * group["weight_decay"])
+        torch._foreach_addcdiv_(params, exp_avgs, denoms, value=-group["lr"] / bias_correction1)
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        super().load_state_dict(state_dict)
+        restore_state_dtypes(self, state_dict, _STATE_KEYS)
+        # Older checkpoints stored the step as a tensor
+        for state in self.state.values():
+            if isinstance(state.get("step"), Tensor):
+                state["step"] = int(state["step"].item())
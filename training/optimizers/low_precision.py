@@ -0,0 +1,124 @@
+"""Helpers for optimizers that keep their state in low precision."""
+
+from itertools import chain
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+DEFAULT_BLOCK_SIZE = 256
+
+
+def quantize_blockwise(x: Tensor, block_size: int = DEFAULT_BLOCK_SIZE, signed: bool = True) -> Tuple[Tensor, Tensor]:
+    """
+    Quantizes `x` to 8 bits with one scale (the absolute maximum) per block of `block_size` values.
+
+    Values are companded with a square root before rounding, which gives small values (most of
+    the entries of Adam moments) a finer resolution than a linear code: relative to the block
+    maximum, the smallest nonzero value is 1/127² (signed) or 1/255² (unsigned).
+
+    Args:
+        x: The tensor to quantize.
+        block_size: Number of consecutive values sharing a scale.
+        signed: Whether `x` has negative values (`int8` codes) or not (`uint8` codes).
+
+    Returns:
+        The codes, of shape [num_blocks, block_size], and the float32 scales, of shape [num_blocks].
+    """
+    flat = x.detach().reshape(-1).float()
+    padding = -flat.numel() % block_size
+    if padding:
+        flat = F.pad(flat, (0, padding))
+    blocks = flat.view(-1, block_size)
+    absmax = blocks.abs().amax(dim=1)
+    normalized = blocks / absmax.clamp(min=torch.finfo(torch.float32).tiny)[:, None]
+    if signed:
+        codes = normalized.abs().sqrt_().mul_(127).round_().copysign_(normalized).to(torch.int8)
+    else:
+        codes = normalized.sqrt_().mul_(255).round_().to(torch.uint8)
+    return codes, absmax
+
+
+def dequantize_blockwise(codes: Tensor, absmax: Tensor, shape: torch.Size) -> Tensor:
+    """
+    Inverse of `quantize_blockwise`. Returns a float32 tensor of `shape`.
+    """
+    signed = codes.dtype == torch.int8
+    values = codes.float().div_(127 if signed else 255)
+    values = values.abs().mul_(values) if signed else values.square_()
+    values.mul_(absmax[:, None])
+    return values.view(-1)[:shape.numel()].view(shape)
+
+
+def stochastic_round_(target: Tensor, value: Tensor, generator: Optional[torch.Generator] = None) -> Tensor:
+    """
+    Copies float32 `value` into bfloat16 `target`, rounding stochastically.
+
+    A bfloat16 is a float32 without the lower 16 mantissa bits. Adding uniform noise to those bits
+    before truncating them rounds up with a probability proportional to the remainder, so updates
+    smaller than the bfloat16 resolution are not lost on average.
+    """
+    if target.dtype != torch.bfloat16:
+        raise ValueError(f"Stochastic rounding targets bfloat16 tensors, got {target.dtype}")
+    bits = value.float().contiguous().view(torch.int32)
+    noise = torch.randint(0, 1 << 16, bits.shape, dtype=torch.int32, device=bits.device, generator=generator)
+    target.copy_(bits.add(noise).bitwise_and_(-65536).view(torch.float32))
+    return target
+
+
+def rounding_generator(generators: Dict[torch.device, torch.Generator], device: torch.device,
+                       seed: int = 0) -> torch.Generator:
+    """
+    Returns the generator of the stochastic rounding noise on `device`, created from `seed` on
+    first use and kept in `generators`.
+
+    Every rank creates it from the same seed and draws the same noise, so that parameters
+    replicated across ranks stay identical, whatever else consumes the global generator.
+    """
+    if device not in generators:
+        generators[device] = torch.Generator(device).manual_seed(seed)
+    return generators[device]
+
+
+def restore_state_dtypes(optimizer: torch.optim.Optimizer, state_dict: Dict[str, Any], keys: Iterable[str]) -> None:
+    """
+    Reverts the dtype cast of `Optimizer.load_state_dict` for the state entries in `keys`.
+
+    `Optimizer.load_state_dict` casts every state tensor of a floating-point parameter to the
+    parameter's dtype, which would upcast low-precision state, turn 8-bit codes into floats and
+    downcast the float32 scales of bfloat16 parameters.
+    Call this right after it, with the same `state_dict`.
+    """
+    keys = set(keys)
+    saved_ids = chain.from_iterable(group["params"] for group in state_dict["param_groups"])
+    params = chain.from_iterable(group["params"] for group in optimizer.param_groups)
+    for saved_id, param in zip(saved_ids, params):
+        saved = state_dict["state"].get(saved_id)
+        if not saved:
+            continue
+        state = optimizer.state[param]
+        for key in keys.intersection(saved):
+            if isinstance(saved[key], Tensor):
+                state[key] = saved[key].to(device=param.device, copy=True)
+
+
+def optimizer_state_bytes(optimizer: torch.optim.Optimizer) -> Dict[str, Any]:
+    """
+    Memory taken by the optimizer state, in bytes, in total and per state key, next to the
+    memory of the parameters it trains.
+    """
+    seen = set()
+    per_key: Dict[str, int] = {}
+    for state in optimizer.state.values():
+        for key, value in state.items():
+            if not isinstance(value, Tensor) or value.data_ptr() in seen:
+                continue
+            seen.add(value.data_ptr())
+            per_key[key] = per_key.get(key, 0) + value.numel() * value.element_size()
+    params = chain.from_iterable(group["params"] for group in optimizer.param_groups)
+    return {
+        "state": sum(per_key.values()),
+        "params": sum(p.numel() * p.element_size() for p in params),
+        "per_key": per_key,
+    }
@@ -3,21 +3,27 @@
 """Implementation of the Muon optimizer."""
 
 import math
+from collections import defaultdict
 from collections.abc import MutableMapping
-from typing import Optional
+from typing import Optional, Union
 
 import torch
+import torch.distributed as dist
 from torch import Tensor
-from torch.distributed.tensor import DTensor, distribute_tensor
+from torch.distributed.tensor import DTensor, Replicate, Shard, distribute_tensor
 
 from torch.optim.optimizer import (
+    _default_to_fused_or_foreach,
     _disable_dynamo_if_unsupported,
+    _foreach_doc,
     _params_doc,
     _to_scalar,
     Optimizer,
     ParamsT,
 )
 
+from training.optimizers.low_precision import restore_state_dtypes, rounding_generator, stochastic_round_
+
 
 __all__ = ["Muon"]
 
@@ -28,10 +34,59 @@ DEFAULT_A = 3.4445
 DEFAULT_B = -4.7750
 DEFAULT_C = 2.0315
 DEFAULT_NS_STEPS = 5
+DEFAULT_NS_DTYPE = "bfloat16"
+_DTYPES = {"bfloat16": torch.bfloat16, "float16": torch.float16, "float32": torch.float32}
+
+
+def _resolve_dtype(dtype: Union[str, torch.dtype], name: str = "ns_dtype") -> torch.dtype:
+    if isinstance(dtype, torch.dtype):
+        return dtype
+    if dtype not in _DTYPES:
+        raise ValueError(f"{name} must be one of {list(_DTYPES)}, got {dtype}")
+    return _DTYPES[dtype]
+
+
+def _resolve_ns_steps(
+    shape: torch.Size, ns_steps: int, ns_steps_per_shape: Optional[dict[str, int]]
+) -> int:
+    """Number of NS steps for a parameter shape, e.g. ``ns_steps_per_shape={"768x3072": 6}``."""
+    if ns_steps_per_shape:
+        return ns_steps_per_shape.get(f"{shape[0]}x{shape[1]}", ns_steps)
+    return ns_steps
+
+
+def _get_ns_workspace(
+    workspaces: Optional[dict],
+    shape: tuple[int, ...],
+    dtype: torch.dtype,
+    device: torch.device,
+) -> dict[str, Tensor]:
+    """
+    Returns the Newton–Schulz buffers for matrices of `shape` (``(A, B)`` or ``(G, A, B)``
+    with ``A <= B``), creating and caching them in `workspaces` on first use.
+    """
+    key = (tuple(shape), dtype, device)
+    if workspaces is not None and key in workspaces:
+        return workspaces[key]
+    *batch, rows, cols = shape
+    workspace = {
+        "ortho": torch.empty(*batch, rows, cols, dtype=dtype, device=device),
+        "ortho_next": torch.empty(*batch, rows, cols, dtype=dtype, device=device),
+        "gram": torch.empty(*batch, rows, rows, dtype=dtype, device=device),
+        "gram_update": torch.empty(*batch, rows, rows, dtype=dtype, device=device),
+    }
+    if workspaces is not None:
+        workspaces[key] = workspace
+    return workspace
 
 
 def _zeropower_via_newtonschulz(
-    grad: Tensor, ns_coefficients: tuple[float, float, float], ns_steps: int, eps: float
+    grad: Tensor,
+    ns_coefficients: tuple[float, float, float],
+    ns_steps: int,
+    eps: float,
+    ns_dtype: torch.dtype = torch.bfloat16,
+    workspaces: Optional[dict] = None,
 ) -> Tensor:
     """
     Newton-Schulz iteration to compute the zeroth power / orthogonalization of G. We opt to use a
@@ -44,6 +99,10 @@ def _zeropower_via_newtonschulz(
 
     Implementation reference: https://github.com/KellerJordan/Muon/blob/master/muon.py
     with suggestions by @jxbz, @leloykun, and @YouJiacheng.
+
+    The iteration runs in `ns_dtype`, in place in preallocated buffers. With `workspaces`,
+    the buffers are cached per shape and reused across calls, so the returned tensor is a
+    view into them that is only valid until the next call for the same shape.
     """
     if ns_steps >= 100:
         raise ValueError(
@@ -54,24 +113,99 @@ def _zeropower_via_newtonschulz(
     if len(ns_coefficients) != 3:
         raise ValueError("Coefficients must be a tuple of exactly 3 values")
     a, b, c = ns_coefficients
-    ortho_grad = grad.bfloat16()
-    if grad.size(0) > grad.size(1):
-        ortho_grad = ortho_grad.T
+    transposed = grad.size(0) > grad.size(1)
+    if transposed:
+        grad = grad.T
+    workspace = _get_ns_workspace(workspaces, grad.shape, ns_dtype, grad.device)
+    ortho_grad, ortho_next = workspace["ortho"], workspace["ortho_next"]
+    gram_matrix, gram_update = workspace["gram"], workspace["gram_update"]
+    ortho_grad.copy_(grad)
     # Ensure spectral norm is at most 1
     ortho_grad.div_(ortho_grad.norm().clamp(min=eps))
     # Perform the NS iterations
     for _ in range(ns_steps):
-        gram_matrix = ortho_grad @ ortho_grad.T
-        gram_update = torch.addmm(
-            gram_matrix, gram_matrix, gram_matrix, beta=b, alpha=c
+        torch.mm(ortho_grad, ortho_grad.T, out=gram_matrix)
+        torch.addmm(
+            gram_matrix, gram_matrix, gram_matrix, beta=b, alpha=c, out=gram_update
         )
-        ortho_grad = torch.addmm(ortho_grad, gram_update, ortho_grad, beta=a)
+        torch.addmm(ortho_grad, gram_update, ortho_grad, beta=a, out=ortho_next)
+        ortho_grad, ortho_next = ortho_next, ortho_grad
 
-    if grad.size(0) > grad.size(1):
+    if transposed:
         ortho_grad = ortho_grad.T
     return ortho_grad
 
 
+def _batched_zeropower_via_newtonschulz(
+    grads: Union[Tensor, list[Tensor]],
+    ns_coefficients: tuple[float, float, float],
+    ns_steps: int,
+    eps: float,
+    ns_dtype: torch.dtype = torch.bfloat16,
+    workspaces: Optional[dict] = None,
+) -> Tensor:
+    """
+    Batched version of :func:`_zeropower_via_newtonschulz` for a stack of matrices of the
+    same shape ``(G, A, B)`` with ``A <= B`` (i.e. already transposed to have fewer rows
+    than columns), or a list of G such matrices, which are copied straight into the stacked
+    buffer. Every matrix is normalized and orthogonalized independently.
+    """
+    if ns_steps >= 100:
+        raise ValueError(
+            "Number of steps must be less than 100 for computational efficiency"
+        )
+    shape = grads.shape if isinstance(grads, Tensor) else (len(grads), *grads[0].shape)
+    if len(shape) != 3 or shape[1] > shape[2]:
+        raise ValueError("Input must be a stack of 2D matrices with rows <= columns")
+    if len(ns_coefficients) != 3:
+        raise ValueError("Coefficients must be a tuple of exactly 3 values")
+    a, b, c = ns_coefficients
+    device = grads.device if isinstance(grads, Tensor) else grads[0].device
+    workspace = _get_ns_workspace(workspaces, shape, ns_dtype, device)
+    ortho_grads, ortho_next = workspace["ortho"], workspace["ortho_next"]
+    gram_matrices, gram_updates = workspace["gram"], workspace["gram_update"]
+    if isinstance(grads, Tensor):
+        ortho_grads.copy_(grads)
+    else:
+        for ortho_grad, grad in zip(ortho_grads.unbind(0), grads):
+            ortho_grad.copy_(grad)
+    # Ensure spectral norm is at most 1, per matrix
+    ortho_grads.div_(ortho_grads.norm(dim=(1, 2), keepdim=True).clamp(min=eps))
+    # Perform the NS iterations
+    for _ in range(ns_steps):
+        torch.bmm(ortho_grads, ortho_grads.mT, out=gram_matrices)
+        torch.baddbmm(
+            gram_matrices, gram_matrices, gram_matrices, beta=b, alpha=c, out=gram_updates
+        )
+        torch.baddbmm(ortho_grads, gram_updates, ortho_grads, beta=a, out=ortho_next)
+        ortho_grads, ortho_next = ortho_next, ortho_grads
+    return ortho_grads
+
+
+def _init_momentum_buffer(grad: Tensor, momentum_dtype: Optional[str]) -> Tensor:
+    """Zero momentum buffer, in `momentum_dtype` (e.g. "bfloat16") or the gradient's dtype."""
+    dtype = None if momentum_dtype is None else _resolve_dtype(momentum_dtype, "momentum_dtype")
+    return torch.zeros_like(grad, dtype=dtype, memory_format=torch.preserve_format)
+
+
+def _update_param_(
+    param: Tensor, update: Tensor, decay: float, alpha: float, rounding_generators: Optional[dict]
+) -> None:
+    """
+    ``param.mul_(decay).add_(update, alpha=alpha)``. With `rounding_generators`, bfloat16
+    parameters are updated in float32 and rounded stochastically (see `stochastic_round_`).
+    """
+    if rounding_generators is None or param.dtype != torch.bfloat16:
+        param.mul_(decay)
+        param.add_(update, alpha=alpha)
+        return
+    if isinstance(param, DTensor):
+        param = param.to_local()
+        update = update.to_local() if isinstance(update, DTensor) else update
+    value = param.float().mul_(decay).add_(update, alpha=alpha)
+    stochastic_round_(param, value, rounding_generator(rounding_generators, param.device))
+
+
 def _adjust_lr(
     lr: float, adjust_lr_fn: Optional[str], param_shape: torch.Size
 ) -> float:
@@ -88,6 +222,9 @@ def _adjust_lr(
 
 
 class Muon(Optimizer):
+    # The learning rate may be a tensor, see `Compile.compile_optimizer_step`
+    supports_tensor_lr = True
+
     def __init__(
         self,
         params: ParamsT,
@@ -99,6 +236,14 @@ class Muon(Optimizer):
         eps: float = EPS,
         ns_steps: int = DEFAULT_NS_STEPS,
         adjust_lr_fn: Optional[str] = None,
+        foreach: Optional[bool] = None,
+        ns_dtype: str = DEFAULT_NS_DTYPE,
+        ns_steps_per_shape: Optional[dict[str, int]] = None,
+        momentum_dtype: Optional[str] = None,
+        distributed: bool = False,
+        process_group: Optional[dist.ProcessGroup] = None,
+        cache_workspaces: bool = True,
+        stochastic_rounding: bool = True,
     ) -> None:
         if isinstance(lr, Tensor) and lr.numel() != 1:
             raise ValueError("Tensor lr must be 1-element")
@@ -115,6 +260,11 @@ class Muon(Optimizer):
             raise ValueError(
                 f"Adjust learning rate function {adjust_lr_fn} is not supported"
             )
+        _resolve_dtype(ns_dtype)
+        if momentum_dtype is not None:
+            _resolve_dtype(momentum_dtype, "momentum_dtype")
+        if ns_steps_per_shape is not None:
+            ns_steps_per_shape = {str(shape): int(steps) for shape, steps in ns_steps_per_shape.items()}
 
         defaults = {
             "lr": lr,
@@ -125,8 +275,21 @@ class Muon(Optimizer):
             "eps": eps,
             "ns_steps": ns_steps,
             "adjust_lr_fn": adjust_lr_fn,
+            "foreach": foreach,
+            "ns_dtype": ns_dtype,
+            "ns_steps_per_shape": ns_steps_per_shape,
+            "momentum_dtype": momentum_dtype,
+            "stochastic_rounding": stochastic_rounding,
         }
         super().__init__(params, defaults)
+        self.distributed = distributed
+        self.process_group = process_group
+        self.cache_workspaces = cache_workspaces
+        # Newton–Schulz buffers kept across steps with `cache_workspaces`, per (shape, dtype,
+        # device). Scratch space, not saved in state_dict
+        self._ns_workspaces: dict = {}
+        # Noise of the stochastic rounding, per device. Not saved in state_dict
+        self._rounding_generators: dict = {}
 
         for group in self.param_groups:
             for p in group["params"]:
@@ -152,15 +315,15 @@ class Muon(Optimizer):
                 raise RuntimeError("Muon does not support sparse gradients")
 
             params_with_grad.append(p)
-            grads.append(p.grad)
 
             state = self.state[p]
 
             if "momentum_buffer" not in state:
-                state["momentum_buffer"] = torch.zeros_like(
-                    p.grad, memory_format=torch.preserve_format
-                )
-            muon_momentum_bufs.append(state["momentum_buffer"])
+                state["momentum_buffer"] = _init_momentum_buffer(p.grad, group["momentum_dtype"])
+            buf = state["momentum_buffer"]
+            muon_momentum_bufs.append(buf)
+            # A low-precision buffer is accumulated from a gradient of the same dtype
+            grads.append(p.grad if p.grad.dtype == buf.dtype else p.grad.to(buf.dtype))
 
         return False  # has_complex
 
@@ -201,9 +364,33 @@ class Muon(Optimizer):
                 ns_steps=group["ns_steps"],
                 adjust_lr_fn=group["adjust_lr_fn"],
                 has_complex=has_complex,
+                foreach=group["foreach"],
+                ns_dtype=_resolve_dtype(group["ns_dtype"]),
+                ns_steps_per_shape=group["ns_steps_per_shape"],
+                ns_workspaces=self._ns_workspaces if self.cache_workspaces else None,
+                rounding_generators=self._rounding_generators if group["stochastic_rounding"] else None,
+                distributed=self.distributed and dist.is_available() and dist.is_initialized(),
+                process_group=self.process_group,
             )
         return loss
 
+    def load_state_dict(self, state_dict):
+        super().load_state_dict(state_dict)
+        # Keep low-precision momentum buffers in their dtype
+        restore_state_dtypes(self, state_dict, ("momentum_buffer",))
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._ns_workspaces = {}
+        self._rounding_generators = {}
+        self.__dict__.setdefault("cache_workspaces", True)
+        for group in self.param_groups:
+            group.setdefault("foreach", None)
+            group.setdefault("ns_dtype", DEFAULT_NS_DTYPE)
+            group.setdefault("ns_steps_per_shape", None)
+            group.setdefault("momentum_dtype", None)
+            group.setdefault("stochastic_rounding", True)
+
 
 Muon.__doc__ = (
     r"""Implements Muon algorithm.
@@ -275,6 +462,35 @@ Muon.__doc__ = (
         ns_steps (int, optional): number of Newton–Schulz iteration steps. (default: {DEFAULT_NS_STEPS})
         adjust_lr_fn (str, optional): function to adjust learning rate. One of "original" and "match_rms_adamw".
             If not specified, we will default to use "original". (default: None)
+        {_foreach_doc} The foreach implementation stacks parameters of the same shape (after
+            transposing tall matrices) and runs the Newton–Schulz iteration as batched matmuls.
+        ns_dtype (str, optional): dtype of the Newton–Schulz iteration, one of "bfloat16",
+            "float16" and "float32". (default: "{DEFAULT_NS_DTYPE}")
+        ns_steps_per_shape (dict, optional): number of Newton–Schulz steps for specific parameter
+            shapes, keyed by "ROWSxCOLS" (e.g. {{"768x3072": 6}}). Other shapes use `ns_steps`.
+            (default: None)
+        momentum_dtype (str, optional): dtype of the momentum buffer, e.g. "bfloat16" to halve
+            the optimizer state. (default: None, the gradient's dtype)
+        distributed (bool, optional): whether each matrix is orthogonalized by a single owner rank
+            (balanced by FLOPs) and sent to the others, instead of by every rank. Requires every
+            rank to step the same parameters in the same order. Ignored if torch.distributed is
+            not initialized. (default: False)
+        process_group (ProcessGroup, optional): process group used by the distributed mode.
+            (default: the default process group)
+        cache_workspaces (bool, optional): whether the Newton–Schulz buffers are cached per
+            matrix shape, dtype and device and kept from one step to the next, which avoids
+            reallocating them every step. The cost is persistent memory outside of the
+            optimizer state: one set of buffers per shape, two matrices of that shape and two
+            square Gram matrices of its smaller side in `ns_dtype` (for the whole stack with
+            foreach), held between steps and not saved in `state_dict`. Set it to False when
+            memory is tight: every matrix (or stack) then gets its own buffers for its
+            iteration, freed as soon as it is done, which keeps the peak memory lowest.
+            (default: True)
+        stochastic_rounding (bool, optional): whether bfloat16 parameters are updated in float32
+            and rounded stochastically, so that updates smaller than their resolution are not
+            lost on average. The noise comes from a generator seeded identically on every rank,
+            so replicated parameters stay identical. No effect on float32 parameters.
+            (default: True)
 
     .. _Muon\: An optimizer for hidden layers in neural networks:
         https://kellerjordan.github.io/posts/muon/
@@ -299,6 +515,10 @@ def _single_tensor_muon(
     eps: float,
     adjust_lr_fn: Optional[str],
     has_complex: bool,
+    ns_dtype: torch.dtype = torch.bfloat16,
+    ns_steps_per_shape: Optional[dict[str, int]] = None,
+    ns_workspaces: Optional[dict] = None,
+    rounding_generators: Optional[dict] = None,
 ) -> None:
     lr = _to_scalar(lr)
     if has_complex:
@@ -312,24 +532,353 @@ def _single_tensor_muon(
         buf = muon_momentum_bufs[i]
         buf.lerp_(grad, 1 - momentum)
         update = grad.lerp(buf, momentum) if nesterov else buf
+        param_ns_steps = _resolve_ns_steps(param.shape, ns_steps, ns_steps_per_shape)
 
         if isinstance(update, DTensor):
             full_update = update.full_tensor()
+            # Not cached: `distribute_tensor` may keep a view of the result
             full_update = _zeropower_via_newtonschulz(
-                full_update, ns_coefficients, ns_steps, eps
+                full_update, ns_coefficients, param_ns_steps, eps, ns_dtype
             )
             update = distribute_tensor(
                 full_update, update.device_mesh, update.placements
             )
         else:
             update = _zeropower_via_newtonschulz(
-                update, ns_coefficients, ns_steps, eps
+                update, ns_coefficients, param_ns_steps, eps, ns_dtype, ns_workspaces
             )
 
         adjusted_lr = _adjust_lr(lr, adjust_lr_fn, param.shape)
+        _update_param_(param, update, 1 - lr * weight_decay, -adjusted_lr, rounding_generators)
+
+
+def _multi_tensor_muon(
+    params: list[Tensor],
+    grads: list[Tensor],
+    muon_momentum_bufs: list[Tensor],
+    *,
+    lr: float,
+    weight_decay: float,
+    momentum: float,
+    nesterov: bool,
+    ns_coefficients: tuple[float, float, float],
+    ns_steps: int,
+    eps: float,
+    adjust_lr_fn: Optional[str],
+    has_complex: bool,
+    ns_dtype: torch.dtype = torch.bfloat16,
+    ns_steps_per_shape: Optional[dict[str, int]] = None,
+    ns_workspaces: Optional[dict] = None,
+    rounding_generators: Optional[dict] = None,
+) -> None:
+    if len(params) == 0:
+        return
+
+    lr = _to_scalar(lr)
+    if has_complex:
+        raise ValueError("Complex parameters are not supported")
+
+    # DTensors need a full gather before orthogonalization, handled per tensor
+    dtensor_indices = [i for i, grad in enumerate(grads) if isinstance(grad, DTensor)]
+    if dtensor_indices:
+        _single_tensor_muon(
+            [params[i] for i in dtensor_indices],
+            [grads[i] for i in dtensor_indices],
+            [muon_momentum_bufs[i] for i in dtensor_indices],
+            lr=lr,
+            weight_decay=weight_decay,
+            momentum=momentum,
+            nesterov=nesterov,
+            ns_coefficients=ns_coefficients,
+            ns_steps=ns_steps,
+            eps=eps,
+            adjust_lr_fn=adjust_lr_fn,
+            has_complex=has_complex,
+            ns_dtype=ns_dtype,
+            ns_steps_per_shape=ns_steps_per_shape,
+            ns_workspaces=ns_workspaces,
+            rounding_generators=rounding_generators,
+        )
+        local_indices = [i for i, grad in enumerate(grads) if not isinstance(grad, DTensor)]
+        params = [params[i] for i in local_indices]
+        grads = [grads[i] for i in local_indices]
+        muon_momentum_bufs = [muon_momentum_bufs[i] for i in local_indices]
+        if len(params) == 0:
+            return
+
+    for grad in grads:
+        if grad.ndim != 2:
+            raise ValueError("Param gradient must be a 2D matrix")
+
+    grouped_tensors = Optimizer._group_tensors_by_device_and_dtype(
+        [params, grads, muon_momentum_bufs]  # type: ignore[list-item]
+    )
+    for (
+        device_params,
+        device_grads,
+        device_momentum_bufs,
+    ), _ in grouped_tensors.values():
+        torch._foreach_lerp_(device_momentum_bufs, device_grads, 1 - momentum)
+
+        # Stack matrices of the same shape, tall ones transposed, and orthogonalize them at once
+        indices_by_shape: dict[tuple[int, int, int], list[int]] = defaultdict(list)
+        for i, grad in enumerate(device_grads):
+            rows, cols = grad.shape
+            steps = _resolve_ns_steps(grad.shape, ns_steps, ns_steps_per_shape)
+            indices_by_shape[(min(rows, cols), max(rows, cols), steps)].append(i)
+
+        # bfloat16 parameters rounded stochastically are decayed and updated one at a time
+        rounded = rounding_generators is not None and device_params[0].dtype == torch.bfloat16
+        if not rounded:
+            torch._foreach_mul_(device_params, 1 - lr * weight_decay)
+
+        for (_, _, steps), indices in indices_by_shape.items():
+            # Nesterov updates are computed one shape at a time, to bound the temporary memory
+            if nesterov:
+                updates = torch._foreach_lerp(
+                    [device_grads[i] for i in indices], [device_momentum_bufs[i] for i in indices], momentum
+                )
+            else:
+                updates = [device_momentum_bufs[i] for i in indices]
+            transposed = [update.size(0) > update.size(1) for update in updates]
+            # Copied straight into the stacked buffer. The result lives in a (possibly cached)
+            # workspace, so it is applied before the next stack
+            stacked = _batched_zeropower_via_newtonschulz(
+                [update.T if t else update for update, t in zip(updates, transposed)],
+                ns_coefficients, steps, eps, ns_dtype, ns_workspaces,
+            )
+            del updates
+            ortho_updates = [
+                ortho_update.T if t else ortho_update for ortho_update, t in zip(stacked.unbind(0), transposed)
+            ]
+
+            # The adjusted learning rate only depends on the parameter shape
+            positions_by_param_shape: dict[torch.Size, list[int]] = defaultdict(list)
+            for position, i in enumerate(indices):
+                positions_by_param_shape[device_params[i].shape].append(position)
+            for shape, positions in positions_by_param_shape.items():
+                if rounded:
+                    for position in positions:
+                        _update_param_(
+                            device_params[indices[position]], ortho_updates[position], 1 - lr * weight_decay,
+                            -_adjust_lr(lr, adjust_lr_fn, shape), rounding_generators,
+                        )
+                    continue
+                torch._foreach_add_(
+                    [device_params[indices[position]] for position in positions],
+                    [ortho_updates[position] for position in positions],
+                    alpha=-_adjust_lr(lr, adjust_lr_fn, shape),
+                )
+
+
+def _assign_owners(shapes: list[torch.Size], world_size: int) -> list[int]:
+    """
+    Assigns every matrix to the rank that orthogonalizes it. Matrices are taken by decreasing
+    Newton–Schulz cost (``A * B * min(A, B)`` per iteration) and given to the least loaded
+    rank, which balances FLOPs and is deterministic across ranks.
+    """
+    costs = [shape[0] * shape[1] * min(shape[0], shape[1]) for shape in shapes]
+    loads = [0] * world_size
+    owners = [0] * len(shapes)
+    for i in sorted(range(len(shapes)), key=lambda i: (-costs[i], i)):
+        owner = min(range(world_size), key=lambda rank: (loads[rank], rank))
+        owners[i] = owner
+        loads[owner] += costs[i]
+    return owners
+
+
+def _even_shard_dim(update: Tensor, world_size: int) -> Optional[int]:
+    """
+    Returns the sharded dimension of a DTensor evenly sharded over a 1D mesh of
+    `world_size` ranks (or None for other layouts, e.g. replicated).
+    """
+    if update.device_mesh.ndim != 1 or update.device_mesh.size() != world_size:
+        return None
+    placement = update.placements[0]
+    if not isinstance(placement, Shard) or update.shape[placement.dim] % world_size != 0:
+        return None
+    return placement.dim
+
+
+def _distributed_muon(
+    params: list[Tensor],
+    grads: list[Tensor],
+    muon_momentum_bufs: list[Tensor],
+    *,
+    lr: float,
+    weight_decay: float,
+    momentum: float,
+    nesterov: bool,
+    ns_coefficients: tuple[float, float, float],
+    ns_steps: int,
+    eps: float,
+    adjust_lr_fn: Optional[str],
+    has_complex: bool,
+    ns_dtype: torch.dtype = torch.bfloat16,
+    ns_steps_per_shape: Optional[dict[str, int]] = None,
+    ns_workspaces: Optional[dict] = None,
+    rounding_generators: Optional[dict] = None,
+    foreach: bool = False,
+    process_group: Optional[dist.ProcessGroup] = None,
+) -> None:
+    """
+    Muon step where every matrix is orthogonalized by a single owner rank instead of all of them.
+
+    Every rank must call it with the same parameters, in the same order. For a DTensor evenly
+    sharded on a 1D mesh over `process_group`, the owner gathers the shards, orthogonalizes
+    the full matrix and scatters the result back. For a replicated tensor (e.g. under DDP, or a
+    replicated DTensor), the owner orthogonalizes it and broadcasts the result. All gathers are
+    issued upfront and every result is sent asynchronously as soon as it is computed, so
+    communication overlaps with the Newton–Schulz iterations of the following matrices. Other
+    DTensor layouts fall back to a full gather on every rank.
+
+    With `foreach`, each owner stacks its matrices of the same (transposed) shape and runs the
+    batched iteration, and the parameters are updated with `_foreach_*` ops. The owner runs
+    the same computation as the single-process optimizer with the same `foreach` setting, so
+    the results are bit-identical.
+    """
+    lr = _to_scalar(lr)
+    if has_complex:
+        raise ValueError("Complex parameters are not supported")
+    if len(params) == 0:
+        return
+
+    world_size = dist.get_world_size(process_group)
+    rank = dist.get_rank(process_group)
 
-        param.mul_(1 - lr * weight_decay)
-        param.add_(update, alpha=-adjusted_lr)
+    updates = []
+    for i, grad in enumerate(grads):
+        if grad.ndim != 2:
+            raise ValueError("Param gradient must be a 2D matrix")
+        buf = muon_momentum_bufs[i]
+        buf.lerp_(grad, 1 - momentum)
+        updates.append(grad.lerp(buf, momentum) if nesterov else buf)
+
+    owners = _assign_owners([update.shape for update in updates], world_size)
+
+    # Gather the shards of sharded matrices on their owner
+    shard_dims: list[Optional[int]] = []
+    gathers: list[Optional[tuple]] = []
+    for update, owner in zip(updates, owners):
+        shard_dim = _even_shard_dim(update, world_size) if isinstance(update, DTensor) else None
+        shard_dims.append(shard_dim)
+        if shard_dim is None:
+            gathers.append(None)
+            continue
+        local = update.to_local().contiguous()
+        gather_list = [torch.empty_like(local) for _ in range(world_size)] if rank == owner else None
+        work = dist.gather(
+            local,
+            gather_list,
+            dst=dist.get_global_rank(process_group, owner) if process_group is not None else owner,
+            group=process_group,
+            async_op=True,
+        )
+        gathers.append((work, gather_list))
+
+    # Matrices orthogonalized together: one at a time, or with foreach, the matrices of the same
+    # owner and (transposed) shape as one stack. Every rank derives the same batches in the same
+    # order, so the collectives below are issued in the same order everywhere.
+    batches: dict[tuple, list[int]] = defaultdict(list)
+    for i, (update, owner) in enumerate(zip(updates, owners)):
+        steps = _resolve_ns_steps(update.shape, ns_steps, ns_steps_per_shape)
+        unsupported = isinstance(update, DTensor) and shard_dims[i] is None and not all(
+            isinstance(placement, Replicate) for placement in update.placements
+        )
+        if foreach and not unsupported:
+            rows, cols = update.shape
+            batches[(owner, min(rows, cols), max(rows, cols), steps)].append(i)
+        else:
+            batches[(i,)].append(i)
+
+    ortho_updates: list[Optional[Tensor]] = [None] * len(updates)
+    works = []
+    for indices in batches.values():
+        owner = owners[indices[0]]
+        src = dist.get_global_rank(process_group, owner) if process_group is not None else owner
+        steps = _resolve_ns_steps(updates[indices[0]].shape, ns_steps, ns_steps_per_shape)
+
+        first = updates[indices[0]]
+        if isinstance(first, DTensor) and shard_dims[indices[0]] is None and not all(
+            isinstance(placement, Replicate) for placement in first.placements
+        ):
+            # Layout not supported by the owner scheme (e.g. uneven or multi-dimensional sharding)
+            full_update = _zeropower_via_newtonschulz(first.full_tensor(), ns_coefficients, steps, eps, ns_dtype)
+            ortho_updates[indices[0]] = distribute_tensor(full_update, first.device_mesh, first.placements).to_local()
+            continue
+
+        # The owner orthogonalizes the full matrices in (possibly cached) workspaces; the results are
+        # copied out of them (into the scattered chunks or the broadcast tensor) before being sent
+        results: list[Optional[Tensor]] = [None] * len(indices)
+        if rank == owner:
+            fulls = []
+            for i in indices:
+                if shard_dims[i] is not None:
+                    work, gather_list = gathers[i]
+                    work.wait()
+                    fulls.append(torch.cat(gather_list, dim=shard_dims[i]))
+                else:
+                    fulls.append(updates[i].to_local() if isinstance(updates[i], DTensor) else updates[i])
+            if foreach:
+                transposed = [full.size(0) > full.size(1) for full in fulls]
+                stacked = _batched_zeropower_via_newtonschulz(
+                    [full.T if t else full for full, t in zip(fulls, transposed)],
+                    ns_coefficients, steps, eps, ns_dtype, ns_workspaces,
+                )
+                results = [o.T if t else o for o, t in zip(stacked.unbind(0), transposed)]
+            else:
+                results = [
+                    _zeropower_via_newtonschulz(fulls[0], ns_coefficients, steps, eps, ns_dtype, ns_workspaces)
+                ]
+
+        for i, result in zip(indices, results):
+            update = updates[i]
+            shard_dim = shard_dims[i]
+            if shard_dim is not None:
+                local = update.to_local()
+                if rank == owner:
+                    scatter_list = [chunk.clone(memory_format=torch.contiguous_format) for chunk in result.chunk(world_size, dim=shard_dim)]
+                    ortho_update = torch.empty_like(scatter_list[rank])
+                else:
+                    scatter_list = None
+                    ortho_update = torch.empty(local.shape, dtype=ns_dtype, device=local.device)
+                works.append(dist.scatter(ortho_update, scatter_list, src=src, group=process_group, async_op=True))
+            else:
+                full_update = update.to_local() if isinstance(update, DTensor) else update
+                if rank == owner:
+                    ortho_update = result.clone(memory_format=torch.contiguous_format)
+                else:
+                    ortho_update = torch.empty(full_update.shape, dtype=ns_dtype, device=full_update.device)
+                works.append(dist.broadcast(ortho_update, src=src, group=process_group, async_op=True))
+            ortho_updates[i] = ortho_update
+
+    for work in works:
+        work.wait()
+
+    local_params = [param.to_local() if isinstance(param, DTensor) else param for param in params]
+    # bfloat16 parameters rounded stochastically are updated one at a time, also with foreach
+    one_at_a_time = [
+        not foreach or (rounding_generators is not None and param.dtype == torch.bfloat16) for param in local_params
+    ]
+    batched = [i for i in range(len(params)) if not one_at_a_time[i]]
+    if batched:
+        torch._foreach_mul_([local_params[i] for i in batched], 1 - lr * weight_decay)
+        # The adjusted learning rate only depends on the parameter shape
+        indices_by_shape: dict[torch.Size, list[int]] = defaultdict(list)
+        for i in batched:
+            indices_by_shape[params[i].shape].append(i)
+        for shape, indices in indices_by_shape.items():
+            torch._foreach_add_(
+                [local_params[i] for i in indices],
+                [ortho_updates[i] for i in indices],
+                alpha=-_adjust_lr(lr, adjust_lr_fn, shape),
+            )
+    for i, param in enumerate(params):
+        if one_at_a_time[i]:
+            _update_param_(
+                local_params[i], ortho_updates[i], 1 - lr * weight_decay,
+                -_adjust_lr(lr, adjust_lr_fn, param.shape), rounding_generators,
+            )
 
 
 @_disable_dynamo_if_unsupported(single_tensor_fn=_single_tensor_muon)
@@ -348,15 +897,52 @@ def muon(
     eps: float,
     adjust_lr_fn: Optional[str],
     has_complex: bool,
+    ns_dtype: torch.dtype = torch.bfloat16,
+    ns_steps_per_shape: Optional[dict[str, int]] = None,
+    ns_workspaces: Optional[dict] = None,
+    rounding_generators: Optional[dict] = None,
+    distributed: bool = False,
+    process_group: Optional[dist.ProcessGroup] = None,
 ):
     r"""Functional API that performs Muon algorithm computation.
 
     See :class:`~torch.optim.Muon` for details.
     """
-    if foreach is not None and foreach:
-        raise RuntimeError("Foreach is not supported for Muon yet")
+    if foreach is None:
+        _, foreach = _default_to_fused_or_foreach(
+            params, differentiable=False, use_fused=False
+        )
 
-    func = _single_tensor_muon
+    if distributed:
+        _distributed_muon(
+            params,
+            grads,
+            muon_momentum_bufs,
+            lr=lr,
+            weight_decay=weight_decay,
+            momentum=momentum,
+            nesterov=nesterov,
+            ns_coefficients=ns_coefficients,
+            ns_steps=ns_steps,
+            eps=eps,
+            adjust_lr_fn=adjust_lr_fn,
+            has_complex=has_complex,
+            ns_dtype=ns_dtype,
+            ns_steps_per_shape=ns_steps_per_shape,
+            ns_workspaces=ns_workspaces,
+            rounding_generators=rounding_generators,
+            foreach=foreach,
+            process_group=process_group,
+        )
+        return
+
+    if foreach and torch.jit.is_scripting():
+        raise RuntimeError("torch.jit.script not supported with foreach optimizers")
+
+    if foreach and not torch.jit.is_scripting():
+        func = _multi_tensor_muon
+    else:
+        func = _single_tensor_muon
 
     func(
         params,
@@ -371,4 +957,8 @@ def muon(
         eps=eps,
         adjust_lr_fn=adjust_lr_fn,
         has_complex=has_complex,
+        ns_dtype=ns_dtype,
+        ns_steps_per_shape=ns_steps_per_shape,
+        ns_workspaces=ns_workspaces,
+        rounding_generators=rounding_generators,
     )
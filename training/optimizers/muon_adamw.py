@@ -0,0 +1,306 @@
+"""Hybrid optimizer: Muon for 2D hidden weights, AdamW for everything else."""
+
+import fnmatch
+import warnings
+from collections.abc import Iterable
+from typing import Any, Optional, Union
+
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+from torch import Tensor
+from torch.optim.adamw import adamw
+from torch.optim.optimizer import _default_to_fused_or_foreach, _get_scalar_dtype, Optimizer
+
+from training.optimizers.muon import (
+    DEFAULT_A,
+    DEFAULT_B,
+    DEFAULT_C,
+    DEFAULT_NS_DTYPE,
+    DEFAULT_NS_STEPS,
+    EPS,
+    _init_momentum_buffer,
+    _resolve_dtype,
+    muon,
+)
+from training.optimizers.low_precision import restore_state_dtypes
+
+
+__all__ = ["MuonAdamW"]
+
+# Parameters that stay on AdamW even though they are 2D
+DEFAULT_ADAMW_PATTERNS = ["*embed*", "*wte*", "*wpe*", "*lm_head*", "*norm*", "*bias"]
+
+
+class MuonAdamW(Optimizer):
+    """
+    Muon for 2D hidden weight matrices and AdamW for all other parameters, in one optimizer.
+
+    Every parameter is routed by name: parameters matching one of `adamw_patterns` (embeddings,
+    `lm_head`, norms, biases by default) and all parameters that are not 2D go to AdamW; the
+    remaining 2D parameters go to Muon if they match one of `muon_patterns`, else to AdamW.
+    The two kinds end up in separate param groups (tagged with ``use_muon``), so there is a
+    single `state_dict` and a single `step()`, and the existing schedulers scale both learning
+    rates. The AdamW groups use the fused kernels when every parameter is on a supported device,
+    and the foreach implementation otherwise.
+    """
+    # The learning rate may be a tensor, see `Compile.compile_optimizer_step`
+    supports_tensor_lr = True
+
+    def __init__(
+        self,
+        params: Union[nn.Module, Iterable[tuple[str, Tensor]], Iterable[Tensor]],
+        lr: float = 0.02,
+        weight_decay: float = 0.1,
+        momentum: float = 0.95,
+        nesterov: bool = True,
+        ns_coefficients: tuple[float, float, float] = (DEFAULT_A, DEFAULT_B, DEFAULT_C),
+        eps: float = EPS,
+        ns_steps: int = DEFAULT_NS_STEPS,
+        adjust_lr_fn: Optional[str] = None,
+        ns_dtype: str = DEFAULT_NS_DTYPE,
+        ns_steps_per_shape: Optional[dict[str, int]] = None,
+        momentum_dtype: Optional[str] = None,
+        adamw_lr: float = 3e-4,
+        adamw_betas: tuple[float, float] = (0.9, 0.95),
+        adamw_eps: float = 1e-8,
+        adamw_weight_decay: float = 0.0,
+        muon_patterns: Optional[list[str]] = None,
+        adamw_patterns: Optional[list[str]] = None,
+        foreach: Optional[bool] = None,
+        fused: Optional[bool] = None,
+        distributed: bool = False,
+        process_group: Optional[dist.ProcessGroup] = None,
+        cache_workspaces: bool = True,
+        stochastic_rounding: bool = True,
+    ) -> None:
+        """
+        Args:
+            params: The model, its `named_parameters()`, or an iterable of parameters. Without
+                    names, parameters are routed by shape only, so the embeddings and the head
+                    go to Muon too (with a warning); pass the model or `named_parameters()`.
+            lr: Muon learning rate.
+            weight_decay: Muon weight decay.
+            momentum, nesterov, ns_coefficients, eps, ns_steps, adjust_lr_fn, ns_dtype,
+            ns_steps_per_shape, momentum_dtype: Muon hyperparameters, see `Muon`.
+            adamw_lr: AdamW learning rate.
+            adamw_betas: AdamW coefficients of the running averages.
+            adamw_eps: AdamW term added to the denominator.
+            adamw_weight_decay: AdamW (decoupled) weight decay.
+            muon_patterns: Glob patterns of the 2D parameters trained with Muon. Defaults to ["*"].
+            adamw_patterns: Glob patterns of the parameters trained with AdamW even if they are 2D.
+                            Defaults to embeddings, `lm_head`, norms and biases.
+                            Example: ['*wte*', 'lm_head.weight']
+            foreach: Whether to use the foreach implementations (default: None, picks automatically).
+            fused: Whether to use the fused AdamW kernels (default: None, fused if supported).
+            distributed: Whether to distribute Muon's Newton–Schulz work across ranks, see `Muon`.
+            process_group: Process group used when `distributed` is set.
+            cache_workspaces: Whether Muon's Newton–Schulz workspaces are kept across steps (faster,
+                              but persistent memory per matrix shape), see `Muon`.
+            stochastic_rounding: Whether bfloat16 parameters trained with Muon are updated in float32
+                                 and rounded stochastically, see `Muon`. The AdamW groups use
+                                 PyTorch's AdamW, which rounds to nearest.
+        """
+        if not 0.0 <= lr or not 0.0 <= adamw_lr:
+            raise ValueError(f"Learning rates should be >= 0 but are: {lr}, {adamw_lr}")
+        if not 0.0 <= weight_decay or not 0.0 <= adamw_weight_decay:
+            raise ValueError(f"Weight decays should be >= 0 but are: {weight_decay}, {adamw_weight_decay}")
+        if not 0.0 <= adamw_betas[0] < 1.0 or not 0.0 <= adamw_betas[1] < 1.0:
+            raise ValueError(f"Invalid AdamW betas: {adamw_betas}")
+        if fused and foreach:
+            raise RuntimeError("`fused` and `foreach` cannot be `True` together.")
+        _resolve_dtype(ns_dtype)
+        if ns_steps_per_shape is not None:
+            ns_steps_per_shape = {str(shape): int(steps) for shape, steps in ns_steps_per_shape.items()}
+        self.muon_patterns = ["*"] if muon_patterns is None else list(muon_patterns)
+        self.adamw_patterns = DEFAULT_ADAMW_PATTERNS if adamw_patterns is None else list(adamw_patterns)
+
+        muon_params, adamw_params = [], []
+        unnamed = 0
+        for name, param in self._named(params):
+            if not param.requires_grad:
+                continue
+            unnamed += name is None and param.ndim == 2
+            (muon_params if self.use_muon(name, param) else adamw_params).append(
+                param if name is None else (name, param)
+            )
+        if unnamed:
+            warnings.warn(
+                f"MuonAdamW got {unnamed} unnamed 2D parameter(s), which all go to Muon: "
+                "`adamw_patterns` (embeddings, head) cannot be applied without names. "
+                "Pass the model or its `named_parameters()` instead of `parameters()`.",
+                stacklevel=2,
+            )
+        if fused is None and not foreach and adamw_params:
+            fused, _ = _default_to_fused_or_foreach(
+                [p[1] if isinstance(p, tuple) else p for p in adamw_params], differentiable=False, use_fused=True
+            )
+
+        param_groups: list[dict[str, Any]] = []
+        if muon_params:
+            param_groups.append({
+                "params": muon_params,
+                "use_muon": True,
+                "lr": lr,
+                "weight_decay": weight_decay,
+                "momentum": momentum,
+                "nesterov": nesterov,
+                "ns_coefficients": ns_coefficients,
+                "eps": eps,
+                "ns_steps": ns_steps,
+                "adjust_lr_fn": adjust_lr_fn,
+                "ns_dtype": ns_dtype,
+                "ns_steps_per_shape": ns_steps_per_shape,
+                "momentum_dtype": momentum_dtype,
+                "stochastic_rounding": stochastic_rounding,
+                "foreach": foreach,
+            })
+        if adamw_params:
+            param_groups.append({
+                "params": adamw_params,
+                "use_muon": False,
+                "lr": adamw_lr,
+                "betas": tuple(adamw_betas),
+                "eps": adamw_eps,
+                "weight_decay": adamw_weight_decay,
+                "foreach": None if fused else foreach,
+                "fused": bool(fused),
+            })
+        super().__init__(param_groups, {})
+        self.distributed = distributed
+        self.process_group = process_group
+        self.cache_workspaces = cache_workspaces
+        # Newton–Schulz buffers and stochastic rounding noise, see `Muon`
+        self._ns_workspaces: dict = {}
+        self._rounding_generators: dict = {}
+
+    @staticmethod
+    def _named(params: Any) -> Iterable[tuple[Optional[str], Tensor]]:
+        if isinstance(params, nn.Module):
+            params = params.named_parameters()
+        for item in params:
+            if isinstance(item, tuple):
+                yield item
+            else:
+                yield None, item
+
+    def use_muon(self, name: Optional[str], param: Tensor) -> bool:
+        """Whether `param` is trained with Muon."""
+        if param.ndim != 2:
+            return False
+        if name is None:
+            return True
+        if any(fnmatch.fnmatch(name, pattern) for pattern in self.adamw_patterns):
+            return False
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.muon_patterns)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        """Performs a single optimization step."""
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            if group["use_muon"]:
+                self._muon_step(group)
+            else:
+                self._adamw_step(group)
+        return loss
+
+    def _muon_step(self, group: dict[str, Any]) -> None:
+        params, grads, momentum_bufs = [], [], []
+        for p in group["params"]:
+            if p.grad is None:
+                continue
+            if p.grad.is_sparse:
+                raise RuntimeError("MuonAdamW does not support sparse gradients")
+            params.append(p)
+            state = self.state[p]
+            if "momentum_buffer" not in state:
+                state["momentum_buffer"] = _init_momentum_buffer(p.grad, group["momentum_dtype"])
+            buf = state["momentum_buffer"]
+            momentum_bufs.append(buf)
+            grads.append(p.grad if p.grad.dtype == buf.dtype else p.grad.to(buf.dtype))
+
+        muon(
+            params,
+            grads,
+            momentum_bufs,
+            lr=group["lr"],
+            weight_decay=group["weight_decay"],
+            momentum=group["momentum"],
+            nesterov=group["nesterov"],
+            ns_coefficients=group["ns_coefficients"],
+            eps=group["eps"],
+            ns_steps=group["ns_steps"],
+            adjust_lr_fn=group["adjust_lr_fn"],
+            has_complex=False,
+            foreach=group["foreach"],
+            ns_dtype=_resolve_dtype(group["ns_dtype"]),
+            ns_steps_per_shape=group["ns_steps_per_shape"],
+            ns_workspaces=self._ns_workspaces if self.cache_workspaces else None,
+            rounding_generators=self._rounding_generators if group["stochastic_rounding"] else None,
+            distributed=self.distributed and dist.is_available() and dist.is_initialized(),
+            process_group=self.process_group,
+        )
+
+    def _adamw_step(self, group: dict[str, Any]) -> None:
+        params, grads, exp_avgs, exp_avg_sqs, state_steps = [], [], [], [], []
+        has_complex = False
+        for p in group["params"]:
+            if p.grad is None:
+                continue
+            if p.grad.is_sparse:
+                raise RuntimeError("MuonAdamW does not support sparse gradients")
+            has_complex |= torch.is_complex(p)
+            params.append(p)
+            grads.append(p.grad)
+            state = self.state[p]
+            if len(state) == 0:
+                # The fused kernels read the step count from the parameter's device
+                state["step"] = (
+                    torch.zeros((), dtype=_get_scalar_dtype(is_fused=True), device=p.device)
+                    if group["fused"]
+                    else torch.tensor(0.0, dtype=_get_scalar_dtype())
+                )
+                state["exp_avg"] = torch.zeros_like(p, memory_format=torch.preserve_format)
+                state["exp_avg_sq"] = torch.zeros_like(p, memory_format=torch.preserve_format)
+            exp_avgs.append(state["exp_avg"])
+            exp_avg_sqs.append(state["exp_avg_sq"])
+            state_steps.append(state["step"])
+
+        beta1, beta2 = group["betas"]
+        adamw(
+            params,
+            grads,
+            exp_avgs,
+            exp_avg_sqs,
+            [],
+            state_steps,
+            foreach=group["foreach"],
+            fused=group["fused"] or None,
+            has_complex=has_complex,
+            amsgrad=False,
+            beta1=beta1,
+            beta2=beta2,
+            lr=group["lr"],
+            weight_decay=group["weight_decay"],
+            eps=group["eps"],
+            maximize=False,
+        )
+
+    def load_state_dict(self, state_dict):
+        super().load_state_dict(state_dict)
+        # Keep low-precision momentum buffers in their dtype
+        restore_state_dtypes(self, state_dict, ("momentum_buffer",))
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._ns_workspaces = {}
+        self._rounding_generators = {}
+        self.__dict__.setdefault("cache_workspaces", True)
+        for group in self.param_groups:
+            if group["use_muon"]:
+                group.setdefault("stochastic_rounding", True)
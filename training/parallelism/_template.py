@@ -0,0 +1,30 @@
+from contextlib import AbstractContextManager
+from typing import Any, Protocol, runtime_checkable
+
+@runtime_checkable
+class DataParallelTemplate(Protocol):
+    """
+    Protocol describing a data-parallel model wrapper.
+
+    It is recommended (but not required) that implementations inherit from
+    `torch.nn.Module`. The wrapper is called like the model it wraps, and averages the
+    gradients across ranks during (or right after) the backward pass.
+    """
+    def __call__(self, *args, **kwargs) -> Any:
+        """
+        Forward pass of the wrapped model.
+        """
+        ...
+
+    def no_sync(self) -> AbstractContextManager:
+        """
+        Context manager disabling gradient synchronization, e.g. for all but the last
+        micro-batch of gradient accumulation.
+        """
+        ...
+
+    def finish_gradient_synchronization(self) -> None:
+        """
+        Blocks until the gradients of the last backward pass are synchronized.
+        """
+        ...
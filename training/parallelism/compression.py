@@ -0,0 +1,306 @@
+"""
+Gradient-compression communication hooks for `DataParallel` (see `CommHook`).
+
+Every hook is called once per bucket and step, keeps its own per-parameter state (error
+feedback, PowerSGD factors) and counts the bytes it sends, see `stats()`. Parameters whose
+name matches one of `uncompressed_patterns` (e.g. embeddings) and parameters that are not
+worth compressing are averaged with a plain full-precision all-reduce.
+"""
+import fnmatch
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+
+from training.parallelism.data_parallel import GradBucket
+
+
+class _Pending:
+    """
+    Result of a hook: `wait()` waits for the first (asynchronous) collective and then runs the
+    remaining stages of the reduction, which depend on it.
+    """
+    def __init__(self, work: Optional[dist.Work], finish: Callable[[], None]):
+        self.work = work
+        self.finish = finish
+
+    def wait(self) -> None:
+        if self.work is not None:
+            self.work.wait()
+        self.finish()
+
+
+class _CompressionHook:
+    def __init__(self, uncompressed_patterns: Sequence[str] = ()):
+        """
+        Args:
+            uncompressed_patterns: Glob patterns of parameter names that are never compressed.
+                                   Example: ['*wte*', '*embed*']
+        """
+        self.uncompressed_patterns = list(uncompressed_patterns)
+        self.bytes_sent = 0
+        self.bytes_uncompressed = 0
+        self.num_steps = 0
+
+    def __call__(self, bucket: GradBucket, process_group: Optional[dist.ProcessGroup]) -> _Pending:
+        if bucket.index == 0:
+            self.num_steps += 1
+        self.bytes_uncompressed += bucket.buffer.numel() * bucket.buffer.element_size()
+        return self.reduce(bucket, process_group)
+
+    def reduce(self, bucket: GradBucket, process_group: Optional[dist.ProcessGroup]) -> _Pending:
+        raise NotImplementedError
+
+    def compress(self, name: str, param: nn.Parameter) -> bool:
+        """Whether the gradient of `param` is compressed."""
+        return not any(fnmatch.fnmatch(name, pattern) for pattern in self.uncompressed_patterns)
+
+    def _split(self, bucket: GradBucket) -> Tuple[List[nn.Parameter], List[nn.Parameter]]:
+        compressed, uncompressed = [], []
+        for name, p in zip(bucket.names, bucket.params):
+            (compressed if self.compress(name, p) else uncompressed).append(p)
+        return compressed, uncompressed
+
+    def _send(self, tensor: torch.Tensor) -> None:
+        self.bytes_sent += tensor.numel() * tensor.element_size()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Bytes this rank contributed to collectives, in total and per step, and the ratio to
+        an uncompressed all-reduce.
+        """
+        return {
+            "bytes_sent": self.bytes_sent,
+            "bytes_sent_per_step": self.bytes_sent / self.num_steps if self.num_steps else 0.0,
+            "compression_ratio": self.bytes_uncompressed / self.bytes_sent if self.bytes_sent else 1.0,
+        }
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {"bytes_sent": self.bytes_sent, "bytes_uncompressed": self.bytes_uncompressed, "num_steps": self.num_steps}
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        self.bytes_sent = state_dict["bytes_sent"]
+        self.bytes_uncompressed = state_dict["bytes_uncompressed"]
+        self.num_steps = state_dict["num_steps"]
+
+
+class BF16CompressionHook(_CompressionHook):
+    """
+    All-reduces gradients in bfloat16, halving the traffic of float32 gradients.
+    """
+    def reduce(self, bucket: GradBucket, process_group: Optional[dist.ProcessGroup]) -> _Pending:
+        world_size = dist.get_world_size(process_group)
+        compressed, uncompressed = self._split(bucket)
+        if uncompressed:
+            # Keep the uncompressed parameters in full precision, in a second collective
+            plain = torch.cat([bucket.views[p].reshape(-1) for p in uncompressed])
+            self._send(plain)
+            plain_work = dist.all_reduce(plain, group=process_group, async_op=True)
+        payload = (
+            torch.cat([bucket.views[p].reshape(-1) for p in compressed]).to(torch.bfloat16)
+            if compressed else None
+        )
+        work = None
+        if payload is not None:
+            self._send(payload)
+            work = dist.all_reduce(payload, group=process_group, async_op=True)
+
+        def finish() -> None:
+            if payload is not None:
+                _unflatten(payload.float().div_(world_size), [bucket.views[p] for p in compressed])
+            if uncompressed:
+                plain_work.wait()
+                _unflatten(plain.div_(world_size), [bucket.views[p] for p in uncompressed])
+
+        return _Pending(work, finish)
+
+
+class TopKCompressionHook(_CompressionHook):
+    """
+    Sends only the `ratio` largest-magnitude gradient entries of every bucket (values and
+    indices, all-gathered), with error feedback: the entries not sent are added to the next
+    step's gradient, so nothing is lost over time.
+    """
+    def __init__(self, ratio: float = 0.01, uncompressed_patterns: Sequence[str] = ()):
+        """
+        Args:
+            ratio: Fraction of the entries sent.
+            uncompressed_patterns: Glob patterns of parameter names that are never compressed.
+        """
+        super().__init__(uncompressed_patterns)
+        if not 0 < ratio <= 1:
+            raise ValueError(f"ratio must be in (0, 1], got {ratio}")
+        self.ratio = ratio
+        self.errors: Dict[int, torch.Tensor] = {}
+
+    def reduce(self, bucket: GradBucket, process_group: Optional[dist.ProcessGroup]) -> _Pending:
+        world_size = dist.get_world_size(process_group)
+        compressed, uncompressed = self._split(bucket)
+        plain = torch.cat([bucket.views[p].reshape(-1) for p in uncompressed]) if uncompressed else None
+        if plain is not None:
+            self._send(plain)
+            plain_work = dist.all_reduce(plain, group=process_group, async_op=True)
+        if not compressed:
+            def finish_plain() -> None:
+                _unflatten(plain.div_(world_size), [bucket.views[p] for p in uncompressed])
+            return _Pending(plain_work, finish_plain)
+
+        grad = torch.cat([bucket.views[p].reshape(-1) for p in compressed])
+        error = self.errors.get(bucket.index)
+        if error is not None:
+            grad.add_(error)
+        k = max(1, int(self.ratio * grad.numel()))
+        indices = grad.abs().topk(k, sorted=False).indices
+        values = grad[indices]
+        grad[indices] = 0
+        self.errors[bucket.index] = grad
+
+        values = values.contiguous()
+        indices = indices.to(torch.int32)
+        gathered_values = [torch.empty_like(values) for _ in range(world_size)]
+        gathered_indices = [torch.empty_like(indices) for _ in range(world_size)]
+        self._send(values)
+        self._send(indices)
+        values_work = dist.all_gather(gathered_values, values, group=process_group, async_op=True)
+        work = dist.all_gather(gathered_indices, indices, group=process_group, async_op=True)
+
+        def finish() -> None:
+            values_work.wait()
+            dense = torch.zeros_like(grad)
+            for chunk_values, chunk_indices in zip(gathered_values, gathered_indices):
+                dense.index_add_(0, chunk_indices, chunk_values)
+            _unflatten(dense.div_(world_size), [bucket.views[p] for p in compressed])
+            if plain is not None:
+                plain_work.wait()
+                _unflatten(plain.div_(world_size), [bucket.views[p] for p in uncompressed])
+
+        return _Pending(work, finish)
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {**super().state_dict(), "errors": dict(self.errors)}
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        super().load_state_dict(state_dict)
+        self.errors = dict(state_dict["errors"])
+
+
+class PowerSGDHook(_CompressionHook):
+    """
+    PowerSGD (Vogels et al., 2019): rank-`rank` approximation of every gradient matrix, with
+    error feedback.
+
+    For a gradient M (reshaped to [rows, cols]) plus its error, one power iteration computes
+    P = M Q (all-reduced), orthonormalizes P, computes Q = M^T P (all-reduced and averaged) and
+    uses P Q^T as the averaged gradient; M - P Q^T is kept as the error for the next step. Q is
+    reused across steps (warm start). Each matrix sends (rows + cols) * rank values instead of
+    rows * cols. The P factors of all matrices of a bucket and its uncompressed gradients go in
+    one all-reduce, and the Q factors in a second one.
+
+    The first `start_step` steps use a plain all-reduce, as early gradients change quickly.
+    """
+    def __init__(
+        self,
+        rank: int = 4,
+        start_step: int = 10,
+        min_compression_rate: float = 2.0,
+        uncompressed_patterns: Sequence[str] = (),
+        seed: int = 0,
+    ):
+        """
+        Args:
+            rank: Rank of the approximation.
+            start_step: Number of initial steps without compression.
+            min_compression_rate: Matrices whose compression rate rows * cols / ((rows + cols) * rank)
+                                  is lower (small or 1D parameters) are not compressed.
+            uncompressed_patterns: Glob patterns of parameter names that are never compressed.
+            seed: Seed of the initial Q factors, which must be the same on all ranks.
+        """
+        super().__init__(uncompressed_patterns)
+        self.rank = rank
+        self.start_step = start_step
+        self.min_compression_rate = min_compression_rate
+        self.seed = seed
+        self.errors: Dict[Tuple[int, int], torch.Tensor] = {}
+        self.qs: Dict[Tuple[int, int], torch.Tensor] = {}
+
+    def compress(self, name: str, param: nn.Parameter) -> bool:
+        if param.ndim < 2 or not super().compress(name, param):
+            return False
+        rows = param.shape[0]
+        cols = param.numel() // rows
+        return rows * cols >= self.min_compression_rate * (rows + cols) * self.rank
+
+    def reduce(self, bucket: GradBucket, process_group: Optional[dist.ProcessGroup]) -> _Pending:
+        world_size = dist.get_world_size(process_group)
+        compressed, uncompressed = self._split(bucket)
+        if self.num_steps <= self.start_step or not compressed:
+            bucket.buffer.div_(world_size)
+            self._send(bucket.buffer)
+            return _Pending(dist.all_reduce(bucket.buffer, group=process_group, async_op=True), lambda: None)
+
+        compressed_ids = {id(p) for p in compressed}
+        matrices, ps, qs, keys = [], [], [], []
+        for i, p in enumerate(bucket.params):
+            if id(p) not in compressed_ids:
+                continue
+            key = (bucket.index, i)
+            matrix = bucket.views[p].reshape(p.shape[0], -1).float()
+            if key in self.errors:
+                matrix = matrix + self.errors[key]
+            if key not in self.qs:
+                generator = torch.Generator().manual_seed(self.seed + 1_000_003 * bucket.index + i)
+                self.qs[key] = torch.randn(matrix.shape[1], self.rank, generator=generator).to(matrix.device)
+            matrices.append(matrix)
+            qs.append(self.qs[key])
+            ps.append(matrix @ qs[-1])
+            keys.append(key)
+
+        plain = [bucket.views[p].reshape(-1).float() for p in uncompressed]
+        payload = torch.cat([p.reshape(-1) for p in ps] + plain)
+        self._send(payload)
+        work = dist.all_reduce(payload, group=process_group, async_op=True)
+
+        def finish() -> None:
+            offset = 0
+            for j, p_factor in enumerate(ps):
+                ps[j] = _orthonormalize(payload[offset:offset + p_factor.numel()].view_as(p_factor))
+                offset += p_factor.numel()
+            _unflatten(payload[offset:].div_(world_size), [bucket.views[p] for p in uncompressed])
+
+            q_payload = torch.cat([(matrix.T @ p_factor).reshape(-1) for matrix, p_factor in zip(matrices, ps)])
+            self._send(q_payload)
+            dist.all_reduce(q_payload, group=process_group)
+            q_payload.div_(world_size)
+
+            offset = 0
+            compressed_views = [bucket.views[p] for p in compressed]
+            for matrix, p_factor, q, key, view in zip(matrices, ps, qs, keys, compressed_views):
+                q.copy_(q_payload[offset:offset + q.numel()].view_as(q))
+                offset += q.numel()
+                approx = p_factor @ q.T
+                self.errors[key] = matrix - approx
+                view.copy_(approx.view_as(view))
+
+        return _Pending(work, finish)
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {**super().state_dict(), "errors": dict(self.errors), "qs": dict(self.qs)}
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        super().load_state_dict(state_dict)
+        self.errors = dict(state_dict["errors"])
+        self.qs = dict(state_dict["qs"])
+
+
+def _orthonormalize(matrix: torch.Tensor) -> torch.Tensor:
+    """Orthonormal basis of the columns of `matrix` ([rows, rank])."""
+    q, _ = torch.linalg.qr(matrix, mode="reduced")
+    return q
+
+
+def _unflatten(flat: torch.Tensor, views: List[torch.Tensor]) -> None:
+    offset = 0
+    for view in views:
+        view.copy_(flat[offset:offset + view.numel()].view_as(view))
+        offset += view.numel()
@@ -0,0 +1,191 @@
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+
+
+class GradBucket:
+    """
+    A group of parameters whose gradients are stored in one flat buffer and reduced together.
+
+    Attributes:
+        params: The parameters of the bucket.
+        names: Their names in the wrapped module.
+        index: Position of the bucket; bucket 0 is reduced first, once per step.
+        buffer: Flat gradient buffer.
+        views: Parameter to the view of `buffer` holding its gradient.
+    """
+    def __init__(self, params: List[nn.Parameter], names: List[str], index: int):
+        self.params = params
+        self.names = names
+        self.index = index
+        self.buffer = torch.zeros(
+            sum(p.numel() for p in params), dtype=params[0].dtype, device=params[0].device
+        )
+        self.views: Dict[nn.Parameter, torch.Tensor] = {}
+        offset = 0
+        for p in params:
+            self.views[p] = self.buffer[offset:offset + p.numel()].view_as(p)
+            offset += p.numel()
+        self.pending = len(params)
+        self.work: Any = None
+
+
+# Called with (bucket, process group) once all gradients of the bucket are ready. Returns an
+# object with a `wait()` method, after which `bucket.buffer` holds the averaged gradients.
+# See `training.parallelism.compression` for compressing hooks.
+CommHook = Callable[[GradBucket, Optional[dist.ProcessGroup]], Any]
+
+
+def allreduce_hook(bucket: GradBucket, process_group: Optional[dist.ProcessGroup]) -> dist.Work:
+    """Default communication hook: averages the bucket with an asynchronous all-reduce."""
+    bucket.buffer.div_(dist.get_world_size(process_group))
+    return dist.all_reduce(bucket.buffer, group=process_group, async_op=True)
+
+
+class DataParallel(nn.Module):
+    """
+    Data-parallel wrapper that averages gradients with bucketed all-reduces overlapped with backward.
+
+    Parameters are grouped into buckets of about `bucket_cap_mb`, in reverse registration order
+    (roughly the order their gradients are produced). Each parameter's gradient lives in a view of
+    its bucket's flat buffer; a post-accumulate-grad hook marks it ready, and as soon as every
+    gradient of a bucket is ready the bucket is all-reduced asynchronously while the backward pass
+    continues. Buckets are always launched in the same order on every rank. At the end of the
+    backward pass the pending all-reduces are awaited, so `optimizer.step()` sees averaged
+    gradients. Parameters that did not receive a gradient contribute zeros.
+
+    Parameters are broadcast from rank 0 when the wrapper is created.
+    """
+    def __init__(
+        self,
+        module: nn.Module,
+        bucket_cap_mb: float = 25.0,
+        process_group: Optional[dist.ProcessGroup] = None,
+        broadcast_buffers: bool = True,
+        comm_hook: Optional[CommHook] = None,
+    ):
+        """
+        Args:
+            module: The model to wrap.
+            bucket_cap_mb: Approximate size of a gradient bucket, in MiB.
+            process_group: Process group to average over. Defaults to the world.
+            broadcast_buffers: Whether to broadcast the module buffers from rank 0 at every forward.
+            comm_hook: Function launching the reduction of a bucket, see `CommHook` (e.g. a
+                       hook of `training.parallelism.compression`). Defaults to `allreduce_hook`.
+        """
+        super().__init__()
+        if not (dist.is_available() and dist.is_initialized()):
+            raise RuntimeError("DataParallel requires an initialized process group")
+        self.module = module
+        self.process_group = process_group
+        self.broadcast_buffers = broadcast_buffers
+        self.comm_hook = comm_hook if comm_hook is not None else allreduce_hook
+        self.world_size = dist.get_world_size(process_group)
+        self._sync = True
+        self._finalize_queued = False
+
+        self._broadcast_from_rank0(list(module.parameters()) + list(module.buffers()))
+
+        named_params = [(name, p) for name, p in module.named_parameters() if p.requires_grad]
+        params = [p for _, p in named_params]
+        self.buckets = self._build_buckets(named_params[::-1], int(bucket_cap_mb * 2**20))
+        self._bucket_of: Dict[nn.Parameter, GradBucket] = {}
+        for bucket in self.buckets:
+            for p in bucket.params:
+                self._bucket_of[p] = bucket
+                p.grad = bucket.views[p]
+        self._next_bucket = 0
+        self._handles = [p.register_post_accumulate_grad_hook(self._on_grad_ready) for p in params]
+
+    def _broadcast_from_rank0(self, tensors: List[torch.Tensor]) -> None:
+        src = dist.get_global_rank(self.process_group, 0) if self.process_group is not None else 0
+        with torch.no_grad():
+            for tensor in tensors:
+                dist.broadcast(tensor.data, src=src, group=self.process_group)
+
+    @staticmethod
+    def _build_buckets(named_params: List[Tuple[str, nn.Parameter]], cap_bytes: int) -> List[GradBucket]:
+        buckets: List[GradBucket] = []
+        current: List[Tuple[str, nn.Parameter]] = []
+        size = 0
+        for name, p in named_params:
+            if current and (
+                size + p.numel() * p.element_size() > cap_bytes
+                or p.dtype != current[0][1].dtype
+                or p.device != current[0][1].device
+            ):
+                buckets.append(GradBucket([q for _, q in current], [n for n, _ in current], len(buckets)))
+                current, size = [], 0
+            current.append((name, p))
+            size += p.numel() * p.element_size()
+        if current:
+            buckets.append(GradBucket([q for _, q in current], [n for n, _ in current], len(buckets)))
+        return buckets
+
+    def forward(self, *args, **kwargs) -> Any:
+        if self.broadcast_buffers and self._sync:
+            buffers = list(self.module.buffers())
+            if buffers:
+                self._broadcast_from_rank0(buffers)
+        return self.module(*args, **kwargs)
+
+    @contextmanager
+    def no_sync(self) -> Iterator[None]:
+        """
+        Accumulates gradients locally inside the context; the next backward outside of it
+        synchronizes the accumulated gradients.
+        """
+        previous = self._sync
+        self._sync = False
+        try:
+            yield
+        finally:
+            self._sync = previous
+
+    def _on_grad_ready(self, p: nn.Parameter) -> None:
+        bucket = self._bucket_of[p]
+        view = bucket.views[p]
+        if p.grad is not view:
+            # The gradient was reset (e.g. `zero_grad(set_to_none=True)`); move it into the bucket
+            view.copy_(p.grad)
+            p.grad = view
+        if not self._sync:
+            return
+        if not self._finalize_queued:
+            self._finalize_queued = True
+            torch.autograd.Variable._execution_engine.queue_callback(self.finish_gradient_synchronization)
+        bucket.pending -= 1
+        self._launch_ready_buckets()
+
+    def _launch_ready_buckets(self, force: bool = False) -> None:
+        # Launch in bucket order so that the collectives match across ranks
+        while self._next_bucket < len(self.buckets):
+            bucket = self.buckets[self._next_bucket]
+            if bucket.pending > 0 and not force:
+                return
+            bucket.work = self.comm_hook(bucket, self.process_group)
+            self._next_bucket += 1
+
+    def finish_gradient_synchronization(self) -> None:
+        """
+        Launches the buckets still waiting for gradients (parameters unused in this step)
+        and waits for all reductions. Runs automatically at the end of the backward pass.
+        """
+        if not self._finalize_queued:
+            return
+        for bucket in self.buckets:
+            for p in bucket.params:
+                if p.grad is None:
+                    bucket.views[p].zero_()
+                    p.grad = bucket.views[p]
+        self._launch_ready_buckets(force=True)
+        for bucket in self.buckets:
+            if bucket.work is not None:
+                bucket.work.wait()
+            bucket.work = None
+            bucket.pending = len(bucket.params)
+        self._next_bucket = 0
+        self._finalize_queued = False
@@ -0,0 +1,140 @@
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+
+
+def partition_parameters(params: List[nn.Parameter], world_size: int) -> List[int]:
+    """
+    Assigns every parameter to a rank. Parameters are taken by decreasing size and given to the
+    least loaded rank, which balances the optimizer state and is deterministic across ranks.
+    """
+    loads = [0] * world_size
+    owners = [0] * len(params)
+    for i in sorted(range(len(params)), key=lambda i: (-params[i].numel(), i)):
+        owner = min(range(world_size), key=lambda rank: (loads[rank], rank))
+        owners[i] = owner
+        loads[owner] += params[i].numel()
+    return owners
+
+
+class ZeroOptimizer(torch.optim.Optimizer):
+    """
+    ZeRO stage 1: shards the optimizer state across data-parallel ranks.
+
+    Every parameter is owned by one rank (see `partition_parameters`). The wrapped optimizer's
+    param groups are restricted to the parameters owned by this rank, so it only creates state
+    (Adam moments, Muon momentum, ...) for its shard, which divides the optimizer memory by the
+    world size. Since all optimizers in `training.optimizers` update every parameter independently
+    (Muon orthogonalizes whole matrices), stepping the shard gives the same result as stepping
+    everything. After the local step, every rank broadcasts its updated parameters, flattened
+    into one buffer per dtype.
+
+    Gradients must already be averaged across ranks, e.g. by `DataParallel`. Param group
+    hyperparameters (e.g. `lr`) are shared with the wrapped optimizer, so schedulers can drive
+    this wrapper directly. `state_dict` only holds this rank's shard.
+
+    It subclasses `torch.optim.Optimizer` so that schedulers accept it, but does not call its
+    `__init__`: the param groups and the state are those of the wrapped optimizer.
+    """
+    def __init__(self, optimizer: torch.optim.Optimizer, process_group: Optional[dist.ProcessGroup] = None):
+        """
+        Args:
+            optimizer: The optimizer to shard. It must not have taken a step yet.
+            process_group: Process group the state is sharded over. Defaults to the world.
+        """
+        if not (dist.is_available() and dist.is_initialized()):
+            raise RuntimeError("ZeroOptimizer requires an initialized process group")
+        if optimizer.state:
+            raise ValueError("ZeroOptimizer must wrap an optimizer before its first step")
+        if getattr(optimizer, "distributed", False):
+            raise ValueError("The wrapped optimizer must not distribute its own work (distributed=False)")
+        self.optimizer = optimizer
+        self.defaults = optimizer.defaults
+        self.process_group = process_group
+        self.rank = dist.get_rank(process_group)
+        self.world_size = dist.get_world_size(process_group)
+
+        self.params: List[nn.Parameter] = [p for group in optimizer.param_groups for p in group["params"]]
+        owners = partition_parameters(self.params, self.world_size)
+        self.owner: Dict[nn.Parameter, int] = dict(zip(self.params, owners))
+        for group in optimizer.param_groups:
+            local = [i for i, p in enumerate(group["params"]) if self.owner[p] == self.rank]
+            if "param_names" in group:
+                group["param_names"] = [group["param_names"][i] for i in local]
+            group["params"] = [group["params"][i] for i in local]
+
+        # Parameters of every rank, per dtype and device, in a fixed order
+        self._params_by_owner: List[Dict[Any, List[nn.Parameter]]] = [defaultdict(list) for _ in range(self.world_size)]
+        for p, owner in zip(self.params, owners):
+            self._params_by_owner[owner][(p.dtype, p.device)].append(p)
+
+    @property
+    def param_groups(self) -> List[Dict[str, Any]]:
+        return self.optimizer.param_groups
+
+    @property
+    def state(self) -> Dict[Any, Any]:
+        return self.optimizer.state
+
+    def zero_grad(self, set_to_none: bool = True) -> None:
+        for p in self.params:
+            if p.grad is None:
+                continue
+            if set_to_none:
+                p.grad = None
+            else:
+                p.grad.zero_()
+
+    @torch.no_grad()
+    def step(self, closure=None) -> Any:
+        """
+        Steps the local shard, then broadcasts the updated parameters from their owners.
+        """
+        loss = self.optimizer.step(closure)
+        works = []
+        flats = []
+        for owner, params_by_key in enumerate(self._params_by_owner):
+            src = dist.get_global_rank(self.process_group, owner) if self.process_group is not None else owner
+            for params in params_by_key.values():
+                if owner == self.rank:
+                    flat = torch.cat([p.detach().reshape(-1) for p in params])
+                else:
+                    flat = torch.empty(
+                        sum(p.numel() for p in params), dtype=params[0].dtype, device=params[0].device
+                    )
+                works.append(dist.broadcast(flat, src=src, group=self.process_group, async_op=True))
+                flats.append((owner, params, flat))
+        for work in works:
+            work.wait()
+        for owner, params, flat in flats:
+            if owner == self.rank:
+                continue
+            offset = 0
+            for p in params:
+                p.copy_(flat[offset:offset + p.numel()].view_as(p))
+                offset += p.numel()
+        return loss
+
+    def state_dict(self) -> Dict[str, Any]:
+        """
+        Returns the state of this rank's shard.
+        """
+        return {
+            "rank": self.rank,
+            "world_size": self.world_size,
+            "optimizer": self.optimizer.state_dict(),
+        }
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        """
+        Loads the shard saved by the same rank of a run with the same world size.
+        """
+        if state_dict["world_size"] != self.world_size or state_dict["rank"] != self.rank:
+            raise ValueError(
+                f"Cannot load the optimizer shard of rank {state_dict['rank']}/{state_dict['world_size']} "
+                f"on rank {self.rank}/{self.world_size}"
+            )
+        self.optimizer.load_state_dict(state_dict["optimizer"])
@@ -0,0 +1,450 @@
+import json
+import mmap
+import os
+import pickle
+import re
+import shutil
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import torch
+import torch.distributed as dist
+
+# safetensors dtype names
+_DTYPES = {
+    torch.float64: "F64", torch.float32: "F32", torch.float16: "F16", torch.bfloat16: "BF16",
+    torch.int64: "I64", torch.int32: "I32", torch.int16: "I16", torch.int8: "I8", torch.uint8: "U8",
+    torch.bool: "BOOL", torch.float8_e4m3fn: "F8_E4M3", torch.float8_e5m2: "F8_E5M2",
+    torch.uint16: "U16", torch.uint32: "U32", torch.uint64: "U64",
+}
+_NAMES = {name: dtype for dtype, name in _DTYPES.items()}
+COMPONENTS = ("model", "optimizer", "scheduler", "dataset")
+_STEP_DIR = re.compile(r"^step_(\d+)$")
+
+
+def save_file(tensors: Dict[str, torch.Tensor], path: str) -> None:
+    """
+    Writes CPU tensors to `path` in the safetensors layout: an 8-byte little-endian header size, a
+    JSON header with the dtype, shape and byte range of every tensor, then the raw bytes. Tensors
+    are ordered by decreasing element size, so every tensor is aligned to its element size in the
+    file (and in memory once mapped). The file is fsynced.
+    """
+    order = sorted(tensors, key=lambda key: (-tensors[key].element_size(), key))
+    header: Dict[str, Any] = {}
+    offset = 0
+    for key in order:
+        tensor = tensors[key]
+        nbytes = tensor.numel() * tensor.element_size()
+        header[key] = {"dtype": _DTYPES[tensor.dtype], "shape": list(tensor.shape), "data_offsets": [offset, offset + nbytes]}
+        offset += nbytes
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for key in order:
+            tensor = tensors[key]
+            if tensor.numel():
+                f.write(memoryview(tensor.contiguous().reshape(-1).view(torch.uint8).numpy()))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def load_file(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Maps a file written by `save_file` and returns its tensors without reading them: every tensor
+    is a copy-on-write view of the mapping, paged in from disk when it is first accessed.
+    """
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+        size = os.fstat(f.fileno()).st_size
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY) if size else b""
+    start = 8 + header_size
+    tensors = {}
+    for key, info in header.items():
+        if key == "__metadata__":
+            continue
+        dtype = _NAMES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        if count:
+            tensor = torch.frombuffer(buffer, dtype=dtype, count=count, offset=start + begin)
+        else:
+            tensor = torch.empty(0, dtype=dtype)
+        tensors[key] = tensor.view(info["shape"])
+    return tensors
+
+
+class _TensorRef:
+    """Placeholder of a tensor in the pickled structure of a state dict."""
+    def __init__(self, key: str, device: str, dtensor: bool = False):
+        self.key = key
+        self.device = device
+        # Whether the tensor is this rank's shard of a DTensor
+        self.dtensor = dtensor
+
+
+def _flatten(obj: Any, prefix: str, tensors: Dict[str, torch.Tensor],
+             dtensors: Optional[Dict[str, torch.Tensor]] = None) -> Any:
+    """
+    Replaces every tensor of a nested state dict by a `_TensorRef`, collecting the tensors. DTensors
+    are collected as their local shard, and also collected themselves in `dtensors`.
+    """
+    if isinstance(obj, torch.Tensor):
+        from torch.distributed.tensor import DTensor
+        is_dtensor = isinstance(obj, DTensor)
+        if is_dtensor:
+            if dtensors is not None:
+                dtensors[prefix] = obj
+            obj = obj.to_local()
+        tensors[prefix] = obj.detach()
+        return _TensorRef(prefix, str(obj.device), is_dtensor)
+    if isinstance(obj, dict):
+        return {key: _flatten(value, f"{prefix}/{key}", tensors, dtensors) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        items = [_flatten(value, f"{prefix}/{i}", tensors, dtensors) for i, value in enumerate(obj)]
+        return type(obj)(items) if not hasattr(obj, "_fields") else type(obj)(*items)
+    return obj
+
+
+def _to_dtensor(key: str, local: torch.Tensor, target: Any) -> torch.Tensor:
+    """Rebuilds a saved shard into a DTensor laid out as `target`, the current value of the key."""
+    from torch.distributed.tensor import DTensor
+    if not isinstance(target, DTensor):
+        raise ValueError(
+            f"{key} was saved from a DTensor, but the state being restored has "
+            f"{'no such entry' if target is None else 'a plain tensor'} to take its layout from"
+        )
+    target_local = target.to_local()
+    if local.shape != target_local.shape:
+        raise ValueError(
+            f"The shard of {key} has shape {tuple(local.shape)}, but this rank's shard is "
+            f"{tuple(target_local.shape)}: was it saved with another mesh or placement?"
+        )
+    return DTensor.from_local(local.to(target_local.device), target.device_mesh, target.placements,
+                              run_check=False, shape=target.shape, stride=target.stride())
+
+
+def _unflatten(obj: Any, tensors: Dict[str, torch.Tensor], dtensors: Optional[Dict[str, torch.Tensor]] = None) -> Any:
+    if isinstance(obj, _TensorRef):
+        if getattr(obj, "dtensor", False):
+            dtensors = dtensors or {}
+            # Or the layout of the parameter, for the state of an optimizer (keyed by parameter)
+            target = dtensors.get(obj.key, dtensors.get(obj.key.rsplit("/", 1)[0]))
+            return _to_dtensor(obj.key, tensors[obj.key], target)
+        return tensors[obj.key]
+    if isinstance(obj, dict):
+        return {key: _unflatten(value, tensors, dtensors) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        items = [_unflatten(value, tensors, dtensors) for value in obj]
+        return type(obj)(items) if not hasattr(obj, "_fields") else type(obj)(*items)
+    return obj
+
+
+class Checkpointer:
+    """
+    Asynchronous, per-rank checkpointing of the model, optimizer, scheduler and dataset states.
+
+    `save` takes a snapshot of the `state_dict()` of every component: tensors are copied into
+    pinned host buffers (reused from one save to the next) with `non_blocking=True`, which only
+    enqueues the copies behind the training step. A background thread then waits for the
+    copies and writes, for every rank, `rank_XXXXX.safetensors` (the tensors, see `save_file`)
+    and `rank_XXXXX.pkl` (the rest of the structure), so the training loop is blocked only for
+    the time of enqueuing the copies (and of the CPU copies, for CPU tensors).
+
+    A checkpoint is written to `step_XXXXXXXX.tmp/` and committed by renaming it to
+    `step_XXXXXXXX/` once every rank has written its files (signalled by per-rank marker files,
+    so the background threads never use collectives); an interrupted save therefore never
+    shadows the last complete checkpoint. The other ranks poll for the committed directory, so
+    `wait` (or a synchronous `save`) returns on every rank once the checkpoint is loadable. After a commit, only the `keep_last` most recent
+    checkpoints are kept. Ranks must share the filesystem of `checkpoint_dir`.
+
+    Components listed in `replicated` are identical on every rank and only saved by rank 0 (the
+    model under data parallelism). The others are saved by every rank, e.g. a `ZeroOptimizer`
+    shard or the position of every rank in its data shard. A replicated component whose state
+    holds DTensors (e.g. a model sharded with FSDP or tensor parallelism) is not identical on
+    every rank, so it is saved by every rank too. DTensors are saved as the local shard of
+    every rank, and restored as DTensors with the layout of the state being loaded into (or, for
+    optimizer states not created yet, of their parameter), which must therefore match the saved
+    one (same mesh and placements).
+
+    `load` maps the files and loads the states from the mapped tensors, so the checkpoint is
+    read from disk only once, directly into the components.
+    """
+    def __init__(
+        self,
+        checkpoint_dir: str,
+        keep_last: Optional[int] = 3,
+        replicated: Sequence[str] = ("model", "scheduler"),
+        async_save: bool = True,
+        process_group: Optional[dist.ProcessGroup] = None,
+        commit_timeout: float = 600.0,
+    ):
+        """
+        Args:
+            checkpoint_dir: Directory holding the checkpoints.
+            keep_last: Number of committed checkpoints to keep. None keeps all of them.
+            replicated: Components saved by rank 0 only, among "model", "optimizer",
+                        "scheduler" and "dataset".
+            async_save: Whether to write from a background thread. Otherwise `save` blocks
+                        until the checkpoint is committed, on every rank.
+            process_group: Process group of the ranks saving together. Defaults to the world.
+            commit_timeout: Seconds rank 0 waits for the other ranks' files before giving up
+                            on committing a checkpoint, and the other ranks wait for the commit.
+        """
+        unknown = set(replicated) - set(COMPONENTS)
+        if unknown:
+            raise ValueError(f"Unknown components {sorted(unknown)}, expected a subset of {COMPONENTS}")
+        if keep_last is not None and keep_last < 1:
+            raise ValueError(f"keep_last must be >= 1 or None, got {keep_last}")
+        self.checkpoint_dir = checkpoint_dir
+        self.keep_last = keep_last
+        self.replicated = tuple(replicated)
+        self.async_save = async_save
+        self.commit_timeout = commit_timeout
+        if dist.is_available() and dist.is_initialized():
+            self.rank, self.world_size = dist.get_rank(process_group), dist.get_world_size(process_group)
+        else:
+            self.rank, self.world_size = 0, 1
+
+        self._buffers: Dict[str, torch.Tensor] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+        self.last_save_blocking_time = 0.0
+        self.last_write_time = 0.0
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    @staticmethod
+    def step_dir_name(step: int) -> str:
+        return f"step_{step:08d}"
+
+    def committed_steps(self) -> List[int]:
+        """Returns the steps of the committed checkpoints, in increasing order."""
+        steps = []
+        for name in os.listdir(self.checkpoint_dir):
+            match = _STEP_DIR.match(name)
+            if match and os.path.isdir(os.path.join(self.checkpoint_dir, name)):
+                steps.append(int(match.group(1)))
+        return sorted(steps)
+
+    def latest_step(self) -> Optional[int]:
+        """Returns the step of the last committed checkpoint, or None."""
+        steps = self.committed_steps()
+        return steps[-1] if steps else None
+
+    def save(self, step: int, model: Any = None, optimizer: Any = None, scheduler: Any = None,
+             dataset: Any = None, extra: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Snapshots the states of the given components and writes them in the background.
+
+        Waits for the previous save to finish first, as its host buffers are reused.
+
+        Args:
+            step: Training step, which names the checkpoint.
+            model, optimizer, scheduler, dataset: Objects with a `state_dict()` method, or None.
+            extra: Additional picklable state (e.g. the RNG states or the token count), saved by every rank.
+        """
+        start = time.perf_counter()
+        self.wait()
+        components = {"model": model, "optimizer": optimizer, "scheduler": scheduler, "dataset": dataset}
+        tensors: Dict[str, torch.Tensor] = {}
+        # Replicated components holding DTensors, saved by every rank
+        structure: Dict[str, Any] = {"step": step, "extra": extra, "per_rank": []}
+        for name, component in components.items():
+            if component is None:
+                continue
+            component_tensors: Dict[str, torch.Tensor] = {}
+            dtensors: Dict[str, torch.Tensor] = {}
+            flat = _flatten(component.state_dict(), name, component_tensors, dtensors)
+            if name in self.replicated:
+                if dtensors:
+                    structure["per_rank"].append(name)
+                elif self.rank != 0:
+                    continue
+            structure[name] = flat
+            tensors.update(component_tensors)
+        snapshot, event = self._snapshot(tensors)
+        self.last_save_blocking_time = time.perf_counter() - start
+
+        if self.async_save:
+            self._thread = threading.Thread(target=self._write, args=(step, snapshot, structure, event), daemon=True)
+            self._thread.start()
+        else:
+            self._write(step, snapshot, structure, event)
+            self._raise_error()
+
+    def _snapshot(self, tensors: Dict[str, torch.Tensor]) -> Tuple[Dict[str, torch.Tensor], Any]:
+        """Copies the tensors to host buffers; device copies are asynchronous."""
+        snapshot = {}
+        devices = set()
+        for key, tensor in tensors.items():
+            buffer = self._buffers.get(key)
+            if buffer is None or buffer.shape != tensor.shape or buffer.dtype != tensor.dtype:
+                buffer = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=tensor.device.type == "cuda")
+                self._buffers[key] = buffer
+            buffer.copy_(tensor, non_blocking=tensor.device.type == "cuda")
+            if tensor.device.type == "cuda":
+                devices.add(tensor.device)
+            snapshot[key] = buffer
+        for key in set(self._buffers) - set(tensors):
+            del self._buffers[key]
+        events = []
+        for device in devices:
+            event = torch.cuda.Event()
+            event.record(torch.cuda.current_stream(device))
+            events.append(event)
+        return snapshot, events
+
+    def _write(self, step: int, snapshot: Dict[str, torch.Tensor], structure: Dict[str, Any], events: List[Any]) -> None:
+        try:
+            start = time.perf_counter()
+            for event in events:
+                event.synchronize()
+            tmp_dir = os.path.join(self.checkpoint_dir, self.step_dir_name(step) + ".tmp")
+            os.makedirs(tmp_dir, exist_ok=True)
+            prefix = os.path.join(tmp_dir, f"rank_{self.rank:05d}")
+            save_file(snapshot, prefix + ".safetensors")
+            with open(prefix + ".pkl", "wb") as f:
+                pickle.dump(structure, f)
+                f.flush()
+                os.fsync(f.fileno())
+            # The marker is written last: its presence means this rank's files are complete
+            with open(prefix + ".done", "w") as f:
+                f.flush()
+                os.fsync(f.fileno())
+            if self.rank == 0:
+                self._commit(step, tmp_dir)
+            else:
+                self._wait_for_commit(step, tmp_dir)
+            self.last_write_time = time.perf_counter() - start
+        except BaseException as error:
+            self._error = error
+
+    def _commit(self, step: int, tmp_dir: str) -> None:
+        markers = [os.path.join(tmp_dir, f"rank_{rank:05d}.done") for rank in range(self.world_size)]
+        deadline = time.monotonic() + self.commit_timeout
+        while not all(os.path.exists(marker) for marker in markers):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Not all ranks wrote their checkpoint files in {tmp_dir}")
+            time.sleep(0.05)
+        for marker in markers:
+            os.remove(marker)
+        final_dir = os.path.join(self.checkpoint_dir, self.step_dir_name(step))
+        if os.path.exists(final_dir):
+            shutil.rmtree(final_dir)
+        os.rename(tmp_dir, final_dir)
+        dir_fd = os.open(self.checkpoint_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+        if self.keep_last is not None:
+            for old_step in self.committed_steps()[:-self.keep_last]:
+                shutil.rmtree(os.path.join(self.checkpoint_dir, self.step_dir_name(old_step)), ignore_errors=True)
+        # Leftovers of interrupted saves of earlier steps
+        for name in os.listdir(self.checkpoint_dir):
+            match = _STEP_DIR.match(name[:-len(".tmp")]) if name.endswith(".tmp") else None
+            if match and int(match.group(1)) < step:
+                shutil.rmtree(os.path.join(self.checkpoint_dir, name), ignore_errors=True)
+
+    def _wait_for_commit(self, step: int, tmp_dir: str) -> None:
+        # Rank 0 renames the temporary directory once every rank's files are written
+        final_dir = os.path.join(self.checkpoint_dir, self.step_dir_name(step))
+        deadline = time.monotonic() + self.commit_timeout
+        while os.path.exists(tmp_dir) or not os.path.isdir(final_dir):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Rank 0 did not commit the checkpoint {tmp_dir}")
+            time.sleep(0.05)
+
+    def wait(self) -> None:
+        """Blocks until the pending save is written and committed."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Writing the checkpoint failed") from error
+
+    def load(self, step: Optional[int] = None, model: Any = None, optimizer: Any = None, scheduler: Any = None,
+             dataset: Any = None, map_location: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Loads a committed checkpoint into the given components.
+
+        Args:
+            step: Step of the checkpoint. Defaults to the latest one.
+            model, optimizer, scheduler, dataset: Objects with a `load_state_dict()` method, or None.
+            map_location: Device the optimizer, scheduler and dataset tensors are moved to. Defaults
+                          to the device they were saved from. Model tensors are copied into the
+                          parameters by `load_state_dict`, wherever they are.
+
+        Returns:
+            {"step", "extra"} of the checkpoint, or None if there is no checkpoint.
+        """
+        if step is None:
+            step = self.latest_step()
+            if step is None:
+                return None
+        step_dir = os.path.join(self.checkpoint_dir, self.step_dir_name(step))
+        if not os.path.isdir(step_dir):
+            raise FileNotFoundError(f"No committed checkpoint for step {step} in {self.checkpoint_dir}")
+
+        files: Dict[int, Tuple[Dict[str, Any], Dict[str, torch.Tensor]]] = {}
+
+        def read(rank: int) -> Tuple[Dict[str, Any], Dict[str, torch.Tensor]]:
+            if rank not in files:
+                prefix = os.path.join(step_dir, f"rank_{rank:05d}")
+                if not os.path.exists(prefix + ".pkl"):
+                    raise FileNotFoundError(f"{step_dir} has no files for rank {rank}, was it saved with another world size?")
+                with open(prefix + ".pkl", "rb") as f:
+                    files[rank] = (pickle.load(f), load_file(prefix + ".safetensors"))
+            return files[rank]
+
+        per_rank = read(self.rank)[0].get("per_rank", [])
+        components = {"model": model, "optimizer": optimizer, "scheduler": scheduler, "dataset": dataset}
+        for name, component in components.items():
+            if component is None:
+                continue
+            structure, tensors = read(0 if name in self.replicated and name not in per_rank else self.rank)
+            if name not in structure:
+                raise KeyError(f"The checkpoint of step {step} has no {name} state")
+            if name != "model":
+                tensors = self._to_devices(structure[name], tensors, map_location)
+            # The current DTensors give the layout of the saved shards; optimizer states that do
+            # not exist yet take the layout of their parameter
+            dtensors: Dict[str, torch.Tensor] = {}
+            if isinstance(component, torch.optim.Optimizer):
+                params = [p for group in component.param_groups for p in group["params"]]
+                _flatten({"state": dict(enumerate(params))}, name, {}, dtensors)
+            _flatten(component.state_dict(), name, {}, dtensors)
+            component.load_state_dict(_unflatten(structure[name], tensors, dtensors))
+        structure, _ = read(self.rank)
+        return {"step": structure["step"], "extra": structure["extra"]}
+
+    @staticmethod
+    def _to_devices(structure: Any, tensors: Dict[str, torch.Tensor], map_location: Optional[str]) -> Dict[str, torch.Tensor]:
+        refs: List[_TensorRef] = []
+
+        def collect(obj: Any) -> None:
+            if isinstance(obj, _TensorRef):
+                refs.append(obj)
+            elif isinstance(obj, dict):
+                for value in obj.values():
+                    collect(value)
+            elif isinstance(obj, (list, tuple)):
+                for value in obj:
+                    collect(value)
+
+        collect(structure)
+        moved = dict(tensors)
+        for ref in refs:
+            device = map_location or ref.device
+            if device != "cpu":
+                moved[ref.key] = tensors[ref.key].to(device)
+        return moved
@@ -0,0 +1,30 @@
+import os
+from typing import Tuple
+
+import torch.distributed as dist
+from torch.utils.data import get_worker_info
+
+
+def get_rank_and_world_size() -> Tuple[int, int]:
+    """
+    Returns the (rank, world_size) of the current process.
+
+    Uses the default process group when it is initialized, and otherwise falls back
+    to the `RANK` / `WORLD_SIZE` environment variables set by `torchrun` (0 and 1 if unset).
+    """
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return int(os.environ.get("RANK", 0)), int(os.environ.get("WORLD_SIZE", 1))
+
+
+def get_data_shard() -> Tuple[int, int]:
+    """
+    Returns the (index, num_shards) of the data shard the current DataLoader worker should read.
+
+    Every DataLoader worker on every rank gets its own shard:
+    `index = rank * num_workers + worker_id` and `num_shards = world_size * num_workers`.
+    """
+    rank, world_size = get_rank_and_world_size()
+    worker_info = get_worker_info()
+    worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+    return rank * num_workers + worker_id, world_size * num_workers
@@ -0,0 +1,352 @@
+"""
+Lazy registry of the components configured under `configs/`.
+
+Every config group (optimizers, schedulers, criteria, ...) maps to its config directory and to
+the `*Template` protocol(s) its components implement. Nothing is imported until a component is
+resolved or instantiated: listing, loading and validating configs only parse YAML and Python
+source files, so they take milliseconds even for components depending on `transformers` or
+`datasets`.
+
+Usage:
+    python -m utils.registry                     # lists the configs of every group
+    python -m utils.registry --validate          # checks every config against its protocol
+    python -m utils.registry --time-to-first-step
+"""
+import argparse
+import ast
+import copy
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Hydra keys that are not arguments of the target
+_SPECIAL_KEYS = {"_target_", "_partial_", "_args_", "_recursive_", "_convert_"}
+
+
+class Group(NamedTuple):
+    config_dir: str
+    # "module:Class" of the protocols; a component must satisfy one of them
+    templates: Tuple[str, ...]
+
+
+GROUPS: Dict[str, Group] = {
+    "optimizers": Group("configs/training/optimizers", ("training.optimizers._template:OptimizerTemplate",)),
+    "schedulers": Group("configs/training/schedulers", ("training.schedulers._template:SchedulerTemplate",)),
+    "criteria": Group("configs/training/criteria", ("training.criteria._template:Criterion",)),
+    "loggers": Group("configs/training/loggers", ("training.loggers._template:LoggerTemplate",)),
+    "initializers": Group("configs/modeling/initializers", ("modeling.initializers._template:InitializerTemplate",)),
+    "models": Group("configs/modeling/models", ("modeling.models._template:ModelTemplate",)),
+    "tokenizers": Group("configs/modeling/tokenizers", ("modeling.tokenizers._template:TokenizerTemplate",)),
+    "wrappers": Group("configs/modeling/wrappers", ("modeling.wrappers._template:WrapperTemplate",)),
+    "datasets": Group("configs/data/datasets", (
+        "data.datasets._template:MapDatasetTemplate",
+        "data.datasets._template:IterableDatasetTemplate",
+    )),
+    "collate_fns": Group("configs/data/collate_fns", ("data.collate_fns._template:CollateFnTemplate",)),
+    "loaders": Group("configs/data/loaders", ("data.loaders._template:LoaderTemplate",)),
+}
+
+
+class _ClassInfo(NamedTuple):
+    # Methods, class attributes and attributes assigned to `self`, including inherited ones
+    members: Set[str]
+    # Parameters of `__init__` (without `self`), None if it is defined outside of the repository
+    init_params: Optional[List[str]]
+    init_has_kwargs: bool
+    # Whether some base class is defined outside of the repository, so members may be missing
+    has_external_base: bool
+
+
+class Registry:
+    """
+    Maps config groups to lazily imported implementations.
+
+    `config` loads a YAML config once per file version (keyed by modification time) and
+    returns a copy of the cached config. `validate` checks, from the source code only, that the
+    `_target_` of a config exists and defines every member of the group's protocol, and that the
+    config keys are arguments of its `__init__`. Members inherited from classes outside of the
+    repository (e.g. `torch.optim.AdamW`) cannot be checked statically and are assumed present.
+    `resolve` and `instantiate` import the target.
+    """
+    def __init__(self, root: str = ROOT, groups: Optional[Dict[str, Group]] = None):
+        """
+        Args:
+            root: Repository root, holding `configs/` and the packages.
+            groups: Config groups. Defaults to `GROUPS`.
+        """
+        self.root = root
+        self.groups = GROUPS if groups is None else groups
+        self._configs: Dict[str, Tuple[int, Any]] = {}
+        self._modules: Dict[str, Tuple[int, Optional[ast.Module]]] = {}
+
+    def _group(self, group: str) -> Group:
+        if group not in self.groups:
+            raise KeyError(f"Unknown config group {group}, expected one of {sorted(self.groups)}")
+        return self.groups[group]
+
+    def names(self, group: str) -> List[str]:
+        """Returns the names of the configs of a group."""
+        config_dir = os.path.join(self.root, self._group(group).config_dir)
+        return sorted(name[:-len(".yaml")] for name in os.listdir(config_dir) if name.endswith(".yaml"))
+
+    def config_path(self, group: str, name: str) -> str:
+        path = os.path.join(self.root, self._group(group).config_dir, f"{name}.yaml")
+        if not os.path.exists(path):
+            raise KeyError(f"No config {name} in group {group}, expected one of {self.names(group)}")
+        return path
+
+    def config(self, group: str, name: str) -> Any:
+        """Returns a copy of the (cached) `DictConfig` of a config."""
+        from omegaconf import OmegaConf
+
+        path = self.config_path(group, name)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._configs.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, OmegaConf.load(path))
+            self._configs[path] = cached
+        return copy.deepcopy(cached[1])
+
+    def target(self, group: str, name: str) -> str:
+        """Returns the `_target_` of a config, without importing it."""
+        target = self.config(group, name).get("_target_")
+        if target is None:
+            raise ValueError(f"Config {group}/{name} has no _target_")
+        return target
+
+    def resolve(self, group: str, name: str) -> Any:
+        """Imports and returns the `_target_` of a config."""
+        from hydra.utils import get_object
+        return get_object(self.target(group, name))
+
+    def instantiate(self, group: str, name: str, *args: Any, **kwargs: Any) -> Any:
+        """
+        Instantiates a config with `hydra.utils.instantiate`, which imports its target.
+
+        Args:
+            group: Config group.
+            name: Config name.
+            *args: Positional arguments of the target (e.g. the parameters of an optimizer).
+            **kwargs: Arguments overriding or completing the config.
+        """
+        from hydra.utils import instantiate
+        return instantiate(self.config(group, name), *args, **kwargs)
+
+    def _source(self, module: str) -> Optional[ast.Module]:
+        """Parses a module of the repository, None if it is not in the repository."""
+        base = os.path.join(self.root, *module.split("."))
+        for path in (base + ".py", os.path.join(base, "__init__.py")):
+            if os.path.exists(path):
+                break
+        else:
+            return None
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._modules.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path) as f:
+                cached = (mtime, ast.parse(f.read(), path))
+            self._modules[path] = cached
+        return cached[1]
+
+    @staticmethod
+    def _imports(tree: ast.Module, module: str) -> Dict[str, str]:
+        """Maps the names imported by a module to "module.name"."""
+        package = module.rsplit(".", 1)[0] if "." in module else ""
+        names = {}
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom):
+                source = node.module or ""
+                if node.level:
+                    parent = package.rsplit(".", node.level - 1)[0] if node.level > 1 else package
+                    source = f"{parent}.{source}" if source else parent
+                for alias in node.names:
+                    names[alias.asname or alias.name] = f"{source}.{alias.name}"
+            elif isinstance(node, ast.Import):
+                for alias in node.names:
+                    names[alias.asname or alias.name.split(".")[0]] = alias.name if alias.asname else alias.name.split(".")[0]
+        return names
+
+    def _class_info(self, module: str, name: str, seen: Optional[Set[str]] = None) -> Optional[_ClassInfo]:
+        """Collects the members of a class of the repository, None if it is not found."""
+        seen = set() if seen is None else seen
+        if f"{module}:{name}" in seen:
+            return None
+        seen.add(f"{module}:{name}")
+        tree = self._source(module)
+        if tree is None:
+            return None
+        node = next((n for n in tree.body if isinstance(n, ast.ClassDef) and n.name == name), None)
+        if node is None:
+            # Re-exported from another module of the repository
+            imported = self._imports(tree, module).get(name)
+            if imported is None or "." not in imported:
+                return None
+            return self._class_info(*imported.rsplit(".", 1), seen)
+
+        members: Set[str] = set()
+        init = None
+        for item in node.body:
+            if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                members.add(item.name)
+                if item.name == "__init__":
+                    init = item
+                for sub in ast.walk(item):
+                    if (isinstance(sub, ast.Attribute) and isinstance(sub.value, ast.Name)
+                            and sub.value.id == "self" and isinstance(sub.ctx, ast.Store)):
+                        members.add(sub.attr)
+            elif isinstance(item, ast.AnnAssign) and isinstance(item.target, ast.Name):
+                members.add(item.target.id)
+            elif isinstance(item, ast.Assign):
+                members.update(t.id for t in item.targets if isinstance(t, ast.Name))
+
+        has_external_base = False
+        inherited: List[_ClassInfo] = []
+        imports = self._imports(tree, module)
+        for base in node.bases:
+            base_name = ast.unparse(base)
+            if base_name in ("object", "Protocol") or base_name.startswith(("Protocol[", "Generic[")):
+                continue
+            head, _, rest = base_name.partition(".")
+            if any(isinstance(n, ast.ClassDef) and n.name == base_name for n in tree.body):
+                qualified = f"{module}.{base_name}"
+            else:
+                qualified = imports.get(head, head) + (f".{rest}" if rest else "")
+            info = self._class_info(*qualified.rsplit(".", 1), seen) if "." in qualified else None
+            if info is None:
+                has_external_base = True
+            else:
+                inherited.append(info)
+                has_external_base |= info.has_external_base
+
+        for info in inherited:
+            members |= info.members
+        if init is not None:
+            args = init.args
+            params = [a.arg for a in args.posonlyargs + args.args + args.kwonlyargs][1:]
+            init_params, init_has_kwargs = params, args.kwarg is not None
+        else:
+            # Nearest base defining it, if known
+            base_init = next((info for info in inherited if info.init_params is not None), None)
+            if base_init is not None:
+                init_params, init_has_kwargs = base_init.init_params, base_init.init_has_kwargs
+            elif has_external_base:
+                init_params, init_has_kwargs = None, True
+            else:
+                init_params, init_has_kwargs = [], False
+        return _ClassInfo(members, init_params, init_has_kwargs, has_external_base)
+
+    def _protocol_members(self, template: str) -> Set[str]:
+        module, name = template.split(":")
+        info = self._class_info(module, name)
+        if info is None:
+            raise ValueError(f"Protocol {template} not found")
+        return {m for m in info.members if m != "__init__"}
+
+    def validate(self, group: str, name: str) -> List[str]:
+        """
+        Checks a config against the protocols of its group, without importing anything.
+
+        Returns:
+            The problems found, empty if the config is valid.
+        """
+        config = self.config(group, name)
+        target = config.get("_target_")
+        if target is None:
+            return ["no _target_"]
+        if "." not in target:
+            return [f"_target_ {target} is not a module attribute"]
+        module, attr = target.rsplit(".", 1)
+        tree = self._source(module)
+        if tree is None:
+            if os.path.exists(os.path.join(self.root, module.split(".")[0])):
+                return [f"module {module} of _target_ {target} does not exist"]
+            # Outside of the repository (e.g. torch.optim.AdamW)
+            return []
+        info = self._class_info(module, attr)
+        problems = []
+        if info is None:
+            function = next((n for n in tree.body if isinstance(n, ast.FunctionDef) and n.name == attr), None)
+            if function is None:
+                return [f"{target} is not defined"]
+            args = function.args
+            params = [a.arg for a in args.posonlyargs + args.args + args.kwonlyargs]
+            info = _ClassInfo({"__call__"}, params, args.kwarg is not None, False)
+        elif not info.has_external_base:
+            missing = [
+                sorted(self._protocol_members(template) - info.members) for template in self._group(group).templates
+            ]
+            if all(missing):
+                protocols = " or ".join(t.split(":")[1] for t in self._group(group).templates)
+                problems.append(f"{target} does not implement {protocols}: missing {min(missing, key=len)}")
+        if info.init_params is not None and not info.init_has_kwargs:
+            unknown = sorted(set(config) - _SPECIAL_KEYS - set(info.init_params))
+            if unknown:
+                problems.append(f"{target} has no arguments {unknown}")
+        return problems
+
+    def validate_all(self, groups: Optional[Sequence[str]] = None) -> Dict[str, List[str]]:
+        """Validates every config of the given groups (default: all), returns "group/name" -> problems."""
+        return {
+            f"{group}/{name}": problems
+            for group in (groups or sorted(self.groups))
+            for name in self.names(group)
+            if (problems := self.validate(group, name))
+        }
+
+
+def time_to_first_step(model: str = "gpt", optimizer: str = "adamw", scheduler: str = "constant",
+                       criterion: str = "cross_entropy", vocab_size: int = 1024, seq_len: int = 128) -> float:
+    """
+    Measures, in a fresh interpreter, the time from the interpreter start to the end of the
+    first training step of a small model instantiated from the given configs (on CPU).
+    """
+    code = f"""
+import torch
+from utils.registry import Registry
+registry = Registry()
+model = registry.instantiate("models", {model!r}, vocab_size={vocab_size}, d_model=64, n_layers=2, n_heads=4)
+optimizer = registry.instantiate("optimizers", {optimizer!r}, model.named_parameters())
+scheduler = registry.instantiate("schedulers", {scheduler!r}, optimizer)
+criterion = registry.instantiate("criteria", {criterion!r}, target_key="target")
+tokens = torch.randint(0, {vocab_size}, (2, {seq_len} + 1))
+data = {{"input": {{"input_ids": tokens[:, :-1]}}, "target": tokens[:, 1:].flatten()}}
+logits = model(**data["input"])
+criterion(data, logits.flatten(0, 1), "train")["loss"].backward()
+optimizer.step()
+scheduler.step()
+"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+    return time.perf_counter() - start
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--group", action="append", default=None, help="Only this config group (repeatable)")
+    parser.add_argument("--validate", action="store_true", help="Check the configs against their protocols")
+    parser.add_argument("--time-to-first-step", action="store_true",
+                        help="Measure the startup time up to the end of a first training step")
+    args = parser.parse_args(argv)
+
+    registry = Registry()
+    if args.time_to_first_step:
+        print(f"Time to first step: {time_to_first_step():.2f}s")
+    elif args.validate:
+        start = time.perf_counter()
+        problems = registry.validate_all(args.group)
+        for config, config_problems in problems.items():
+            for problem in config_problems:
+                print(f"{config}: {problem}")
+        print(f"Validated in {time.perf_counter() - start:.3f}s, {len(problems)} invalid configs")
+        if problems:
+            sys.exit(1)
+    else:
+        for group in args.group or sorted(registry.groups):
+            print(f"{group}: {', '.join(registry.names(group))}")
+
+
+if __name__ == "__main__":
+    main()